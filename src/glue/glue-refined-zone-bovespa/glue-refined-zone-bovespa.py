@@ -1,14 +1,27 @@
 import awswrangler as wr
 import boto3
 import sys
+import json
+import hashlib
 import logging
-from typing import Dict, List
-from pyspark.sql import DataFrame, SparkSession, functions as sf
+import math
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from pyspark.sql import DataFrame, Observation, SparkSession, Window, functions as sf
+from pyspark.sql.types import DateType, DecimalType, IntegerType, LongType, StringType, StructField, StructType
+from pyspark.sql.utils import AnalysisException
 from pyspark.context import SparkContext
-from awsglue.context import GlueContext
-from awsglue.utils import getResolvedOptions
-from awsglue.job import Job
+from pyspark.storagelevel import StorageLevel
+try:
+    from awsglue.context import GlueContext
+    from awsglue.utils import getResolvedOptions
+    from awsglue.job import Job
+except ImportError:
+    # Bibliotecas do Glue ausentes: permite importar as transformações em testes e execuções locais
+    GlueContext = getResolvedOptions = Job = None
 from botocore.exceptions import ClientError
+# Módulo compartilhado (src/shared), enviado ao job em --extra-py-files
+import instrumentation
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO)
@@ -25,11 +38,201 @@ REQUIRED_PARAMS: List[str] = [
     'AWS_REGION'
 ]
 
+# Parâmetros opcionais do job e seus valores padrão
+OPTIONAL_PARAMS: Dict[str, str] = {
+    'DATA_QUALITY_CHECKS': 'true',
+    'INCREMENTAL': 'false',
+    'WATERMARK_KEY': '',
+    'START_DATE': '',
+    'END_DATE': '',
+    'CATALOG_MODE': 'partitions',
+    'MAX_RECORDS_PER_FILE': '0',
+    'TARGET_FILE_SIZE_MB': '128',
+    'COMPACT_PREFIX': '',
+    'PARTITIONS': '',
+    'FEATURES': 'false',
+    'FEATURES_TABLE_NAME': '',
+    'FEATURES_OUTPUT_PREFIX': '',
+    'SORT_COLUMNS': 'nom_empresa',
+    'ROW_GROUP_SIZE_MB': '',
+    'BLOOM_FILTER_COLUMNS': '',
+    'RAW_SCHEMA': 'auto',
+    'PARALLELISM_PROFILE': 'auto',
+    'STAGE_METRICS': 'false',
+    'STAGE_METRICS_FORMAT': 'json',
+    'CORRELATION_ID': '',
+    'MIGRATE_PARTITION_KEYS': 'false'
+}
+
+# Componente das métricas por etapa do job (ver src/shared/instrumentation.py)
+STAGE_METRICS_COMPONENT = "glue-refined-zone-bovespa"
+
+# Modos de catalogação: 'partitions' registra apenas as partições gravadas; 'msck' executa MSCK REPAIR TABLE;
+# 'none' apenas grava os dados, sem tocar no catálogo (execuções locais e reprocessamentos)
+CATALOG_MODES: List[str] = ['partitions', 'msck', 'none']
+
+# Esquemas da camada raw: 'typed' (numéricos convertidos na extração), 'legacy' (partições gravadas
+# antes da conversão, com todos os campos como string) ou 'auto' (detectado por partição e convertido para 'typed')
+RAW_SCHEMAS: List[str] = ['auto', 'typed', 'legacy']
+
+# Perfis de paralelismo: 'auto' dimensiona o shuffle pelo número de partições raw lidas e liga o AQE;
+# 'spark' mantém as configurações do cluster (200 partições de shuffle)
+PARALLELISM_PROFILES: List[str] = ['auto', 'spark']
+
+# Perfil 'auto': partições raw (dia/índice) por partição de shuffle além do paralelismo do cluster,
+# limite de partições de shuffle e tamanho alvo das partições após o coalesce do AQE
+RAW_PARTITIONS_PER_SHUFFLE_PARTITION = 4
+MAX_SHUFFLE_PARTITIONS = 400
+ADVISORY_PARTITION_SIZE = "64m"
+
+# Raiz local que substitui o S3 nos caminhos lidos e gravados pelo Spark (execução local do pipeline).
+# None (padrão) usa s3://bucket/chave.
+LOCAL_STORAGE_ROOT: Optional[str] = None
+
+# Limite de partições por chamada do glue.batch_create_partition
+GLUE_PARTITION_BATCH_SIZE = 100
+
+# Limite de partições por chamada do glue.batch_delete_partition
+GLUE_DELETE_PARTITION_BATCH_SIZE = 25
+
+# Campos de Partition aceitos em PartitionInput pelo glue.update_partition
+PARTITION_INPUT_KEYS: List[str] = ['Values', 'LastAccessTime', 'StorageDescriptor', 'Parameters', 'LastAnalyzedTime']
+
+# Chave de partição incluída nas tabelas refinada e de features junto com a partição raw index=
+INDEX_PARTITION_KEY = "cod_indice"
+
+# Limite de chaves por chamada do s3.delete_objects
+S3_DELETE_BATCH_SIZE = 1000
+
+# Parâmetro da tabela atualizado a cada escrita catalogada: sinal barato de novas partições lido pelo
+# cache de consultas (refined_zone_query.table_watermark), sem listar as partições
+LAST_WRITE_PARAMETER = "last_write_at"
+
+# Campos do get_table aceitos de volta no TableInput do update_table
+TABLE_INPUT_KEYS: List[str] = [
+    'Name', 'Description', 'Owner', 'Retention', 'StorageDescriptor', 'PartitionKeys',
+    'ViewOriginalText', 'ViewExpandedText', 'TableType', 'Parameters', 'TargetTable'
+]
+
+# Caracteres escapados pelo Spark/Hive nos nomes de diretório de partição (ExternalCatalogUtils.escapePathName)
+SPARK_ESCAPED_CHARS = set('"#%\'*/:=?\\\x7f{[]^') | {chr(code) for code in range(0x01, 0x20)}
+
+RAW_PARTITION_KEYS: List[str] = ["year", "month", "day"]
+
+# Partição raw (abaixo do dia) com o índice da B3 consultado pela extração
+RAW_INDEX_COLUMN = "index"
+
+# Índice atribuído às partições gravadas antes da coluna 'index' (a extração consultava apenas o IBOV)
+DEFAULT_INDEX = "IBOV"
+
+REFINED_PARTITION_KEYS: List[str] = ["year", "month", "day", "cod_indice", "nom_setor"]
+
 EXPECTED_COLUMNS: List[str] = [
     "results_segment", "results_asset", "results_cod", "results_type",
     "results_theoricalQty", "results_part", "results_partAcum", "header_date"
 ]
 
+# Campos numéricos convertidos do formato brasileiro ('2,802', '1.482.105.837') já na extração
+RAW_DECIMAL_COLUMNS: List[str] = ["results_part", "results_partAcum"]
+RAW_INTEGER_COLUMNS: List[str] = ["results_theoricalQty"]
+RAW_DECIMAL_TYPE: DecimalType = DecimalType(9, 3)
+
+# Janelas (em pregões) das médias móveis por ação
+FEATURE_WINDOWS: List[int] = [5, 20]
+
+# Dias corridos lidos da tabela de features para completar a maior janela (20 pregões com feriados)
+FEATURES_LOOKBACK_DAYS = 40
+
+FEATURES_PARTITION_KEYS: List[str] = ["year", "month", "day", "cod_indice"]
+
+# Ordenação dentro das partições da tabela de features (filtro mais comum: a ação)
+FEATURES_SORT_COLUMNS: List[str] = ["cod_acao"]
+
+# Cardinalidade esperada por row group usada no dimensionamento dos bloom filters do Parquet (~1,2 KB com fpp de 1%)
+BLOOM_FILTER_EXPECTED_NDV = 1000
+
+# Colunas da tabela de features reaproveitadas como histórico das janelas
+FEATURES_HISTORY_SCHEMA: StructType = StructType([
+    StructField("cod_acao", StringType(), True),
+    StructField("nom_empresa", StringType(), True),
+    StructField("nom_setor", StringType(), True),
+    StructField("qtd_teorica", LongType(), True),
+    StructField("perc_participacao_setor", DecimalType(5, 3), True),
+    StructField("data_ref", DateType(), True)
+] + [StructField(column, IntegerType(), True) for column in RAW_PARTITION_KEYS] + [
+    StructField("cod_indice", StringType(), True)
+])
+
+REFINED_CATALOG_COLUMNS: List[Dict[str, str]] = [
+    {'Name': 'nom_empresa', 'Type': 'string'},
+    {'Name': 'qtd_registros', 'Type': 'bigint'},
+    {'Name': 'qtd_acao', 'Type': 'bigint'},
+    {'Name': 'qtd_tipos_acao', 'Type': 'bigint'},
+    {'Name': 'qtd_teorica_acumulada', 'Type': 'bigint'},
+    {'Name': 'qtd_teorica_max', 'Type': 'bigint'},
+    {'Name': 'qtd_teorica_min', 'Type': 'bigint'},
+    {'Name': 'qtd_dias_atraso', 'Type': 'int'},
+    {'Name': 'avg_participacao_setor_total', 'Type': 'decimal(9,7)'},
+    {'Name': 'avg_participacao_setor_acumulada_total', 'Type': 'decimal(9,7)'},
+    {'Name': 'data_ref', 'Type': 'date'},
+    {'Name': 'dth_etl_processamento', 'Type': 'timestamp'},
+]
+
+REFINED_CATALOG_PARTITIONS: List[Dict[str, str]] = [
+    {'Name': 'year', 'Type': 'int'},
+    {'Name': 'month', 'Type': 'int'},
+    {'Name': 'day', 'Type': 'int'},
+    {'Name': 'cod_indice', 'Type': 'string'},
+    {'Name': 'nom_setor', 'Type': 'string'}
+]
+
+FEATURES_CATALOG_COLUMNS: List[Dict[str, str]] = [
+    {'Name': 'cod_acao', 'Type': 'string'},
+    {'Name': 'nom_empresa', 'Type': 'string'},
+    {'Name': 'nom_setor', 'Type': 'string'},
+    {'Name': 'qtd_teorica', 'Type': 'bigint'},
+    {'Name': 'perc_participacao_setor', 'Type': 'decimal(5,3)'},
+    {'Name': 'data_ref_anterior', 'Type': 'date'},
+    {'Name': 'qtd_teorica_var_dia', 'Type': 'bigint'},
+    {'Name': 'perc_qtd_teorica_var_dia', 'Type': 'double'},
+    {'Name': 'perc_participacao_var_dia', 'Type': 'decimal(6,3)'},
+] + [
+    column for window in FEATURE_WINDOWS for column in (
+        {'Name': f'avg_qtd_teorica_{window}d', 'Type': 'double'},
+        {'Name': f'avg_participacao_setor_{window}d', 'Type': 'decimal(9,7)'},
+        {'Name': f'qtd_pregoes_{window}d', 'Type': 'int'},
+    )
+] + [
+    {'Name': 'data_ref', 'Type': 'date'},
+    {'Name': 'dth_etl_processamento', 'Type': 'timestamp'},
+]
+
+FEATURES_CATALOG_PARTITIONS: List[Dict[str, str]] = [
+    {'Name': key, 'Type': 'int'} for key in RAW_PARTITION_KEYS
+] + [{'Name': 'cod_indice', 'Type': 'string'}]
+
+def raw_column_type(column: str, raw_schema: str = 'typed'):
+    """Tipo Spark da coluna raw no esquema informado (RAW_SCHEMAS); 'auto' resulta nos tipos de 'typed'."""
+    if raw_schema != 'legacy' and column in RAW_DECIMAL_COLUMNS:
+        return RAW_DECIMAL_TYPE
+    if raw_schema != 'legacy' and column in RAW_INTEGER_COLUMNS:
+        return LongType()
+    return StringType()
+
+def raw_read_schema(raw_schema: str = 'typed') -> StructType:
+    """
+    Esquema explícito de leitura da camada raw: apenas as colunas usadas + colunas de partição.
+    Evita a inferência pelos footers dos arquivos e projeta somente essas colunas no scan.
+    """
+    return StructType(
+        [StructField(column, raw_column_type(column, raw_schema), True) for column in EXPECTED_COLUMNS] +
+        [StructField(column, IntegerType(), True) for column in RAW_PARTITION_KEYS] +
+        [StructField(RAW_INDEX_COLUMN, StringType(), True)]
+    )
+
+RAW_READ_SCHEMA: StructType = raw_read_schema('typed')
+LEGACY_RAW_READ_SCHEMA: StructType = raw_read_schema('legacy')
+
 def validate_params(args: Dict[str, str]) -> None:
     """
     Valida se todos os parâmetros obrigatórios foram fornecidos.
@@ -39,6 +242,62 @@ def validate_params(args: Dict[str, str]) -> None:
         logger.error(f"Parâmetros obrigatórios ausentes: {missing}")
         raise ValueError(f"Parâmetros obrigatórios ausentes: {missing}")
 
+def resolve_optional_params(argv: List[str], defaults: Dict[str, str] = OPTIONAL_PARAMS) -> Dict[str, str]:
+    """
+    Resolve os parâmetros opcionais do job, usando o valor padrão quando '--PARAM' não foi informado.
+    """
+    present = [param for param in defaults if f"--{param}" in argv]
+    resolved = getResolvedOptions(argv, present) if present else {}
+    return {param: resolved.get(param, default) for param, default in defaults.items()}
+
+def is_enabled(value: str) -> bool:
+    """
+    Interpreta um parâmetro booleano do job ('true'/'false').
+    """
+    return str(value).strip().lower() in ("true", "1", "yes", "sim")
+
+class JobMetrics:
+    """
+    Coleta as métricas de qualidade e volumetria do job em uma única passada sobre os dados,
+    usando Observation do Spark: os valores são calculados durante a escrita, sem ações count() extras.
+    Com enabled=False nenhuma métrica é registrada (modo de produção sem checagens).
+    """
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._observations: Dict[str, Observation] = {}
+
+    def observe(self, df: DataFrame, name: str, *exprs) -> DataFrame:
+        """
+        Anexa as expressões de métrica ao plano do DataFrame.
+        """
+        if not self.enabled:
+            return df
+        observation = Observation(name)
+        self._observations[name] = observation
+        return df.observe(observation, *exprs)
+
+    def to_dict(self) -> Dict[str, int]:
+        """
+        Retorna as métricas coletadas. Deve ser chamado somente após a ação de escrita.
+        """
+        metrics: Dict[str, int] = {}
+        for observation in self._observations.values():
+            metrics.update({key: int(value or 0) for key, value in observation.get.items()})
+        if "input_rows" in metrics and "processed_rows" in metrics:
+            metrics["dropped_rows"] = metrics["input_rows"] - metrics["processed_rows"]
+        return metrics
+
+    def log(self) -> Dict[str, int]:
+        """
+        Loga as métricas em JSON estruturado e as retorna.
+        """
+        if not self.enabled:
+            logger.info("Métricas de qualidade desabilitadas (DATA_QUALITY_CHECKS=false).")
+            return {}
+        metrics = self.to_dict()
+        logger.info(json.dumps({"data_quality_metrics": metrics}))
+        return metrics
+
 def validate_schema(df: DataFrame, expected_columns: List[str]) -> None:
     """
     Valida se o DataFrame possui todas as colunas esperadas.
@@ -48,30 +307,334 @@ def validate_schema(df: DataFrame, expected_columns: List[str]) -> None:
         logger.error(f"Colunas esperadas ausentes: {missing}")
         raise ValueError(f"Colunas esperadas ausentes: {missing}")
 
-def read_data(spark: SparkSession, s3_bucket: str, object_key: str) -> DataFrame:
+def partition_date_filter(start_date: Optional[str] = None, end_date: Optional[str] = None):
+    """
+    Monta o filtro de intervalo de datas sobre as colunas de partição year/month/day.
+    Por referenciar apenas colunas de partição, o Spark o aplica como PartitionFilter (poda de diretórios).
+    """
+    for value in (start_date, end_date):
+        if value:
+            date.fromisoformat(value)
+    if not start_date and not end_date:
+        return None
+    partition_date = sf.make_date("year", "month", "day")
+    conditions = []
+    if start_date:
+        conditions.append(partition_date >= sf.to_date(sf.lit(start_date)))
+    if end_date:
+        conditions.append(partition_date <= sf.to_date(sf.lit(end_date)))
+    condition = conditions[0]
+    for other in conditions[1:]:
+        condition = condition & other
+    return condition
+
+def s3_uri(bucket: str, key: str = "") -> str:
+    """
+    Monta o caminho lido ou gravado pelo Spark para a chave do bucket: s3://bucket/chave ou,
+    com LOCAL_STORAGE_ROOT definido, o diretório equivalente no disco local.
+    """
+    if LOCAL_STORAGE_ROOT:
+        return f"file://{LOCAL_STORAGE_ROOT.rstrip('/')}/{bucket}/{key}"
+    return f"s3://{bucket}/{key}"
+
+def hadoop_glob(spark: SparkSession, pattern: str) -> List[str]:
+    """
+    Caminhos que casam com o glob no sistema de arquivos do Hadoop usado pelo Spark (s3:// no Glue, file:// localmente).
+    Lista apenas os níveis de diretório do padrão, sem ler os arquivos.
+    """
+    path = spark._jvm.org.apache.hadoop.fs.Path(pattern)
+    statuses = path.getFileSystem(spark._jsc.hadoopConfiguration()).globStatus(path)
+    return sorted(status.getPath().toString() for status in (statuses or []))
+
+def glob_parquet_files(spark: SparkSession, pattern: str) -> List[str]:
+    """Arquivos Parquet que casam com o glob, sem os arquivos auxiliares (_SUCCESS, .crc etc.)."""
+    return [path for path in hadoop_glob(spark, pattern) if not path.rsplit("/", 1)[1].startswith(("_", "."))]
+
+def list_raw_layouts(spark: SparkSession, base_path: str, day_patterns: List[str]) -> Dict[str, List[str]]:
+    """
+    Lista os arquivos Parquet da raw nos diretórios de dia (padrões year=/month=/day= relativos a base_path),
+    separados pelo layout: 'index' para year=/month=/day=/index= e 'legacy' para os arquivos gravados direto
+    no dia, antes da partição index=. Um mesmo dia pode ter os dois layouts.
+    """
+    layouts: Dict[str, List[str]] = {"legacy": [], "index": []}
+    for pattern in day_patterns:
+        day = f"{base_path}{pattern.strip('/')}"
+        layouts["legacy"].extend(glob_parquet_files(spark, f"{day}/*.parquet"))
+        layouts["index"].extend(glob_parquet_files(spark, f"{day}/{RAW_INDEX_COLUMN}=*/*.parquet"))
+    return layouts
+
+def detect_raw_schema(spark: SparkSession, path: str) -> str:
+    """
+    Esquema raw ('typed' ou 'legacy') de um arquivo, pelo tipo gravado em RAW_DECIMAL_COLUMNS.
+    Lê apenas o footer do arquivo.
+    """
+    data_type = spark.read.parquet(path).schema[RAW_DECIMAL_COLUMNS[0]].dataType
+    return 'legacy' if isinstance(data_type, StringType) else 'typed'
+
+def cast_legacy_raw(df: DataFrame) -> DataFrame:
+    """
+    Converte as colunas numéricas de uma leitura 'legacy' (strings no formato brasileiro) para os tipos do
+    esquema 'typed', com os mesmos regexp_replace usados no process_data.
+    """
+    return df.withColumns({
+        **{column: to_number(df, column, RAW_DECIMAL_TYPE.simpleString(), ",", ".") for column in RAW_DECIMAL_COLUMNS},
+        **{column: to_number(df, column, "bigint", "[. ]") for column in RAW_INTEGER_COLUMNS}
+    })
+
+def read_raw_files(spark: SparkSession, base_path: str, files: List[str], raw_schema: str = 'auto') -> DataFrame:
     """
-    Lê os dados do S3 no formato Parquet.
+    Lê arquivos raw de um mesmo layout. Com raw_schema 'auto', o esquema de cada diretório de partição é
+    detectado pelo footer de um dos seus arquivos (detect_raw_schema): cada esquema tem a sua leitura, e as
+    leituras 'legacy' são convertidas para o esquema 'typed' antes da união. Com 'typed' ou 'legacy', todos os
+    arquivos são lidos com o esquema informado, sem detecção.
+    """
+    groups: Dict[str, List[str]] = {}
+    if raw_schema == 'auto':
+        directories: Dict[str, List[str]] = {}
+        for path in files:
+            directories.setdefault(path.rsplit("/", 1)[0], []).append(path)
+        for paths in directories.values():
+            groups.setdefault(detect_raw_schema(spark, paths[0]), []).extend(paths)
+        logger.info(f"Esquemas raw detectados: { {name: len(paths) for name, paths in groups.items()} } arquivos")
+    else:
+        groups[raw_schema] = files
+    frames = []
+    for name, paths in groups.items():
+        df = spark.read.schema(raw_read_schema(name)).option("basePath", base_path).parquet(*paths)
+        frames.append(cast_legacy_raw(df) if raw_schema == 'auto' and name == 'legacy' else df)
+    return union_frames(frames)
+
+def union_frames(frames: List[DataFrame]) -> DataFrame:
+    """União por nome das leituras (todas com as mesmas colunas)."""
+    df = frames[0]
+    for other in frames[1:]:
+        df = df.unionByName(other)
+    return df
+
+def read_raw_layouts(spark: SparkSession, base_path: str, day_patterns: List[str], raw_schema: str = 'auto') -> DataFrame:
+    """
+    Lê os dias da raw com uma leitura por layout (list_raw_layouts), unidas por nome. A descoberta de partições
+    do Spark não aceita year=/month=/day= e year=/month=/day=/index= na mesma leitura; na leitura legada a coluna
+    'index' fica nula e process_data a completa com o DEFAULT_INDEX.
+    """
+    layouts = list_raw_layouts(spark, base_path, day_patterns)
+    if not any(layouts.values()):
+        raise FileNotFoundError(f"Nenhum arquivo Parquet da raw em {base_path} para {day_patterns}")
+    logger.info(f"Arquivos raw por layout: { {layout: len(paths) for layout, paths in layouts.items()} }")
+    return union_frames([read_raw_files(spark, base_path, paths, raw_schema) for paths in layouts.values() if paths])
+
+def raw_day_pattern(relative: str) -> Optional[str]:
+    """
+    Padrão dos diretórios de dia abaixo de um caminho relativo à raiz da raw ('', 'year=2025', 'year=2025/month=7'
+    ou o próprio dia). None se o caminho está abaixo do dia (diretório index= ou arquivo), lido diretamente.
+    """
+    parts = [part for part in relative.strip('/').split('/') if part]
+    if len(parts) > len(RAW_PARTITION_KEYS):
+        return None
+    return '/'.join(parts + [f"{key}=*" for key in RAW_PARTITION_KEYS[len(parts):]])
+
+def read_data(spark: SparkSession, s3_bucket: str, object_key: str,
+              start_date: Optional[str] = None, end_date: Optional[str] = None,
+              raw_schema: str = 'auto') -> DataFrame:
+    """
+    Lê os dados do S3 no formato Parquet com esquema explícito (raw_read_schema), projetando apenas
+    as colunas necessárias e, opcionalmente, filtrando as partições pelo intervalo de datas (YYYY-MM-DD).
+    A raiz, um ano, um mês ou um dia são lidos por layout (read_raw_layouts); um diretório index= ou um
+    arquivo, diretamente.
     """
     logger.info(f"Lendo dados do bucket S3: {s3_bucket} com prefixo: {object_key}")
     try:
-        df = spark.read.parquet(f"s3://{s3_bucket}/{object_key}")
-        logger.info(f"Dados lidos com sucesso. Número de registros: {df.count()}")
+        key = object_key.lstrip('/')
+        raw_root = raw_table_root(key)
+        base_path = s3_uri(s3_bucket, raw_root)
+        pattern = None if key.endswith('.parquet') else raw_day_pattern(key[len(raw_root):])
+        if pattern is None:
+            path = s3_uri(s3_bucket, key)
+            files = [path] if key.endswith('.parquet') else glob_parquet_files(spark, f"{path.rstrip('/')}/*.parquet")
+            if not files:
+                raise FileNotFoundError(f"Nenhum arquivo Parquet da raw em {path}")
+            df = read_raw_files(spark, base_path, files, raw_schema)
+        else:
+            df = read_raw_layouts(spark, base_path, [pattern], raw_schema)
+        condition = partition_date_filter(start_date, end_date)
+        if condition is not None:
+            logger.info(f"Filtrando partições entre {start_date or '-'} e {end_date or '-'}")
+            df = df.where(condition)
+        logger.info("Leitura dos dados configurada com sucesso.")
         return df
     except Exception as e:
         logger.error(f"Erro ao ler dados do S3: {e}")
         raise
 
-def drop_and_log_nulls(df: DataFrame) -> DataFrame:
+def raw_table_root(object_key: str) -> str:
+    """
+    Retorna o prefixo raiz da tabela raw a partir do OBJECT_KEY, que pode apontar para um arquivo,
+    uma partição (year=/month=/day=) ou a própria raiz.
+    """
+    key = object_key.lstrip('/')
+    index = key.find(f"{RAW_PARTITION_KEYS[0]}=")
+    root = key[:index] if index >= 0 else key
+    return root if not root or root.endswith('/') else root + '/'
+
+def default_watermark_key(s3_output_prefix: str) -> str:
+    """
+    Chave padrão do manifesto de partições processadas, fora do prefixo da tabela refinada.
+    """
+    return f"{s3_output_prefix.strip('/')}_state/processed_partitions.json"
+
+def list_raw_partitions(s3_bucket: str, raw_root: str, aws_region: str) -> Dict[str, str]:
+    """
+    Lista os arquivos Parquet da camada raw (apenas metadados) e retorna, por partição
+    year=/month=/day=, uma impressão digital das chaves e ETags para detectar partições novas ou alteradas.
+    """
+    s3 = boto3.client('s3', region_name=aws_region)
+    objects: Dict[str, List[str]] = {}
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=s3_bucket, Prefix=raw_root):
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            if not key.endswith('.parquet'):
+                continue
+            parts = key[len(raw_root):].split('/')[:-1]
+            if len(parts) < len(RAW_PARTITION_KEYS) or not all(
+                    part.startswith(f"{name}=") for part, name in zip(parts, RAW_PARTITION_KEYS)):
+                continue
+            partition = '/'.join(parts[:len(RAW_PARTITION_KEYS)])
+            objects.setdefault(partition, []).append(f"{key}:{obj.get('ETag', '')}")
+    return {
+        partition: hashlib.sha256('|'.join(sorted(entries)).encode('utf-8')).hexdigest()
+        for partition, entries in objects.items()
+    }
+
+def load_watermark(s3_bucket: str, watermark_key: str, aws_region: str) -> Dict[str, str]:
+    """
+    Lê o manifesto de partições raw já refinadas. Retorna vazio se ainda não existir.
+    """
+    s3 = boto3.client('s3', region_name=aws_region)
+    try:
+        response = s3.get_object(Bucket=s3_bucket, Key=watermark_key)
+        return json.loads(response['Body'].read().decode('utf-8')).get('partitions', {})
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            logger.info(f"Manifesto s3://{s3_bucket}/{watermark_key} não encontrado. Processando todas as partições.")
+            return {}
+        logger.error(f"Erro ao ler o manifesto de partições processadas: {e}")
+        raise
+
+def save_watermark(s3_bucket: str, watermark_key: str, partitions: Dict[str, str], aws_region: str) -> None:
+    """
+    Grava o manifesto de partições raw refinadas.
+    """
+    s3 = boto3.client('s3', region_name=aws_region)
+    s3.put_object(
+        Bucket=s3_bucket,
+        Key=watermark_key,
+        Body=json.dumps({'partitions': partitions}, sort_keys=True).encode('utf-8'),
+        ContentType='application/json'
+    )
+    logger.info(f"Manifesto atualizado em s3://{s3_bucket}/{watermark_key} com {len(partitions)} partições.")
+
+def select_pending_partitions(current: Dict[str, str], processed: Dict[str, str]) -> List[str]:
+    """
+    Retorna as partições raw novas ou alteradas desde a última execução.
+    """
+    return sorted(partition for partition, fingerprint in current.items() if processed.get(partition) != fingerprint)
+
+def parse_partitions(value: str) -> List[str]:
+    """
+    Converte o parâmetro PARTITIONS ('year=2025/month=7/day=14,...') na lista de partições raw.
+    """
+    partitions = sorted({partition.strip().strip('/') for partition in value.split(',') if partition.strip()})
+    for partition in partitions:
+        parts = partition.split('/')
+        if len(parts) != len(RAW_PARTITION_KEYS) or not all(
+                part.startswith(f"{name}=") for part, name in zip(parts, RAW_PARTITION_KEYS)):
+            raise ValueError(f"Partição inválida em PARTITIONS: {partition}. Formato esperado: year=AAAA/month=M/day=D")
+    return partitions
+
+def read_partitions(spark: SparkSession, s3_bucket: str, raw_root: str, partitions: List[str],
+                    raw_schema: str = 'auto') -> DataFrame:
     """
-    Remove linhas com valores nulos e loga a quantidade de linhas removidas.
+    Lê apenas as partições raw informadas, mantendo as colunas de partição (basePath na raiz da tabela),
+    com uma leitura por layout (read_raw_layouts).
     """
-    qtd_total = df.count()
+    base_path = s3_uri(s3_bucket, raw_root)
+    logger.info(f"Lendo {len(partitions)} partições de {base_path}: {partitions}")
+    try:
+        return read_raw_layouts(spark, base_path, partitions, raw_schema)
+    except Exception as e:
+        logger.error(f"Erro ao ler partições do S3: {e}")
+        raise
+
+def count_input_partitions(df: DataFrame) -> int:
+    """
+    Número de diretórios de partição raw (dia/índice) lidos, pela listagem de arquivos já feita na leitura.
+    """
+    return len({path.rsplit("/", 1)[0] for path in df.inputFiles()})
+
+def parallelism_settings(input_partitions: int, default_parallelism: int) -> Dict[str, str]:
+    """
+    Configurações do perfil 'auto': uma partição de shuffle por partição raw até o paralelismo do cluster
+    e, acima dele, uma a cada RAW_PARTITIONS_PER_SHUFFLE_PARTITION (até MAX_SHUFFLE_PARTITIONS).
+    Um dia isolado usa uma única partição; o AQE junta partições pequenas e divide as com skew.
+    """
+    shuffle_partitions = max(
+        1,
+        min(input_partitions, default_parallelism),
+        math.ceil(input_partitions / RAW_PARTITIONS_PER_SHUFFLE_PARTITION)
+    )
+    shuffle_partitions = min(shuffle_partitions, MAX_SHUFFLE_PARTITIONS)
+    return {
+        "spark.sql.shuffle.partitions": str(shuffle_partitions),
+        "spark.sql.adaptive.enabled": "true",
+        "spark.sql.adaptive.coalescePartitions.enabled": "true",
+        "spark.sql.adaptive.coalescePartitions.initialPartitionNum": str(shuffle_partitions),
+        "spark.sql.adaptive.advisoryPartitionSizeInBytes": ADVISORY_PARTITION_SIZE,
+        "spark.sql.adaptive.skewJoin.enabled": "true",
+        "spark.sql.adaptive.optimizeSkewsInRebalancePartitions.enabled": "true"
+    }
+
+def apply_parallelism_profile(spark: SparkSession, df: DataFrame, profile: str = 'auto') -> Dict[str, str]:
+    """
+    Aplica o perfil de paralelismo à sessão antes das ações sobre os dados lidos e retorna as configurações usadas.
+    O número de partições vale para todos os shuffles do job. Não há um repartition explícito por data_ref: a
+    agregação (com contagens distintas) redistribui os dados por todas as chaves do groupBy, e a escrita, pelas
+    chaves de partição. Um shuffle por data_ref antes deles seria apenas mais um shuffle.
+    """
+    if profile != 'auto':
+        return {}
+    input_partitions = count_input_partitions(df)
+    settings = parallelism_settings(input_partitions, spark.sparkContext.defaultParallelism)
+    for key, value in settings.items():
+        spark.conf.set(key, value)
+    logger.info(f"Perfil de paralelismo 'auto': {input_partitions} partições raw, "
+                f"{settings['spark.sql.shuffle.partitions']} partições de shuffle")
+    return settings
+
+def drop_and_log_nulls(df: DataFrame, metrics: Optional[JobMetrics] = None) -> DataFrame:
+    """
+    Remove linhas com valores nulos. Com 'metrics', registra as linhas de entrada, os nulos por
+    coluna e as linhas restantes, calculados na mesma passada da escrita.
+    """
+    if metrics is None:
+        return df.na.drop()
+    df = metrics.observe(
+        df, "input",
+        sf.count(sf.lit(1)).alias("input_rows"),
+        *[sf.sum(sf.col(column).isNull().cast("int")).alias(f"null_rows_{column}") for column in df.columns]
+    )
     df_clean = df.na.drop()
-    qtd_rows_unic = df_clean.count()
-    logger.info(f"Linhas removidas por valores nulos: {qtd_total - qtd_rows_unic}")
-    return df_clean
+    return metrics.observe(df_clean, "processed", sf.count(sf.lit(1)).alias("processed_rows"))
 
-def process_data(df: DataFrame) -> DataFrame:
+def to_number(df: DataFrame, column: str, data_type: str, pattern: str, replacement: str = ""):
+    """
+    Converte a coluna para data_type. Colunas já tipadas pela extração são apenas convertidas;
+    strings (esquema raw 'legacy') passam antes pelo regexp_replace do formato brasileiro.
+    """
+    if isinstance(df.schema[column].dataType, StringType):
+        return sf.regexp_replace(column, pattern, replacement).cast(data_type)
+    return sf.col(column).cast(data_type)
+
+def process_data(df: DataFrame, metrics: Optional[JobMetrics] = None) -> DataFrame:
     """
     Realiza o processamento e limpeza dos dados.
     """
@@ -79,15 +642,15 @@ def process_data(df: DataFrame) -> DataFrame:
     try:
         validate_schema(df, EXPECTED_COLUMNS)
         logger.info("Validação de esquema concluída com sucesso.")
+        # Partições raw anteriores à coluna 'index' não têm o diretório index=: são do DEFAULT_INDEX
+        raw_index = sf.col(RAW_INDEX_COLUMN) if RAW_INDEX_COLUMN in df.columns else sf.lit(None)
+        df = df.withColumn(RAW_INDEX_COLUMN, sf.coalesce(raw_index, sf.lit(DEFAULT_INDEX)))
         df = df.drop(
                 "page_pageNumber", "page_pageSize", "page_totalRecords", "page_totalPages",
                 "header_text", "header_part", "header_partAcum", "header_textReductor",
                 "header_reductor", "header_theoricalQty")
-        df.cache()
-        logger.info("Cache aplicado aos dados.")
-        df = drop_and_log_nulls(df)
-        df = (
-            df.withColumnsRenamed({
+        df = drop_and_log_nulls(df, metrics)
+        df = df.withColumnsRenamed({
                 "results_segment": "nom_setor",
                 "results_asset": "nom_empresa",
                 "results_cod": "cod_acao",
@@ -95,33 +658,36 @@ def process_data(df: DataFrame) -> DataFrame:
                 "results_theoricalQty": "qtd_teorica",
                 "results_part": "perc_participacao_setor",
                 "results_partAcum": "perc_participacao_setor_acumulada",
-                "header_date": "data_ref"
-            })
+                "header_date": "data_ref",
+                RAW_INDEX_COLUMN: "cod_indice"
+        })
+        df = (
+            df.withColumn("cod_indice", sf.trim("cod_indice"))
             .withColumn("nom_setor", sf.trim("nom_setor"))
             .withColumn("nom_empresa", sf.trim("nom_empresa"))
             .withColumn("cod_acao", sf.trim("cod_acao"))
             .withColumn("des_tipo_acao", sf.trim("des_tipo_acao"))
-            .withColumn("perc_participacao_setor", sf.regexp_replace("perc_participacao_setor", ",", ".").cast("decimal(5,3)"))
-            .withColumn("perc_participacao_setor_acumulada", sf.regexp_replace("perc_participacao_setor_acumulada", ",", ".").cast("decimal(5,3)"))
-            .withColumn("qtd_teorica", sf.regexp_replace("qtd_teorica", "[. ]", "").cast("bigint"))
+            .withColumn("perc_participacao_setor", to_number(df, "perc_participacao_setor", "decimal(5,3)", ",", "."))
+            .withColumn("perc_participacao_setor_acumulada", to_number(df, "perc_participacao_setor_acumulada", "decimal(5,3)", ",", "."))
+            .withColumn("qtd_teorica", to_number(df, "qtd_teorica", "bigint", "[. ]"))
             .withColumn("data_ref", sf.to_date("data_ref", "dd/MM/yy"))
             .withColumn("year", sf.year("data_ref"))
             .withColumn("month", sf.month("data_ref"))
             .withColumn("day", sf.day("data_ref"))
         )
-        logger.info(f"Processamento de dados concluído. Registros finais: {df.count()}")
+        logger.info("Processamento de dados configurado.")
         return df
     except Exception as e:
         logger.error(f"Erro ao processar dados: {e}")
         raise
     
-def aggregate_data(df: DataFrame) -> DataFrame:
+def aggregate_data(df: DataFrame, metrics: Optional[JobMetrics] = None) -> DataFrame:
     """
-    Realiza a agregação dos dados por setor, empresa e data de referência.
+    Realiza a agregação dos dados por índice, setor, empresa e data de referência.
     """
     try:
         df = (
-            df.groupBy("nom_setor","nom_empresa","data_ref","year","month","day") \
+            df.groupBy("cod_indice","nom_setor","nom_empresa","data_ref","year","month","day") \
             .agg(
                 sf.count(sf.col("cod_acao")).alias("qtd_registros"),
                 sf.count_distinct(sf.col("cod_acao")).alias("qtd_acao"),
@@ -137,34 +703,457 @@ def aggregate_data(df: DataFrame) -> DataFrame:
             .select(
                 "nom_empresa","qtd_registros","qtd_acao","qtd_tipos_acao","qtd_teorica_acumulada","qtd_teorica_max",
                 "qtd_teorica_min","avg_participacao_setor_total","avg_participacao_setor_acumulada_total","qtd_dias_atraso",
-                "data_ref","dth_etl_processamento","year","month","day","nom_setor"
+                "data_ref","dth_etl_processamento","year","month","day","cod_indice","nom_setor"
             )
         )
-        logger.info(f"Agregação de dados concluída. Registros agregados: {df.count()}")
+        if metrics is not None:
+            df = metrics.observe(df, "aggregated", sf.count(sf.lit(1)).alias("aggregated_groups"))
+        logger.info("Agregação de dados configurada.")
         return df
     except Exception as e:
         logger.error(f"Erro ao agregar dados: {e}")
         raise
 
-def write_data(df: DataFrame,s3_output_bucket: str,s3_output_prefix: str,partition_keys: List[str] = ["year", "month", "day"],compression: str = "snappy") -> None:
+def default_features_prefix(s3_output_prefix: str) -> str:
+    """
+    Prefixo padrão da tabela de features por ação, ao lado da tabela refinada.
+    """
+    return f"{s3_output_prefix.strip('/')}_features/"
+
+def ticker_daily(df: DataFrame) -> DataFrame:
+    """
+    Reduz os dados processados a uma linha por índice, ação e data de referência (base das features).
+    """
+    return (
+        df.groupBy("cod_indice", "cod_acao", "data_ref", "year", "month", "day")
+        .agg(
+            sf.max("nom_empresa").alias("nom_empresa"),
+            sf.max("nom_setor").alias("nom_setor"),
+            sf.sum("qtd_teorica").alias("qtd_teorica"),
+            sf.sum("perc_participacao_setor").cast("decimal(5,3)").alias("perc_participacao_setor")
+        )
+        .select([field.name for field in FEATURES_HISTORY_SCHEMA.fields])
+    )
+
+def read_features_history(spark: SparkSession, s3_bucket: str, features_prefix: str,
+                          new_dates: List[date]) -> Optional[DataFrame]:
     """
-    Escreve os dados processados no S3 particionados e cataloga no Glue.
+    Lê da tabela de features apenas a janela anterior às datas processadas (FEATURES_LOOKBACK_DAYS),
+    com filtro de partição, excluindo as próprias datas processadas (que serão sobrescritas).
+    Retorna None se a tabela ainda não existir.
     """
+    base_path = s3_uri(s3_bucket, features_prefix)
+    start_date = min(new_dates) - timedelta(days=FEATURES_LOOKBACK_DAYS)
+    partition_date = sf.make_date("year", "month", "day")
     try:
+        history = spark.read.schema(FEATURES_HISTORY_SCHEMA).parquet(base_path)
+    except AnalysisException as e:
+        logger.info(f"Histórico de features indisponível em {base_path}: {e}")
+        return None
+    return history.where(
+        partition_date_filter(start_date.isoformat(), max(new_dates).isoformat())
+        & ~partition_date.isin([sf.lit(new_date) for new_date in new_dates])
+    ).withColumn("cod_indice", sf.coalesce("cod_indice", sf.lit(DEFAULT_INDEX)))
+
+def build_ticker_features(daily: DataFrame, history: Optional[DataFrame] = None) -> DataFrame:
+    """
+    Calcula, por índice e ação, a variação diária da quantidade teórica e da participação e as médias móveis
+    de FEATURE_WINDOWS pregões. O histórico completa as janelas; apenas as datas de 'daily' são retornadas.
+    """
+    new_dates = daily.select("data_ref").distinct()
+    series = daily if history is None else daily.unionByName(history)
+    by_ticker = Window.partitionBy("cod_indice", "cod_acao").orderBy("data_ref")
+    previous_qtd = sf.lag("qtd_teorica").over(by_ticker)
+    df = (
+        series
+        .withColumn("data_ref_anterior", sf.lag("data_ref").over(by_ticker))
+        .withColumn("qtd_teorica_var_dia", sf.col("qtd_teorica") - previous_qtd)
+        .withColumn("perc_qtd_teorica_var_dia",
+                    sf.when(previous_qtd != 0, (sf.col("qtd_teorica") - previous_qtd) / previous_qtd * 100))
+        .withColumn("perc_participacao_var_dia",
+                    (sf.col("perc_participacao_setor") - sf.lag("perc_participacao_setor").over(by_ticker)).cast("decimal(6,3)"))
+    )
+    for window in FEATURE_WINDOWS:
+        trailing = by_ticker.rowsBetween(-(window - 1), Window.currentRow)
+        df = (
+            df.withColumn(f"avg_qtd_teorica_{window}d", sf.avg("qtd_teorica").over(trailing).cast("double"))
+            .withColumn(f"avg_participacao_setor_{window}d", sf.avg("perc_participacao_setor").over(trailing).cast("decimal(9,7)"))
+            .withColumn(f"qtd_pregoes_{window}d", sf.count("data_ref").over(trailing).cast("int"))
+        )
+    return (
+        df.join(sf.broadcast(new_dates), "data_ref", "left_semi")
+        .withColumn("dth_etl_processamento", sf.current_timestamp())
+        .select([column['Name'] for column in FEATURES_CATALOG_COLUMNS] + FEATURES_PARTITION_KEYS)
+    )
+
+def parse_columns(value: str) -> List[str]:
+    """
+    Converte um parâmetro de colunas separadas por vírgula em lista.
+    """
+    return [column.strip() for column in value.split(',') if column.strip()]
+
+def parquet_layout_options(row_group_size_mb: Optional[int] = None, bloom_filter_columns: Optional[List[str]] = None,
+                           expected_ndv: int = BLOOM_FILTER_EXPECTED_NDV) -> Dict[str, str]:
+    """
+    Opções do writer Parquet para o layout dos arquivos: tamanho do row group e bloom filters por coluna.
+    O dicionário do Parquet já vem habilitado por padrão e é mantido explicitamente.
+    """
+    options = {"parquet.enable.dictionary": "true"}
+    if row_group_size_mb:
+        options["parquet.block.size"] = str(row_group_size_mb * 1024 * 1024)
+    for column in bloom_filter_columns or []:
+        options[f"parquet.bloom.filter.enabled#{column}"] = "true"
+        options[f"parquet.bloom.filter.expected.ndv#{column}"] = str(expected_ndv)
+    return options
+
+def write_data(df: DataFrame,s3_output_bucket: str,s3_output_prefix: str,partition_keys: List[str] = ["year", "month", "day"],compression: str = "snappy",max_records_per_file: int = 0,
+               sort_columns: Optional[List[str]] = None, parquet_options: Optional[Dict[str, str]] = None) -> List[Dict[str, str]]:
+    """
+    Escreve os dados processados no S3 particionados e retorna as partições gravadas,
+    coletadas na própria escrita (Observation), sem uma ação extra sobre os dados.
+    O reparticionamento pelas chaves de partição gera um arquivo por partição (em vez de um por task);
+    max_records_per_file > 0 divide partições grandes em arquivos de até esse número de linhas.
+    sort_columns ordena as linhas dentro de cada arquivo, deixando as estatísticas min/max dos row groups
+    disjuntas para que filtros nessas colunas pulem row groups (predicate pushdown no Athena).
+    """
+    try:
+        observation = Observation("written_partitions")
+        df = df.repartition(*partition_keys)
+        if sort_columns:
+            # As chaves de partição vêm primeiro: é a ordenação exigida pelo writer, que assim não reordena os dados
+            df = df.sortWithinPartitions(*partition_keys, *sort_columns)
+        df = df.observe(observation, sf.to_json(sf.collect_set(sf.struct(*partition_keys))).alias("partitions"))
         df.write \
             .mode("overwrite") \
             .option("compression", compression) \
-            .option("spark.sql.sources.partitionOverwriteMode", "dynamic") \
+            .option("partitionOverwriteMode", "dynamic") \
+            .option("maxRecordsPerFile", max_records_per_file) \
+            .options(**(parquet_options or {})) \
             .partitionBy(*partition_keys) \
             .format("parquet") \
-            .parquet(f"s3://{s3_output_bucket}/{s3_output_prefix}")
-        logger.info(f"Dados gravados com sucesso em s3://{s3_output_bucket}/{s3_output_prefix}")
+            .parquet(s3_uri(s3_output_bucket, s3_output_prefix))
+        partitions = [
+            {key: None if row[key] is None else str(row[key]) for key in partition_keys}
+            for row in json.loads(observation.get.get("partitions") or "[]")
+        ]
+        logger.info(f"Dados gravados com sucesso em s3://{s3_output_bucket}/{s3_output_prefix} ({len(partitions)} partições)")
+        return partitions
     except Exception as e:
         logger.error(f"Erro ao gravar dados no S3: {e}")
         raise
 
+def escape_partition_value(value: Optional[str]) -> str:
+    """
+    Escapa o valor de partição como o Spark/Hive ao nomear os diretórios (ex.: '/' -> '%2F').
+    """
+    if value is None or value == "":
+        return "__HIVE_DEFAULT_PARTITION__"
+    return "".join(f"%{ord(char):02X}" if char in SPARK_ESCAPED_CHARS else char for char in str(value))
+
+def build_partition_inputs(partitions: List[Dict[str, str]], partition_keys: List[str], storage_descriptor: Dict,
+                           s3_output_bucket: str, s3_output_prefix: str) -> List[Dict]:
+    """
+    Monta os PartitionInput do Glue para as partições gravadas, com a Location igual ao diretório do Spark.
+    """
+    base_location = f"s3://{s3_output_bucket}/{s3_output_prefix.strip('/')}"
+    inputs = []
+    for partition in partitions:
+        relative = "/".join(f"{key}={escape_partition_value(partition[key])}" for key in partition_keys)
+        inputs.append({
+            'Values': [partition[key] if partition[key] not in (None, "") else "__HIVE_DEFAULT_PARTITION__" for key in partition_keys],
+            'StorageDescriptor': {**storage_descriptor, 'Location': f"{base_location}/{relative}/"}
+        })
+    return inputs
+
+def register_partitions(database_name: str, table_name: str, s3_output_bucket: str, s3_output_prefix: str,
+                        partitions: List[Dict[str, str]], partition_keys: List[str], aws_region: str) -> None:
+    """
+    Registra no catálogo Glue apenas as partições gravadas, em lotes do batch_create_partition.
+    O custo não depende do histórico acumulado (ao contrário do MSCK REPAIR TABLE).
+    """
+    if not partitions:
+        logger.info("Nenhuma partição gravada para registrar no catálogo.")
+        return
+    glue = boto3.client('glue', region_name=aws_region)
+    storage_descriptor = glue.get_table(DatabaseName=database_name, Name=table_name)['Table']['StorageDescriptor']
+    inputs = build_partition_inputs(partitions, partition_keys, storage_descriptor, s3_output_bucket, s3_output_prefix)
+    for start in range(0, len(inputs), GLUE_PARTITION_BATCH_SIZE):
+        response = glue.batch_create_partition(
+            DatabaseName=database_name,
+            TableName=table_name,
+            PartitionInputList=inputs[start:start + GLUE_PARTITION_BATCH_SIZE]
+        )
+        errors = [
+            error for error in response.get('Errors', [])
+            if error.get('ErrorDetail', {}).get('ErrorCode') != 'AlreadyExistsException'
+        ]
+        if errors:
+            logger.error(f"Erro ao registrar partições no catálogo Glue: {errors}")
+            raise RuntimeError(f"Erro ao registrar partições no catálogo Glue: {errors}")
+    logger.info(f"{len(inputs)} partições registradas em {database_name}.{table_name}.")
+    touch_table(database_name, table_name, aws_region)
+
+def touch_table(database_name: str, table_name: str, aws_region: str) -> None:
+    """
+    Marca a escrita no parâmetro LAST_WRITE_PARAMETER da tabela (o que também muda o UpdateTime),
+    inclusive quando as partições gravadas já estavam registradas e só foram reescritas.
+    """
+    glue = boto3.client('glue', region_name=aws_region)
+    table = glue.get_table(DatabaseName=database_name, Name=table_name)['Table']
+    table_input = {key: table[key] for key in TABLE_INPUT_KEYS if key in table}
+    table_input['Parameters'] = {**table.get('Parameters', {}), LAST_WRITE_PARAMETER: datetime.now(timezone.utc).isoformat()}
+    glue.update_table(DatabaseName=database_name, TableInput=table_input, SkipArchive=True)
+
+def catalog_partition_keys(database_name: str, table_name: str, aws_region: str) -> Optional[List[str]]:
+    """
+    Chaves de partição da tabela no catálogo Glue, ou None se a tabela ainda não existir.
+    """
+    glue = boto3.client('glue', region_name=aws_region)
+    try:
+        table = glue.get_table(DatabaseName=database_name, Name=table_name)['Table']
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'EntityNotFoundException':
+            return None
+        raise
+    return [key['Name'] for key in table.get('PartitionKeys', [])]
+
+def migrate_partition_keys(database_name: str, table_name: str, s3_bucket: str, s3_prefix: str,
+                           catalog_partitions: List[Dict[str, str]], aws_region: str) -> int:
+    """
+    Migra uma tabela criada antes de INDEX_PARTITION_KEY para as chaves atuais. Os arquivos de cada partição são
+    copiados para o diretório com cod_indice=DEFAULT_INDEX (o único índice extraído até então). Em seguida, as
+    partições antigas são trocadas no catálogo pelas novas, e só então os arquivos antigos são removidos.
+    Retorna o número de partições migradas.
+    """
+    glue = boto3.client('glue', region_name=aws_region)
+    s3 = boto3.client('s3', region_name=aws_region)
+    table = glue.get_table(DatabaseName=database_name, Name=table_name)['Table']
+    old_keys = [key['Name'] for key in table.get('PartitionKeys', [])]
+    new_keys = [key['Name'] for key in catalog_partitions]
+    if old_keys == new_keys:
+        return 0
+    if [key for key in new_keys if key != INDEX_PARTITION_KEY] != old_keys:
+        raise RuntimeError(f"Chaves de partição de {database_name}.{table_name} sem migração conhecida: {old_keys} -> {new_keys}")
+    old_partitions = [
+        partition for page in glue.get_paginator('get_partitions').paginate(DatabaseName=database_name, TableName=table_name)
+        for partition in page.get('Partitions', [])
+    ]
+    logger.info(f"Migrando {len(old_partitions)} partições de {database_name}.{table_name}: {old_keys} -> {new_keys}")
+    new_partitions, obsolete = [], []
+    bucket_uri = f"s3://{s3_bucket}/"
+    for partition in old_partitions:
+        values = {**dict(zip(old_keys, partition['Values'])), INDEX_PARTITION_KEY: DEFAULT_INDEX}
+        new_partitions.append(values)
+        old_dir = partition['StorageDescriptor']['Location'][len(bucket_uri):].rstrip('/') + '/'
+        new_dir = f"{s3_prefix.strip('/')}/" + "/".join(f"{key}={escape_partition_value(values[key])}" for key in new_keys) + "/"
+        for page in s3.get_paginator('list_objects_v2').paginate(Bucket=s3_bucket, Prefix=old_dir):
+            for obj in page.get('Contents', []):
+                s3.copy_object(
+                    Bucket=s3_bucket,
+                    Key=f"{new_dir}{obj['Key'][len(old_dir):]}",
+                    CopySource={'Bucket': s3_bucket, 'Key': obj['Key']}
+                )
+                obsolete.append(obj['Key'])
+    for start in range(0, len(old_partitions), GLUE_DELETE_PARTITION_BATCH_SIZE):
+        glue.batch_delete_partition(
+            DatabaseName=database_name,
+            TableName=table_name,
+            PartitionsToDelete=[{'Values': partition['Values']} for partition in old_partitions[start:start + GLUE_DELETE_PARTITION_BATCH_SIZE]]
+        )
+    table_input = {key: table[key] for key in TABLE_INPUT_KEYS if key in table}
+    table_input['PartitionKeys'] = catalog_partitions
+    glue.update_table(DatabaseName=database_name, TableInput=table_input, SkipArchive=True)
+    register_partitions(database_name, table_name, s3_bucket, s3_prefix, new_partitions, new_keys, aws_region)
+    delete_keys(s3, s3_bucket, obsolete)
+    logger.info(f"Tabela {database_name}.{table_name} migrada: {len(new_partitions)} partições com {INDEX_PARTITION_KEY}={DEFAULT_INDEX}.")
+    return len(new_partitions)
+
+def ensure_partition_keys(database_name: str, table_name: str, s3_bucket: str, s3_prefix: str,
+                          catalog_partitions: List[Dict[str, str]], aws_region: str, migrate: bool = False) -> None:
+    """
+    Confere, antes de gravar, se a tabela existente usa as chaves de partição atuais. Uma tabela criada antes de
+    INDEX_PARTITION_KEY é migrada com migrate=True (MIGRATE_PARTITION_KEYS); sem isso o job falha antes de misturar
+    os dois layouts no prefixo.
+    """
+    current = catalog_partition_keys(database_name, table_name, aws_region)
+    expected = [key['Name'] for key in catalog_partitions]
+    if current is None or current == expected:
+        return
+    if not migrate:
+        message = (f"Tabela {database_name}.{table_name} particionada por {current}, esperado {expected}. "
+                   f"Execute o job com --MIGRATE_PARTITION_KEYS true para migrar as partições existentes.")
+        logger.error(message)
+        raise RuntimeError(message)
+    migrate_partition_keys(database_name, table_name, s3_bucket, s3_prefix, catalog_partitions, aws_region)
+
 # Catalogação automática usando boto3
-def create_table_if_not_exists(database_name:str,table_name:str,s3_output_bucket: str,s3_output_prefix: str,aws_region:str) -> None:
+def default_compaction_staging_prefix(s3_output_prefix: str) -> str:
+    """
+    Prefixo temporário da compactação, fora do prefixo da tabela refinada.
+    """
+    return f"{s3_output_prefix.strip('/')}_compaction/"
+
+def list_partition_files(s3_bucket: str, prefix: str, aws_region: str) -> Dict[str, List[Dict]]:
+    """
+    Lista os arquivos Parquet sob o prefixo (apenas metadados), agrupados pelo diretório de partição.
+    """
+    s3 = boto3.client('s3', region_name=aws_region)
+    files: Dict[str, List[Dict]] = {}
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=s3_bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            if not key.endswith('.parquet'):
+                continue
+            files.setdefault(key.rsplit('/', 1)[0], []).append({'Key': key, 'Size': obj['Size']})
+    return files
+
+def plan_compaction(files: List[Dict], target_file_size_bytes: int) -> int:
+    """
+    Retorna a quantidade de arquivos de saída da partição, ou 0 se ela já está no tamanho alvo.
+    """
+    total_size = sum(file['Size'] for file in files)
+    num_files = max(1, math.ceil(total_size / target_file_size_bytes))
+    return num_files if len(files) > num_files else 0
+
+def list_catalog_partitions(database_name: str, table_name: str, s3_bucket: str, staging_prefix: str,
+                            aws_region: str) -> Dict[str, Dict]:
+    """
+    Partições da tabela no catálogo Glue, indexadas pelo diretório da partição no bucket (sem a '/' final).
+    Uma partição que ficou apontando para o prefixo temporário (compactação interrompida) é indexada pelo
+    diretório original. Retorna {} se a tabela não existir.
+    """
+    glue = boto3.client('glue', region_name=aws_region)
+    bucket_uri = f"s3://{s3_bucket}/"
+    staging = f"{staging_prefix.strip('/')}/"
+    partitions: Dict[str, Dict] = {}
+    try:
+        for page in glue.get_paginator('get_partitions').paginate(DatabaseName=database_name, TableName=table_name):
+            for partition in page.get('Partitions', []):
+                location = partition['StorageDescriptor']['Location']
+                if location.startswith(bucket_uri):
+                    key = location[len(bucket_uri):].strip('/')
+                    partitions[key[len(staging):] if key.startswith(staging) else key] = partition
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'EntityNotFoundException':
+            return {}
+        raise
+    return partitions
+
+def set_partition_location(database_name: str, table_name: str, partition: Dict, location: str, aws_region: str) -> None:
+    """
+    Aponta a partição do catálogo para outra Location. Cada consulta do Athena lê a Location vigente no
+    planejamento, então a troca é atômica para quem consulta a tabela.
+    """
+    glue = boto3.client('glue', region_name=aws_region)
+    partition_input = {key: partition[key] for key in PARTITION_INPUT_KEYS if key in partition}
+    partition_input['StorageDescriptor'] = {**partition['StorageDescriptor'], 'Location': location}
+    glue.update_partition(
+        DatabaseName=database_name,
+        TableName=table_name,
+        PartitionValueList=partition['Values'],
+        PartitionInput=partition_input
+    )
+
+def swap_partition_files(s3_bucket: str, partition_dir: str, obsolete: List[str], staging: str, aws_region: str,
+                         database_name: Optional[str] = None, table_name: Optional[str] = None,
+                         catalog_partition: Optional[Dict] = None) -> None:
+    """
+    Substitui os arquivos 'obsolete' da partição pelos arquivos do diretório temporário 'staging'.
+    Com a partição no catálogo, ela aponta para 'staging' durante a troca e volta ao diretório original só
+    depois dele conter apenas os arquivos novos: o Athena nunca vê os arquivos antigos e novos juntos.
+    Sem a partição no catálogo, os novos arquivos são copiados antes da remoção dos antigos.
+    Pode ser repetida com os mesmos argumentos após uma falha.
+    """
+    s3 = boto3.client('s3', region_name=aws_region)
+    staged = [obj['Key'] for page in s3.get_paginator('list_objects_v2').paginate(Bucket=s3_bucket, Prefix=staging)
+              for obj in page.get('Contents', [])]
+    targets = {key: f"{partition_dir}/{key.rsplit('/', 1)[1]}" for key in staged if key.endswith('.parquet')}
+    if catalog_partition:
+        set_partition_location(database_name, table_name, catalog_partition, s3_uri(s3_bucket, staging), aws_region)
+    for key, target in targets.items():
+        s3.copy_object(Bucket=s3_bucket, Key=target, CopySource={'Bucket': s3_bucket, 'Key': key})
+    delete_keys(s3, s3_bucket, [key for key in obsolete if key not in targets.values()])
+    if catalog_partition:
+        set_partition_location(database_name, table_name, catalog_partition, s3_uri(s3_bucket, f"{partition_dir}/"), aws_region)
+    delete_keys(s3, s3_bucket, staged)
+
+def delete_keys(s3, s3_bucket: str, keys: List[str]) -> None:
+    """Remove as chaves em lotes de S3_DELETE_BATCH_SIZE."""
+    for start in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+        s3.delete_objects(
+            Bucket=s3_bucket,
+            Delete={'Objects': [{'Key': key} for key in keys[start:start + S3_DELETE_BATCH_SIZE]], 'Quiet': True}
+        )
+
+def compact_partition(spark: SparkSession, s3_bucket: str, partition_dir: str, files: List[Dict], num_files: int,
+                      staging_prefix: str, aws_region: str, compression: str = "snappy",
+                      sort_columns: Optional[List[str]] = None, parquet_options: Optional[Dict[str, str]] = None,
+                      database_name: Optional[str] = None, table_name: Optional[str] = None,
+                      catalog_partition: Optional[Dict] = None) -> None:
+    """
+    Reescreve os arquivos pequenos de uma partição em num_files arquivos no prefixo temporário, com o mesmo
+    layout do write_data: linhas ordenadas por sort_columns (arquivos com faixas disjuntas, via
+    repartitionByRange) e as mesmas opções do writer Parquet. A troca dos arquivos é feita por
+    swap_partition_files.
+    """
+    staging = f"{staging_prefix.rstrip('/')}/{partition_dir}/"
+    df = spark.read.parquet(*[s3_uri(s3_bucket, file['Key']) for file in files])
+    # As colunas de partição não estão nos arquivos: só as colunas de dados entram na ordenação
+    sort_columns = [column for column in sort_columns or [] if column in df.columns]
+    if sort_columns:
+        df = df.repartitionByRange(num_files, *sort_columns).sortWithinPartitions(*sort_columns)
+    else:
+        df = df.repartition(num_files)
+    df.write \
+        .mode("overwrite") \
+        .option("compression", compression) \
+        .options(**(parquet_options or {})) \
+        .parquet(s3_uri(s3_bucket, staging))
+    swap_partition_files(
+        s3_bucket, partition_dir, [file['Key'] for file in files], staging, aws_region,
+        database_name, table_name, catalog_partition
+    )
+    logger.info(f"Partição {partition_dir} compactada: {len(files)} -> {num_files} arquivos.")
+
+def compact_prefix(spark: SparkSession, s3_bucket: str, prefix: str, staging_prefix: str, aws_region: str,
+                   target_file_size_mb: int = 128, compression: str = "snappy",
+                   sort_columns: Optional[List[str]] = None, parquet_options: Optional[Dict[str, str]] = None,
+                   database_name: Optional[str] = None, table_name: Optional[str] = None) -> Dict[str, int]:
+    """
+    Compacta os arquivos pequenos de todas as partições sob o prefixo, mirando target_file_size_mb por arquivo.
+    Com database_name/table_name, as partições registradas no catálogo são trocadas pela Location e as
+    trocas interrompidas em uma execução anterior são concluídas antes do planejamento.
+    """
+    target_file_size_bytes = target_file_size_mb * 1024 * 1024
+    summary = {'partitions': 0, 'compacted': 0, 'files_before': 0, 'files_after': 0}
+    partition_files = list_partition_files(s3_bucket, prefix, aws_region)
+    catalog = list_catalog_partitions(database_name, table_name, s3_bucket, staging_prefix, aws_region) \
+        if database_name and table_name else {}
+    staging_uri = s3_uri(s3_bucket, f"{staging_prefix.strip('/')}/")
+    for partition_dir, partition in sorted(catalog.items()):
+        if partition_dir.startswith(prefix.strip('/')) and partition['StorageDescriptor']['Location'].startswith(staging_uri):
+            logger.warning(f"Concluindo a troca interrompida da partição {partition_dir}")
+            swap_partition_files(
+                s3_bucket, partition_dir, [file['Key'] for file in partition_files.pop(partition_dir, [])],
+                f"{staging_prefix.rstrip('/')}/{partition_dir}/", aws_region, database_name, table_name, partition
+            )
+    for partition_dir, files in sorted(partition_files.items()):
+        num_files = plan_compaction(files, target_file_size_bytes)
+        summary['partitions'] += 1
+        summary['files_before'] += len(files)
+        if num_files:
+            compact_partition(
+                spark, s3_bucket, partition_dir, files, num_files, staging_prefix, aws_region, compression,
+                sort_columns, parquet_options, database_name, table_name, catalog.get(partition_dir)
+            )
+            summary['compacted'] += 1
+        summary['files_after'] += num_files or len(files)
+    logger.info(f"Compactação concluída em s3://{s3_bucket}/{prefix}: {json.dumps(summary)}")
+    return summary
+
+def create_table_if_not_exists(database_name:str,table_name:str,s3_output_bucket: str,s3_output_prefix: str,aws_region:str,
+                               columns: List[Dict[str, str]] = REFINED_CATALOG_COLUMNS,
+                               partition_keys: List[Dict[str, str]] = REFINED_CATALOG_PARTITIONS) -> None:
     glue = boto3.client('glue', region_name=aws_region)
     try:
         glue.get_table(DatabaseName=database_name, Name=table_name)
@@ -177,20 +1166,7 @@ def create_table_if_not_exists(database_name:str,table_name:str,s3_output_bucket
                 TableInput={
                     'Name': table_name,
                     'StorageDescriptor': {
-                        'Columns': [
-                            {'Name': 'nom_empresa', 'Type': 'string'},
-                            {'Name': 'qtd_registros', 'Type': 'bigint'},
-                            {'Name': 'qtd_acao', 'Type': 'bigint'},
-                            {'Name': 'qtd_tipos_acao', 'Type': 'bigint'},
-                            {'Name': 'qtd_teorica_acumulada', 'Type': 'bigint'},
-                            {'Name': 'qtd_teorica_max', 'Type': 'bigint'},
-                            {'Name': 'qtd_teorica_min', 'Type': 'bigint'},
-                            {'Name': 'qtd_dias_atraso', 'Type': 'int'},
-                            {'Name': 'avg_participacao_setor_total', 'Type': 'decimal(9,7)'},
-                            {'Name': 'avg_participacao_setor_acumulada_total', 'Type': 'decimal(9,7)'},
-                            {'Name': 'data_ref', 'Type': 'date'},
-                            {'Name': 'dth_etl_processamento', 'Type': 'timestamp'},
-                        ],
+                        'Columns': columns,
                         'Location': f"s3://{s3_output_bucket}/{s3_output_prefix}",
                         'InputFormat': 'org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat',
                         'OutputFormat': 'org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat',
@@ -201,12 +1177,7 @@ def create_table_if_not_exists(database_name:str,table_name:str,s3_output_bucket
                         'Compressed': True,
                         'StoredAsSubDirectories': False
                     },
-                    'PartitionKeys': [
-                            {'Name': 'year', 'Type': 'int'},
-                            {'Name': 'month', 'Type': 'int'},
-                            {'Name': 'day', 'Type': 'int'},
-                            {'Name': 'nom_setor', 'Type': 'string'}
-                        ],
+                    'PartitionKeys': partition_keys,
                     'TableType': 'EXTERNAL_TABLE',
                     'Parameters': {
                         'classification': 'parquet'
@@ -218,6 +1189,53 @@ def create_table_if_not_exists(database_name:str,table_name:str,s3_output_bucket
             logger.error(f"Erro ao acessar o catálogo Glue: {e}")
             raise
 
+def update_ticker_features(spark: SparkSession, processed_df: DataFrame, database_name: str, table_name: str,
+                           s3_output_bucket: str, features_prefix: str, aws_region: str, catalog_mode: str,
+                           parquet_options: Optional[Dict[str, str]] = None) -> None:
+    """
+    Atualiza a tabela de features por ação para as datas processadas, lendo só a janela anterior
+    da própria tabela, e cataloga as partições gravadas (exceto com catalog_mode='none').
+    """
+    daily = ticker_daily(processed_df)
+    new_dates = [row["data_ref"] for row in daily.select("data_ref").distinct().collect() if row["data_ref"] is not None]
+    if not new_dates:
+        logger.info("Nenhuma data processada para atualizar as features.")
+        return
+    logger.info(f"Atualizando features por ação para {len(new_dates)} datas em s3://{s3_output_bucket}/{features_prefix}")
+    history = read_features_history(spark, s3_output_bucket, features_prefix, new_dates)
+    written_partitions = write_data(
+            df=build_ticker_features(daily, history),
+            s3_output_bucket=s3_output_bucket,
+            s3_output_prefix=features_prefix,
+            partition_keys=FEATURES_PARTITION_KEYS,
+            sort_columns=FEATURES_SORT_COLUMNS,
+            parquet_options=parquet_options
+    )
+    if catalog_mode == 'none':
+        return
+    create_table_if_not_exists(
+            database_name=database_name,
+            table_name=table_name,
+            s3_output_bucket=s3_output_bucket,
+            s3_output_prefix=features_prefix,
+            aws_region=aws_region,
+            columns=FEATURES_CATALOG_COLUMNS,
+            partition_keys=FEATURES_CATALOG_PARTITIONS
+    )
+    if catalog_mode == 'msck':
+        msck_repair_table(database_name=database_name, table_name=table_name)
+        touch_table(database_name, table_name, aws_region)
+    else:
+        register_partitions(
+                database_name=database_name,
+                table_name=table_name,
+                s3_output_bucket=s3_output_bucket,
+                s3_output_prefix=features_prefix,
+                partitions=written_partitions,
+                partition_keys=FEATURES_PARTITION_KEYS,
+                aws_region=aws_region
+        )
+
 def msck_repair_table(database_name: str, table_name: str) -> None:
     """
     Executa o comando MSCK REPAIR TABLE via Athena usando awswrangler.
@@ -227,19 +1245,182 @@ def msck_repair_table(database_name: str, table_name: str) -> None:
         wr.athena.start_query_execution(
             sql=f"MSCK REPAIR TABLE {database_name}.{table_name}",
             database=database_name,
-            workgroup="primary"
+            workgroup="primary",
+            wait=True
         )
         logger.info("MSCK REPAIR TABLE executado com sucesso.")
     except Exception as e:
         logger.error(f"Erro ao executar MSCK REPAIR TABLE: {e}")
         raise
 
+def run_pipeline(spark: SparkSession, args: Dict[str, str]) -> None:
+    """
+    Executa o pipeline do job (leitura da raw, refinamento, escrita, catálogo e features) com os
+    argumentos já resolvidos. Separado de main() para rodar também em uma SparkSession local.
+    As métricas por etapa (STAGE_METRICS) são emitidas ao final, inclusive em caso de erro.
+    """
+    stage_metrics = instrumentation.StageMetrics(
+        STAGE_METRICS_COMPONENT, enabled=is_enabled(args['STAGE_METRICS']), fmt=args['STAGE_METRICS_FORMAT']
+    )
+    correlation_id = stage_metrics.start(args['CORRELATION_ID'] or None)
+    logger.info(f"Correlation id: {correlation_id}")
+    try:
+        refine_raw_zone(spark, args, stage_metrics)
+    finally:
+        stage_metrics.flush()
+
+def refine_raw_zone(spark: SparkSession, args: Dict[str, str], stage_metrics: instrumentation.StageMetrics) -> None:
+    """
+    Corpo do run_pipeline. A avaliação preguiçosa do Spark junta leitura dos arquivos, transformação e escrita
+    em uma única ação: 'read' mede listagem e planejamento, 'write_refined' mede a transformação e a escrita.
+    """
+    row_group_size_mb = int(args['ROW_GROUP_SIZE_MB']) if args['ROW_GROUP_SIZE_MB'] else None
+    features_table = args['FEATURES_TABLE_NAME'] or f"{args['TABLE_NAME']}_features"
+    features_prefix = args['FEATURES_OUTPUT_PREFIX'] or default_features_prefix(args['S3_OUTPUT_PREFIX'])
+    if args['COMPACT_PREFIX']:
+        # Mesmo layout (ordenação e opções do writer) da tabela a que o prefixo pertence
+        if args['COMPACT_PREFIX'].lstrip('/').startswith(features_prefix.lstrip('/')):
+            table_name, sort_columns = features_table, FEATURES_SORT_COLUMNS
+            parquet_options = parquet_layout_options(row_group_size_mb, FEATURES_SORT_COLUMNS)
+        else:
+            table_name, sort_columns = args['TABLE_NAME'], parse_columns(args['SORT_COLUMNS'])
+            parquet_options = parquet_layout_options(row_group_size_mb, parse_columns(args['BLOOM_FILTER_COLUMNS']))
+        with stage_metrics.stage("compaction"):
+            compact_prefix(
+                    spark=spark,
+                    s3_bucket=args['S3_OUTPUT_BUCKET'],
+                    prefix=args['COMPACT_PREFIX'],
+                    staging_prefix=default_compaction_staging_prefix(args['S3_OUTPUT_PREFIX']),
+                    aws_region=args['AWS_REGION'],
+                    target_file_size_mb=int(args['TARGET_FILE_SIZE_MB']),
+                    sort_columns=sort_columns,
+                    parquet_options=parquet_options,
+                    database_name=args['DATABASE_NAME'] if args['CATALOG_MODE'] != 'none' else None,
+                    table_name=table_name
+            )
+        return
+
+    metrics = JobMetrics(enabled=is_enabled(args['DATA_QUALITY_CHECKS']))
+    raw_schema = args['RAW_SCHEMA']
+    incremental = is_enabled(args['INCREMENTAL'])
+    features = is_enabled(args['FEATURES'])
+    if args['CATALOG_MODE'] != 'none':
+        with stage_metrics.stage("catalog"):
+            tables = [(args['TABLE_NAME'], args['S3_OUTPUT_PREFIX'], REFINED_CATALOG_PARTITIONS)]
+            if features:
+                tables.append((features_table, features_prefix, FEATURES_CATALOG_PARTITIONS))
+            for table_name, prefix, catalog_partitions in tables:
+                ensure_partition_keys(
+                        database_name=args['DATABASE_NAME'],
+                        table_name=table_name,
+                        s3_bucket=args['S3_OUTPUT_BUCKET'],
+                        s3_prefix=prefix,
+                        catalog_partitions=catalog_partitions,
+                        aws_region=args['AWS_REGION'],
+                        migrate=is_enabled(args['MIGRATE_PARTITION_KEYS'])
+                )
+    with stage_metrics.stage("read"):
+        if incremental:
+            raw_root = raw_table_root(args['OBJECT_KEY'])
+            watermark_key = args['WATERMARK_KEY'] or default_watermark_key(args['S3_OUTPUT_PREFIX'])
+            current_partitions = list_raw_partitions(args['S3_BUCKET'], raw_root, args['AWS_REGION'])
+            processed_partitions = load_watermark(args['S3_OUTPUT_BUCKET'], watermark_key, args['AWS_REGION'])
+            pending = select_pending_partitions(current_partitions, processed_partitions)
+            if not pending:
+                logger.info("Nenhuma partição raw nova ou alterada. Nada a processar.")
+                return
+            df = read_partitions(spark=spark, s3_bucket=args['S3_BUCKET'], raw_root=raw_root, partitions=pending, raw_schema=raw_schema)
+        elif args['PARTITIONS']:
+            df = read_partitions(
+                spark=spark, s3_bucket=args['S3_BUCKET'], raw_root=raw_table_root(args['OBJECT_KEY']),
+                partitions=parse_partitions(args['PARTITIONS']), raw_schema=raw_schema
+            )
+        else:
+            df = read_data(
+                spark=spark, s3_bucket=args['S3_BUCKET'], object_key=args['OBJECT_KEY'],
+                start_date=args['START_DATE'] or None, end_date=args['END_DATE'] or None, raw_schema=raw_schema
+            )
+        apply_parallelism_profile(spark, df, args['PARALLELISM_PROFILE'])
+    with stage_metrics.stage("write_refined") as stage:
+        processed_df = process_data(df=df, metrics=metrics)
+        if features:
+            # Reaproveitado pela tabela de features: cache apenas do resultado filtrado e projetado
+            processed_df = processed_df.persist(StorageLevel.MEMORY_AND_DISK)
+        agg_df = aggregate_data(df=processed_df, metrics=metrics)
+        written_partitions = write_data(
+                df= agg_df,
+                s3_output_bucket=args['S3_OUTPUT_BUCKET'],
+                s3_output_prefix= args['S3_OUTPUT_PREFIX'],
+                partition_keys=REFINED_PARTITION_KEYS,
+                max_records_per_file=int(args['MAX_RECORDS_PER_FILE']),
+                sort_columns=parse_columns(args['SORT_COLUMNS']),
+                parquet_options=parquet_layout_options(row_group_size_mb, parse_columns(args['BLOOM_FILTER_COLUMNS']))
+        )
+        quality_metrics = metrics.log()
+        # Linhas só são conhecidas com DATA_QUALITY_CHECKS (Observation calculada na própria escrita)
+        stage.rows = quality_metrics.get("aggregated_groups", 0)
+    stage_metrics.add("read", rows=quality_metrics.get("input_rows", 0), calls=0)
+
+    with stage_metrics.stage("catalog"):
+        if args['CATALOG_MODE'] != 'none':
+            create_table_if_not_exists(
+                    database_name=args['DATABASE_NAME'],
+                    table_name=args['TABLE_NAME'],
+                    s3_output_bucket=args['S3_OUTPUT_BUCKET'],
+                    s3_output_prefix= args['S3_OUTPUT_PREFIX'],
+                    aws_region=args['AWS_REGION']
+            )
+
+        if args['CATALOG_MODE'] == 'msck':
+            msck_repair_table(database_name=args['DATABASE_NAME'],table_name=args['TABLE_NAME'])
+            touch_table(args['DATABASE_NAME'], args['TABLE_NAME'], args['AWS_REGION'])
+        elif args['CATALOG_MODE'] == 'partitions':
+            register_partitions(
+                    database_name=args['DATABASE_NAME'],
+                    table_name=args['TABLE_NAME'],
+                    s3_output_bucket=args['S3_OUTPUT_BUCKET'],
+                    s3_output_prefix=args['S3_OUTPUT_PREFIX'],
+                    partitions=written_partitions,
+                    partition_keys=REFINED_PARTITION_KEYS,
+                    aws_region=args['AWS_REGION']
+            )
+    if features:
+        with stage_metrics.stage("features"):
+            update_ticker_features(
+                    spark=spark,
+                    processed_df=processed_df,
+                    database_name=args['DATABASE_NAME'],
+                    table_name=features_table,
+                    s3_output_bucket=args['S3_OUTPUT_BUCKET'],
+                    features_prefix=features_prefix,
+                    aws_region=args['AWS_REGION'],
+                    catalog_mode=args['CATALOG_MODE'],
+                    parquet_options=parquet_layout_options(row_group_size_mb, FEATURES_SORT_COLUMNS)
+            )
+        processed_df.unpersist()
+    if incremental:
+        with stage_metrics.stage("watermark"):
+            processed_partitions.update({partition: current_partitions[partition] for partition in pending})
+            save_watermark(args['S3_OUTPUT_BUCKET'], watermark_key, processed_partitions, args['AWS_REGION'])
+
 def main() -> None:
     """
     Função principal do Glue Job.
     """
     args = getResolvedOptions(sys.argv, REQUIRED_PARAMS)
     validate_params(args)
+    args.update(resolve_optional_params(sys.argv))
+    if args['CATALOG_MODE'] not in CATALOG_MODES:
+        raise ValueError(f"CATALOG_MODE inválido: {args['CATALOG_MODE']}. Use um de {CATALOG_MODES}")
+    if args['RAW_SCHEMA'] not in RAW_SCHEMAS:
+        raise ValueError(f"RAW_SCHEMA inválido: {args['RAW_SCHEMA']}. Use um de {RAW_SCHEMAS}")
+    if args['PARALLELISM_PROFILE'] not in PARALLELISM_PROFILES:
+        raise ValueError(f"PARALLELISM_PROFILE inválido: {args['PARALLELISM_PROFILE']}. Use um de {PARALLELISM_PROFILES}")
+    if args['STAGE_METRICS_FORMAT'] not in instrumentation.METRICS_FORMATS:
+        raise ValueError(f"STAGE_METRICS_FORMAT inválido: {args['STAGE_METRICS_FORMAT']}. Use um de {list(instrumentation.METRICS_FORMATS)}")
+    if args['CORRELATION_ID'] and not all(
+            instrumentation.is_valid_correlation_id(value) for value in args['CORRELATION_ID'].split(",")):
+        raise ValueError(f"CORRELATION_ID inválido: {args['CORRELATION_ID']}")
 
     logger.info(f"Iniciando o job Glue: {args['JOB_NAME']}")
     logger.info(f"Argumentos do job Glue: {args}")
@@ -249,26 +1430,7 @@ def main() -> None:
         spark = glueContext.spark_session
         job = Job(glueContext)
         job.init(args['JOB_NAME'], args)
-
-        df = read_data(spark=spark, s3_bucket=args['S3_BUCKET'], object_key=args['OBJECT_KEY'])
-        processed_df = process_data(df=df)
-        agg_df = aggregate_data(df=processed_df)
-        write_data(
-                df= agg_df,
-                s3_output_bucket=args['S3_OUTPUT_BUCKET'],
-                s3_output_prefix= args['S3_OUTPUT_PREFIX'],
-                partition_keys=["year", "month", "day", "nom_setor"]
-        )
-
-        create_table_if_not_exists(
-                database_name=args['DATABASE_NAME'],
-                table_name=args['TABLE_NAME'],
-                s3_output_bucket=args['S3_OUTPUT_BUCKET'],
-                s3_output_prefix= args['S3_OUTPUT_PREFIX'],
-                aws_region=args['AWS_REGION']
-        )
-
-        msck_repair_table(database_name=args['DATABASE_NAME'],table_name=args['TABLE_NAME'])
+        run_pipeline(spark, args)
         job.commit()
         logger.info("Job Glue finalizado com sucesso.")
 
@@ -0,0 +1,386 @@
+import os
+import sys
+import uuid
+import logging
+import numbers
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+from datetime import date, datetime, timezone
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Dict, List, Optional
+
+# Configuração de logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Engine leve (pandas/pyarrow) da camada refined: mesma limpeza, renomeação, conversões, cálculo
+# de datas e agregação do glue-refined-zone-bovespa.py, para dias pequenos sem subir um cluster Spark.
+
+REQUIRED_PARAMS: List[str] = [
+    'JOB_NAME',
+    'TABLE_NAME',
+    'DATABASE_NAME',
+    'S3_BUCKET',
+    'OBJECT_KEY',
+    'S3_OUTPUT_BUCKET',
+    'S3_OUTPUT_PREFIX',
+    'AWS_REGION'
+]
+
+EXPECTED_COLUMNS: List[str] = [
+    "results_segment", "results_asset", "results_cod", "results_type",
+    "results_theoricalQty", "results_part", "results_partAcum", "header_date"
+]
+
+RAW_PARTITION_KEYS: List[str] = ["year", "month", "day"]
+
+# Partição raw (abaixo do dia) com o índice da B3; partições sem ela são do DEFAULT_INDEX
+RAW_INDEX_COLUMN = "index"
+DEFAULT_INDEX = "IBOV"
+
+REFINED_PARTITION_KEYS: List[str] = ["year", "month", "day", "cod_indice", "nom_setor"]
+
+COLUMN_RENAMES: Dict[str, str] = {
+    "results_segment": "nom_setor",
+    "results_asset": "nom_empresa",
+    "results_cod": "cod_acao",
+    "results_type": "des_tipo_acao",
+    "results_theoricalQty": "qtd_teorica",
+    "results_part": "perc_participacao_setor",
+    "results_partAcum": "perc_participacao_setor_acumulada",
+    "header_date": "data_ref",
+    RAW_INDEX_COLUMN: "cod_indice"
+}
+
+# Ordem e tipos das colunas gravadas, iguais aos produzidos pelo Spark (decimal(5,3) -> avg decimal(9,7))
+REFINED_SCHEMA: pa.Schema = pa.schema([
+    ("nom_empresa", pa.string()),
+    ("qtd_registros", pa.int64()),
+    ("qtd_acao", pa.int64()),
+    ("qtd_tipos_acao", pa.int64()),
+    ("qtd_teorica_acumulada", pa.int64()),
+    ("qtd_teorica_max", pa.int64()),
+    ("qtd_teorica_min", pa.int64()),
+    ("avg_participacao_setor_total", pa.decimal128(9, 7)),
+    ("avg_participacao_setor_acumulada_total", pa.decimal128(9, 7)),
+    ("qtd_dias_atraso", pa.int32()),
+    ("data_ref", pa.date32()),
+    ("dth_etl_processamento", pa.timestamp("us", tz="UTC")),
+    ("year", pa.int32()),
+    ("month", pa.int32()),
+    ("day", pa.int32()),
+    ("cod_indice", pa.string()),
+    ("nom_setor", pa.string())
+])
+
+# Tipos do catálogo Glue, iguais aos de create_table_if_not_exists no job Spark
+CATALOG_COLUMNS_TYPES: Dict[str, str] = {
+    "nom_empresa": "string",
+    "qtd_registros": "bigint",
+    "qtd_acao": "bigint",
+    "qtd_tipos_acao": "bigint",
+    "qtd_teorica_acumulada": "bigint",
+    "qtd_teorica_max": "bigint",
+    "qtd_teorica_min": "bigint",
+    "qtd_dias_atraso": "int",
+    "avg_participacao_setor_total": "decimal(9,7)",
+    "avg_participacao_setor_acumulada_total": "decimal(9,7)",
+    "data_ref": "date",
+    "dth_etl_processamento": "timestamp"
+}
+CATALOG_PARTITIONS_TYPES: Dict[str, str] = {"year": "int", "month": "int", "day": "int", "cod_indice": "string", "nom_setor": "string"}
+
+# Parâmetro da tabela atualizado a cada escrita catalogada (mesmo do job Spark, lido por refined_zone_query)
+LAST_WRITE_PARAMETER = "last_write_at"
+
+# Caracteres escapados pelo Spark/Hive nos nomes de diretório de partição (ExternalCatalogUtils.escapePathName)
+_SPARK_ESCAPED_CHARS = set('"#%\'*/:=?\\\x7f{[]^') | {chr(code) for code in range(0x01, 0x20)}
+
+def validate_schema(df: pd.DataFrame, expected_columns: List[str]) -> None:
+    """
+    Valida se o DataFrame possui todas as colunas esperadas.
+    """
+    missing = [col for col in expected_columns if col not in df.columns]
+    if missing:
+        logger.error(f"Colunas esperadas ausentes: {missing}")
+        raise ValueError(f"Colunas esperadas ausentes: {missing}")
+
+def resolve_filesystem(path: str) -> tuple:
+    """
+    Resolve o filesystem pyarrow (S3 ou local) e o caminho sem esquema para 'path'.
+    """
+    if "://" in path:
+        return pafs.FileSystem.from_uri(path)
+    return pafs.LocalFileSystem(), os.path.abspath(path)
+
+def raw_table_root(path: str) -> str:
+    """
+    Retorna a raiz da tabela raw a partir de um caminho que pode apontar para um arquivo,
+    uma partição (year=/month=/day=) ou a própria raiz (mesma regra do job Spark).
+    """
+    index = path.find(f"{RAW_PARTITION_KEYS[0]}=")
+    root = path[:index] if index >= 0 else path
+    return root if not root or root.endswith('/') else root + '/'
+
+def parse_partitions(value: str) -> List[str]:
+    """
+    Converte o parâmetro PARTITIONS ('year=2025/month=7/day=14,...') na lista de partições raw.
+    """
+    partitions = sorted({partition.strip().strip('/') for partition in value.split(',') if partition.strip()})
+    for partition in partitions:
+        parts = partition.split('/')
+        if len(parts) != len(RAW_PARTITION_KEYS) or not all(
+                part.startswith(f"{name}=") for part, name in zip(parts, RAW_PARTITION_KEYS)):
+            raise ValueError(f"Partição inválida em PARTITIONS: {partition}. Formato esperado: year=AAAA/month=M/day=D")
+    return partitions
+
+def _read_source(path: str, base_dir: str) -> pd.DataFrame:
+    """
+    Lê um caminho da raw (raiz, partição ou arquivo) com as colunas de partição relativas a 'base_dir',
+    como o basePath do Spark, projetando apenas as colunas usadas.
+    """
+    filesystem, source_path = resolve_filesystem(path)
+    _, base_path = resolve_filesystem(base_dir)
+    partitioning = ds.partitioning(
+        pa.schema([(column, pa.int32()) for column in RAW_PARTITION_KEYS] + [(RAW_INDEX_COLUMN, pa.string())]),
+        flavor="hive"
+    )
+    dataset = ds.dataset(
+        source_path, filesystem=filesystem, format="parquet", partitioning=partitioning,
+        partition_base_dir=base_path.rstrip('/'), exclude_invalid_files=False, ignore_prefixes=["_", "."]
+    )
+    columns = [column for column in EXPECTED_COLUMNS + RAW_PARTITION_KEYS + [RAW_INDEX_COLUMN] if column in dataset.schema.names]
+    # Inteiros da raw tipada ficam como Int64 (com nulos), sem passar por float
+    return dataset.to_table(columns=columns).to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+
+def read_data(path: str, start_date: Optional[str] = None, end_date: Optional[str] = None,
+              partitions: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Lê a camada raw (s3:// ou local) projetando apenas as colunas usadas. 'path' pode ser a raiz da tabela,
+    uma partição ou um arquivo: as colunas year/month/day/index vêm sempre dos diretórios abaixo da raiz.
+    Com 'partitions' (formato de PARTITIONS), lê apenas essas partições sob a raiz; opcionalmente filtra
+    as partições pelo intervalo de datas (YYYY-MM-DD).
+    """
+    root = raw_table_root(path)
+    sources = [f"{root}{partition}/" for partition in partitions] if partitions else [path]
+    logger.info(f"Lendo dados de: {sources}")
+    df = pd.concat([_read_source(source, root) for source in sources], ignore_index=True)
+    if start_date or end_date:
+        partition_date = pd.to_datetime(df[RAW_PARTITION_KEYS].astype("Int64").astype(str).agg("-".join, axis=1), errors="coerce")
+        mask = pd.Series(True, index=df.index)
+        if start_date:
+            mask &= partition_date >= pd.Timestamp(date.fromisoformat(start_date))
+        if end_date:
+            mask &= partition_date <= pd.Timestamp(date.fromisoformat(end_date))
+        df = df[mask].reset_index(drop=True)
+    logger.info(f"Dados lidos com sucesso. Número de registros: {len(df)}")
+    return df
+
+def _parse_decimal(value, precision: int = 5, scale: int = 3) -> Optional[Decimal]:
+    """
+    Converte '2,802' (raw legada) ou um Decimal já convertido na extração em Decimal com a mesma
+    semântica do cast do Spark para decimal(5,3): arredondamento HALF_UP e nulo em caso de valor
+    inválido ou estouro de precisão.
+    """
+    if value is None:
+        return None
+    try:
+        number = value if isinstance(value, Decimal) else Decimal(value.replace(",", ".").strip())
+        number = number.quantize(Decimal(1).scaleb(-scale), rounding=ROUND_HALF_UP)
+    except (InvalidOperation, AttributeError):
+        return None
+    if not number.is_finite() or abs(number) >= Decimal(10) ** (precision - scale):
+        return None
+    return number
+
+def _parse_bigint(value) -> Optional[int]:
+    """
+    Converte '1.482.105.837' em inteiro, removendo pontos e espaços (nulo se inválido).
+    Inteiros já convertidos na extração são mantidos.
+    """
+    if value is None:
+        return None
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    cleaned = value.replace(".", "").replace(" ", "")
+    try:
+        number = int(cleaned.strip())
+    except ValueError:
+        return None
+    return number if -(2 ** 63) <= number < 2 ** 63 else None
+
+def _parse_date(value: Optional[str]) -> Optional[date]:
+    """
+    Converte 'dd/MM/yy' em data, com o ano de dois dígitos no século 2000 (mesmo padrão do Spark).
+    """
+    try:
+        day, month, year = value.strip().split("/")
+        return date(2000 + int(year) if len(year) == 2 else int(year), int(month), int(day))
+    except (ValueError, AttributeError):
+        return None
+
+def process_data(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Realiza o processamento e limpeza dos dados.
+    """
+    logger.info("Processando dados...")
+    validate_schema(df, EXPECTED_COLUMNS)
+    columns = [column for column in EXPECTED_COLUMNS + RAW_PARTITION_KEYS if column in df.columns]
+    # Partições raw anteriores à coluna 'index' são do DEFAULT_INDEX
+    raw_index = df[RAW_INDEX_COLUMN] if RAW_INDEX_COLUMN in df.columns else pd.Series(None, index=df.index, dtype=object)
+    df = df[columns].assign(**{RAW_INDEX_COLUMN: raw_index.astype(object).where(raw_index.notna(), DEFAULT_INDEX)})
+    qtd_total = len(df)
+    # Apenas as colunas de dados: year/month/day são recalculados a partir de data_ref
+    df = df.dropna(subset=EXPECTED_COLUMNS).rename(columns=COLUMN_RENAMES)
+    logger.info(f"Linhas removidas por valores nulos: {qtd_total - len(df)}")
+
+    result = pd.DataFrame(index=df.index)
+    for column in ["cod_indice", "nom_setor", "nom_empresa", "cod_acao", "des_tipo_acao"]:
+        result[column] = df[column].astype(object).str.strip(" ")
+    result["qtd_teorica"] = pd.array([_parse_bigint(value) for value in df["qtd_teorica"]], dtype="Int64")
+    for column in ["perc_participacao_setor", "perc_participacao_setor_acumulada"]:
+        result[column] = [_parse_decimal(value) for value in df[column]]
+    result["data_ref"] = [_parse_date(value) for value in df["data_ref"]]
+    result["year"] = pd.array([value.year if value else None for value in result["data_ref"]], dtype="Int32")
+    result["month"] = pd.array([value.month if value else None for value in result["data_ref"]], dtype="Int32")
+    result["day"] = pd.array([value.day if value else None for value in result["data_ref"]], dtype="Int32")
+    logger.info(f"Processamento de dados concluído. Registros finais: {len(result)}")
+    return result.reset_index(drop=True)
+
+def _avg_decimal(values: pd.Series) -> Optional[Decimal]:
+    """
+    Média de decimal(5,3) com o resultado em decimal(9,7), como o avg do Spark (HALF_UP).
+    """
+    valid = [value for value in values if value is not None]
+    if not valid:
+        return None
+    return (sum(valid, Decimal(0)) / Decimal(len(valid))).quantize(Decimal("0.0000001"), rounding=ROUND_HALF_UP)
+
+def aggregate_data(df: pd.DataFrame, processing_time: Optional[datetime] = None) -> pd.DataFrame:
+    """
+    Realiza a agregação dos dados por índice, setor, empresa e data de referência.
+    """
+    processing_time = processing_time or datetime.now(timezone.utc)
+    group_keys = ["cod_indice", "nom_setor", "nom_empresa", "data_ref", "year", "month", "day"]
+    grouped = df.groupby(group_keys, dropna=False, sort=False)
+    agg_df = grouped.agg(
+        qtd_registros=("cod_acao", "count"),
+        qtd_acao=("cod_acao", "nunique"),
+        qtd_tipos_acao=("des_tipo_acao", "nunique"),
+        qtd_teorica_acumulada=("qtd_teorica", lambda values: values.sum(min_count=1)),
+        qtd_teorica_max=("qtd_teorica", "max"),
+        qtd_teorica_min=("qtd_teorica", "min"),
+        avg_participacao_setor_total=("perc_participacao_setor", _avg_decimal),
+        avg_participacao_setor_acumulada_total=("perc_participacao_setor_acumulada", _avg_decimal)
+    ).reset_index()
+    processing_date = processing_time.date()
+    agg_df["dth_etl_processamento"] = pd.Timestamp(processing_time)
+    agg_df["qtd_dias_atraso"] = [
+        (value - processing_date).days if value is not None else None for value in agg_df["data_ref"]
+    ]
+    agg_df = agg_df[REFINED_SCHEMA.names]
+    logger.info(f"Agregação de dados concluída. Registros agregados: {len(agg_df)}")
+    return agg_df
+
+def to_refined_table(df: pd.DataFrame) -> pa.Table:
+    """
+    Converte o DataFrame agregado para uma pyarrow.Table com os tipos da tabela refinada.
+    """
+    return pa.Table.from_pandas(df, schema=REFINED_SCHEMA, preserve_index=False)
+
+def escape_partition_value(value) -> str:
+    """
+    Escapa o valor de partição como o Spark/Hive, para gerar os mesmos diretórios do job Spark.
+    """
+    if value is None or value == "" or (isinstance(value, float) and pd.isna(value)):
+        return "__HIVE_DEFAULT_PARTITION__"
+    return "".join(f"%{ord(char):02X}" if char in _SPARK_ESCAPED_CHARS else char for char in str(value))
+
+def write_data(df: pd.DataFrame, output_path: str, partition_keys: List[str] = REFINED_PARTITION_KEYS,
+               compression: str = "snappy") -> List[Dict[str, str]]:
+    """
+    Grava o DataFrame agregado em Parquet particionado no mesmo layout do job Spark, substituindo
+    apenas as partições presentes (equivalente ao overwrite dinâmico). Retorna as partições gravadas.
+    """
+    filesystem, root_path = resolve_filesystem(output_path)
+    df = df.reset_index(drop=True)
+    table = to_refined_table(df)
+    data_columns = [name for name in table.schema.names if name not in partition_keys]
+    written = []
+    for values, group in df.groupby(partition_keys, dropna=False, sort=True):
+        partition = dict(zip(partition_keys, values))
+        relative = "/".join(f"{key}={escape_partition_value(partition[key])}" for key in partition_keys)
+        partition_dir = f"{root_path.rstrip('/')}/{relative}"
+        filesystem.delete_dir_contents(partition_dir, missing_dir_ok=True)
+        if isinstance(filesystem, pafs.LocalFileSystem):
+            filesystem.create_dir(partition_dir, recursive=True)
+        part_table = table.take(pa.array(group.index.to_numpy())).select(data_columns)
+        pq.write_table(
+            part_table, f"{partition_dir}/part-{uuid.uuid4().hex}.{compression}.parquet",
+            filesystem=filesystem, compression=compression
+        )
+        written.append({"path": f"{output_path.rstrip('/')}/{relative}/", **{key: str(value) for key, value in partition.items()}})
+    logger.info(f"{len(written)} partições gravadas em {output_path}")
+    return written
+
+def register_partitions(database_name: str, table_name: str, output_path: str,
+                        written: List[Dict[str, str]], boto3_session=None) -> None:
+    """
+    Cria a tabela no catálogo Glue, se necessário, registra apenas as partições gravadas e marca
+    a escrita no parâmetro LAST_WRITE_PARAMETER da tabela.
+    """
+    import awswrangler as wr
+
+    if not wr.catalog.does_table_exist(database=database_name, table=table_name, boto3_session=boto3_session):
+        logger.info(f"Tabela {table_name} não existe. Criando tabela no catálogo Glue...")
+        wr.catalog.create_parquet_table(
+            database=database_name, table=table_name, path=output_path,
+            columns_types=CATALOG_COLUMNS_TYPES, partitions_types=CATALOG_PARTITIONS_TYPES,
+            compression="snappy", boto3_session=boto3_session
+        )
+    partitions_values = {
+        item["path"]: [item[key] for key in CATALOG_PARTITIONS_TYPES] for item in written
+    }
+    if partitions_values:
+        wr.catalog.add_parquet_partitions(
+            database=database_name, table=table_name, partitions_values=partitions_values,
+            compression="snappy", boto3_session=boto3_session
+        )
+        logger.info(f"{len(partitions_values)} partições registradas em {database_name}.{table_name}.")
+        wr.catalog.upsert_table_parameters(
+            parameters={LAST_WRITE_PARAMETER: datetime.now(timezone.utc).isoformat()},
+            database=database_name, table=table_name, catalog_versioning=False, boto3_session=boto3_session
+        )
+
+def main() -> None:
+    """
+    Função principal para execução como job Glue Python shell (sem Spark).
+    """
+    from awsglue.utils import getResolvedOptions
+
+    args = getResolvedOptions(sys.argv, REQUIRED_PARAMS)
+    missing = [param for param in REQUIRED_PARAMS if not args.get(param)]
+    if missing:
+        logger.error(f"Parâmetros obrigatórios ausentes: {missing}")
+        raise ValueError(f"Parâmetros obrigatórios ausentes: {missing}")
+
+    logger.info(f"Iniciando o job Glue (engine pandas): {args['JOB_NAME']}")
+    output_path = f"s3://{args['S3_OUTPUT_BUCKET']}/{args['S3_OUTPUT_PREFIX']}"
+    # PARTITIONS é opcional: quando informado, lê apenas essas partições sob a raiz do OBJECT_KEY
+    partitions = parse_partitions(getResolvedOptions(sys.argv, ['PARTITIONS'])['PARTITIONS']) \
+        if '--PARTITIONS' in sys.argv else None
+    df = read_data(f"s3://{args['S3_BUCKET']}/{args['OBJECT_KEY']}", partitions=partitions)
+    agg_df = aggregate_data(process_data(df))
+    written = write_data(agg_df, output_path)
+    register_partitions(args['DATABASE_NAME'], args['TABLE_NAME'], output_path, written)
+    logger.info("Job Glue (engine pandas) finalizado com sucesso.")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        logger.error(f"Falha na execução do job: {e}")
+        raise
@@ -0,0 +1,243 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import awswrangler as wr
+import boto3
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+from botocore.exceptions import ClientError
+
+# Configuração de logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Consultas às tabelas da camada refined (dashboards e notebook) com reaproveitamento de resultados:
+# result reuse do Athena + cache em disco invalidado quando há uma nova escrita nas tabelas consultadas.
+# A invalidação é por tabela, não por partição: qualquer escrita catalogada na tabela invalida todas
+# as consultas sobre ela, mesmo as que filtram partições que não mudaram.
+
+DEFAULT_DATABASE = "db_default"
+DEFAULT_WORKGROUP = "primary"
+
+# Idade máxima de um resultado reaproveitado (result reuse do Athena e cache local)
+DEFAULT_MAX_AGE_MINUTES = 60
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bovespa-athena")
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Tempo em que o watermark de uma tabela é reaproveitado sem consultar o catálogo
+WATERMARK_TTL_SECONDS = 60
+
+# Parâmetro da tabela no catálogo atualizado pelos jobs da camada refined a cada escrita catalogada
+# (glue-refined-zone-bovespa.py e refined_zone_pandas.py)
+LAST_WRITE_PARAMETER = "last_write_at"
+
+# Tabelas referenciadas após FROM/JOIN: "db"."tabela", db.tabela ou tabela
+_TABLE_PATTERN = re.compile(r'\b(?:from|join)\s+((?:"[^"]+"|\w+)(?:\s*\.\s*(?:"[^"]+"|\w+))?)', re.IGNORECASE)
+_QUOTED_OR_SPACE = re.compile(r"('(?:[^']|'')*'|\"[^\"]*\")|\s+")
+
+_watermarks: Dict[Tuple[str, str], Tuple[float, str]] = {}
+
+def normalize_sql(sql: str) -> str:
+    """
+    Normaliza a SQL para a chave do cache: espaços e quebras de linha colapsados (fora de literais)
+    e sem ';' final, para que a mesma consulta formatada de outro jeito reaproveite o resultado.
+    """
+    normalized = _QUOTED_OR_SPACE.sub(lambda match: match.group(1) or " ", sql).strip()
+    return normalized.rstrip(";").strip()
+
+def referenced_tables(sql: str, default_database: str = DEFAULT_DATABASE) -> List[Tuple[str, str]]:
+    """
+    Lista as tabelas (banco, tabela) referenciadas após FROM/JOIN na consulta.
+    """
+    tables = set()
+    for match in _TABLE_PATTERN.finditer(sql):
+        parts = [part.strip().strip('"').lower() for part in match.group(1).split(".")]
+        database, table = (parts[0], parts[1]) if len(parts) == 2 else (default_database, parts[0])
+        tables.add((database, table))
+    return sorted(tables)
+
+def table_watermark(database: str, table: str, boto3_session: Optional[boto3.Session] = None) -> str:
+    """
+    Impressão digital da última escrita na tabela: UpdateTime do catálogo Glue e o parâmetro
+    LAST_WRITE_PARAMETER, atualizados pelos jobs a cada partição gravada ou reescrita. Custa um
+    get_table, independente do número de partições. Retorna '' para nomes que não são tabelas do
+    catálogo (ex.: CTEs).
+    """
+    cached = _watermarks.get((database, table))
+    if cached and time.monotonic() - cached[0] < WATERMARK_TTL_SECONDS:
+        return cached[1]
+    glue = (boto3_session or boto3).client("glue")
+    try:
+        metadata = glue.get_table(DatabaseName=database, Name=table)["Table"]
+        updated = metadata.get("UpdateTime") or metadata.get("CreateTime")
+        last_write = metadata.get("Parameters", {}).get(LAST_WRITE_PARAMETER, "")
+        watermark = hashlib.sha256(f"{updated.isoformat() if updated else ''}|{last_write}".encode("utf-8")).hexdigest()
+    except ClientError:
+        watermark = ""
+    _watermarks[(database, table)] = (time.monotonic(), watermark)
+    return watermark
+
+def reset_watermarks() -> None:
+    """Descarta os watermarks em memória para que a próxima consulta releia o catálogo."""
+    _watermarks.clear()
+
+def tag_sql(sql: str, watermarks: Dict[str, str]) -> str:
+    """
+    Acrescenta os watermarks à SQL enviada ao Athena como comentário final. O result reuse do Athena só
+    reaproveita consultas com o texto idêntico: após uma nova escrita na tabela o texto muda e a consulta é
+    reexecutada.
+    """
+    if not any(watermarks.values()):
+        return sql
+    digest = hashlib.sha256(json.dumps(watermarks, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return f"{sql.rstrip().rstrip(';').rstrip()}\n-- watermark: {digest}"
+
+def cache_key(sql: str, watermarks: Dict[str, str]) -> str:
+    """
+    Chave do cache: SQL normalizada + watermark de cada tabela consultada.
+    """
+    payload = json.dumps({"sql": normalize_sql(sql), "watermarks": watermarks}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class QueryCache:
+    """
+    Cache em disco dos resultados (Parquet + metadados JSON por entrada), com expiração por idade
+    e remoção das entradas menos usadas quando o tamanho total passa de max_bytes.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+                 max_age_minutes: int = DEFAULT_MAX_AGE_MINUTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_minutes * 60
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        return os.path.join(self.cache_dir, f"{key}.parquet"), os.path.join(self.cache_dir, f"{key}.json")
+
+    def _remove(self, key: str) -> None:
+        for path in self._paths(key):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _entries(self) -> List[Dict]:
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-len(".json")]
+            data_path, meta_path = self._paths(key)
+            try:
+                with open(meta_path, encoding="utf-8") as f:
+                    meta = json.load(f)
+                size = os.path.getsize(data_path) + os.path.getsize(meta_path)
+            except (OSError, ValueError):
+                self._remove(key)
+                continue
+            entries.append({"key": key, "meta": meta, "size": size, "last_access": os.stat(data_path).st_atime})
+        return entries
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """Retorna o resultado em cache, se existir e não tiver expirado."""
+        data_path, meta_path = self._paths(key)
+        if not os.path.exists(meta_path) or not os.path.exists(data_path):
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if time.time() - meta["created_at"] > self.max_age_seconds:
+            self._remove(key)
+            return None
+        now = time.time()
+        os.utime(data_path, (now, os.stat(data_path).st_mtime))
+        return pd.read_parquet(data_path)
+
+    def put(self, key: str, df: pd.DataFrame, sql: str, watermarks: Dict[str, str]) -> None:
+        """Grava o resultado e remove as entradas menos usadas se o cache passar do limite de tamanho."""
+        data_path, meta_path = self._paths(key)
+        df.to_parquet(data_path, index=False)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({"sql": normalize_sql(sql), "watermarks": watermarks, "created_at": time.time()}, f)
+        self.evict()
+
+    def invalidate(self, watermarks: Dict[str, str]) -> int:
+        """
+        Remove apenas as entradas que consultam alguma das tabelas informadas com um watermark diferente
+        do atual. Entradas de outras tabelas continuam válidas.
+
+        A invalidação é por tabela: o watermark muda a cada escrita catalogada na tabela, sem indicar quais
+        partições foram gravadas, então uma entrada que filtra só partições antigas também é removida. Isso
+        evita interpretar os filtros de partição de cada SQL; o custo é reexecutar algumas consultas cujo
+        resultado não mudou.
+        """
+        removed = 0
+        for entry in self._entries():
+            stale = [
+                table for table, watermark in entry["meta"]["watermarks"].items()
+                if table in watermarks and watermarks[table] != watermark
+            ]
+            if stale:
+                self._remove(entry["key"])
+                removed += 1
+        if removed:
+            logger.info(f"{removed} entradas do cache invalidadas por nova escrita nas tabelas consultadas.")
+        return removed
+
+    def evict(self) -> int:
+        """Remove as entradas menos usadas até o cache caber em max_bytes."""
+        entries = sorted(self._entries(), key=lambda entry: entry["last_access"])
+        total = sum(entry["size"] for entry in entries)
+        removed = 0
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(entry["key"])
+            total -= entry["size"]
+            removed += 1
+        return removed
+
+    def clear(self) -> None:
+        """Remove todas as entradas do cache."""
+        for entry in self._entries():
+            self._remove(entry["key"])
+
+def read_sql_query(sql: str, database: str = DEFAULT_DATABASE, workgroup: str = DEFAULT_WORKGROUP,
+                   max_age_minutes: int = DEFAULT_MAX_AGE_MINUTES, cache: Optional[QueryCache] = None,
+                   boto3_session: Optional[boto3.Session] = None) -> pd.DataFrame:
+    """
+    Executa a consulta no Athena reaproveitando resultados: primeiro o cache local (se informado),
+    chaveado pela SQL normalizada e pelo watermark de escrita das tabelas consultadas; depois o
+    result reuse do próprio Athena, com idade máxima de max_age_minutes, sobre a SQL marcada com os
+    mesmos watermarks (tag_sql) para que um resultado anterior à última escrita não seja reaproveitado.
+    """
+    watermarks = {
+        f"{table_database}.{table}": table_watermark(table_database, table, boto3_session)
+        for table_database, table in referenced_tables(sql, database)
+    }
+    key = cache_key(sql, watermarks)
+    if cache is not None:
+        cache.invalidate(watermarks)
+        cached = cache.get(key)
+        if cached is not None:
+            logger.info(f"Resultado reaproveitado do cache local ({key[:12]}).")
+            return cached
+
+    logger.info(f"Executando consulta no Athena (result reuse até {max_age_minutes} min).")
+    df = wr.athena.read_sql_query(
+        sql=tag_sql(sql, watermarks),
+        database=database,
+        workgroup=workgroup,
+        # O result reuse do Athena exige a consulta direta (sem CTAS/UNLOAD)
+        ctas_approach=False,
+        unload_approach=False,
+        result_reuse_configuration={
+            "ResultReuseByAgeConfiguration": {"Enabled": True, "MaxAgeInMinutes": max_age_minutes}
+        },
+        boto3_session=boto3_session
+    )
+    if cache is not None:
+        cache.put(key, df, sql, watermarks)
+    return df
@@ -0,0 +1,296 @@
+import time
+import random
+import logging
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import requests
+
+# Cliente HTTP da API da B3 usado pela lambda-extract-bovespa: limite de taxa (token bucket), concorrência
+# adaptativa (AIMD guiado por latência e por 429/5xx), respeito ao Retry-After e circuit breaker.
+# Empacotamento: incluir este arquivo ao lado do lambda_function.py.
+
+logger = logging.getLogger()
+
+# Respostas que indicam sobrecarga e são retentadas pelo cliente
+RETRY_STATUS = (429, 502, 503, 504)
+# Respostas que indicam falha do serviço e contam para o circuit breaker (429 é tratado só pelo limite de taxa)
+FAILURE_STATUS = (500, 502, 503, 504)
+
+# Configuração padrão do cliente (chave 'rate_limit' do evento). max_concurrency é definido pela Lambda
+# a partir do pool de conexões quando não informado
+DEFAULT_SETTINGS = {
+    "requests_per_second": 20.0,
+    "burst": None,
+    "initial_concurrency": 4,
+    "min_concurrency": 1,
+    "max_concurrency": 8,
+    "latency_tolerance": 2.0,
+    "max_attempts": 5,
+    "max_retry_after": 60.0,
+    "failure_threshold": 5,
+    "reset_timeout": 30.0
+}
+
+# Backoff exponencial com jitter (segundos) quando a resposta não traz Retry-After
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+# Fator de redução da concorrência em 429/5xx e em aumento de latência
+OVERLOAD_DECREASE = 0.5
+LATENCY_DECREASE = 0.9
+# Suavização da latência observada e deriva da latência de referência (sem carga)
+LATENCY_SMOOTHING = 0.2
+BASELINE_DRIFT = 0.01
+
+class CircuitOpenError(requests.RequestException):
+    """Requisição recusada sem chamar a B3: o circuit breaker está aberto."""
+
+def parse_retry_after(value: Optional[str], now: Optional[datetime] = None) -> Optional[float]:
+    """Converte o cabeçalho Retry-After (segundos ou data HTTP) em segundos de espera; None se ausente ou inválido."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max(0.0, (moment - (now or datetime.now(timezone.utc))).total_seconds())
+
+def backoff_delay(attempt: int) -> float:
+    """Espera antes da tentativa seguinte: backoff exponencial com full jitter."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+def client_retries(response) -> int:
+    """Retentativas feitas pelo B3Client até obter a resposta (0 para respostas de uma sessão comum)."""
+    retries = getattr(response, "client_retries", 0)
+    return retries if isinstance(retries, int) else 0
+
+class TokenBucket:
+    """
+    Limite de taxa compartilhado entre as threads: 'rate' requisições por segundo com rajadas de até 'burst'.
+    pause() suspende todas as requisições (Retry-After de um 429) e reinicia o balde vazio.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = max(1.0, burst or rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Aguarda um token e retorna o tempo de espera. Com rate=0 não há limite."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif not self.rate:
+                    return waited
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds: float) -> None:
+        """Suspende a emissão de tokens por 'seconds' (sem rajada ao retomar)."""
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self.paused_until:
+                self.paused_until = until
+                self.tokens = 0.0
+                self.updated = until
+
+class AdaptiveConcurrency:
+    """
+    Limite de requisições simultâneas ajustado por AIMD: cresce 1 a cada 'limit' respostas rápidas com o
+    limite ocupado e cai multiplicativamente em 429/5xx/erros de conexão ou quando a latência suavizada passa
+    de 'latency_tolerance' vezes a latência sem carga. As reduções acontecem no máximo uma vez por latência
+    observada, para que as respostas de uma mesma rajada não derrubem o limite várias vezes.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, latency_tolerance: float):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.baseline: Optional[float] = None
+        self.smoothed: Optional[float] = None
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        """Aguarda uma vaga dentro do limite atual."""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency: float, overloaded: bool = False) -> None:
+        """Libera a vaga e ajusta o limite com a latência da requisição e o sinal de sobrecarga."""
+        with self._condition:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if overloaded:
+                self._decrease(OVERLOAD_DECREASE, self.smoothed or latency)
+            else:
+                self.baseline = latency if self.baseline is None else \
+                    min(latency, self.baseline + (latency - self.baseline) * BASELINE_DRIFT)
+                self.smoothed = latency if self.smoothed is None else \
+                    self.smoothed + (latency - self.smoothed) * LATENCY_SMOOTHING
+                if self.smoothed > self.latency_tolerance * self.baseline:
+                    self._decrease(LATENCY_DECREASE, self.smoothed)
+                elif saturated:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def _decrease(self, factor: float, window: float) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < window:
+            return
+        self._last_decrease = now
+        limit = max(self.minimum, self.limit * factor)
+        if int(limit) < int(self.limit):
+            logger.warning(f"Concorrência com a B3 reduzida de {int(self.limit)} para {int(limit)}")
+        self.limit = limit
+
+class CircuitBreaker:
+    """
+    Abre após 'failure_threshold' falhas consecutivas da B3 (5xx, timeout ou conexão) e recusa as requisições
+    por 'reset_timeout' segundos. Depois disso, deixa passar uma requisição de teste: sucesso fecha o circuito,
+    falha o reabre.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_request(self) -> None:
+        """Lança CircuitOpenError se o circuito está aberto (ou se já há uma requisição de teste em curso)."""
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return
+            raise CircuitOpenError(f"Circuit breaker da API da B3 aberto após {self.failures} falhas consecutivas.")
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != "closed":
+                logger.info("Circuit breaker da API da B3 fechado.")
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"Circuit breaker da API da B3 aberto por {self.reset_timeout}s após {self.failures} falhas.")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def record_neutral(self) -> None:
+        """Resposta que não indica saúde nem falha do serviço (ex.: 429): apenas libera o teste em curso."""
+        with self._lock:
+            self._probing = False
+
+class B3Client:
+    """
+    Envolve a sessão HTTP com o mesmo get() de requests.Session, aplicando limite de taxa, concorrência
+    adaptativa, Retry-After e circuit breaker. O estado aprendido é compartilhado entre as threads e pode ser
+    reaproveitado entre invocações quentes (a sessão pode ser trocada em 'session').
+    Com stream=True a vaga de concorrência é liberada ao receber os cabeçalhos.
+    """
+
+    def __init__(self, session: requests.Session, **settings):
+        unknown = set(settings) - set(DEFAULT_SETTINGS)
+        if unknown:
+            raise ValueError(f"Opções desconhecidas do cliente da B3: {sorted(unknown)}")
+        self.settings = {**DEFAULT_SETTINGS, **settings}
+        self.session = session
+        self.bucket = TokenBucket(self.settings["requests_per_second"], self.settings["burst"])
+        self.concurrency = AdaptiveConcurrency(
+            self.settings["initial_concurrency"], self.settings["min_concurrency"],
+            self.settings["max_concurrency"], self.settings["latency_tolerance"]
+        )
+        self.breaker = CircuitBreaker(self.settings["failure_threshold"], self.settings["reset_timeout"])
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """
+        Executa o GET com até 'max_attempts' tentativas. Retorna a última resposta (o chamador usa
+        raise_for_status) ou relança o último erro de conexão. Um Retry-After maior que 'max_retry_after'
+        encerra as tentativas.
+        """
+        max_attempts = max(1, int(self.settings["max_attempts"]))
+        for attempt in range(1, max_attempts + 1):
+            self.breaker.before_request()
+            self.bucket.acquire()
+            self.concurrency.acquire()
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.concurrency.release(time.monotonic() - start, overloaded=True)
+                self.breaker.record_failure()
+                if attempt == max_attempts:
+                    raise
+                logger.warning(f"Erro de conexão com a B3 (tentativa {attempt}/{max_attempts}): {e}")
+                time.sleep(backoff_delay(attempt))
+                continue
+            except Exception:
+                self.concurrency.release(time.monotonic() - start)
+                self.breaker.record_neutral()
+                raise
+
+            latency = time.monotonic() - start
+            if response.status_code not in RETRY_STATUS:
+                self.concurrency.release(latency)
+                self.breaker.record_success()
+                response.client_retries = attempt - 1
+                return response
+
+            self.concurrency.release(latency, overloaded=True)
+            if response.status_code in FAILURE_STATUS:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_neutral()
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            response.client_retries = attempt - 1
+            if attempt == max_attempts or (retry_after or 0) > self.settings["max_retry_after"]:
+                return response
+            if retry_after is not None and response.status_code == 429:
+                # O 429 vale para o cliente inteiro: todas as threads aguardam o Retry-After
+                self.bucket.pause(retry_after)
+            delay = retry_after if retry_after is not None else backoff_delay(attempt)
+            logger.warning(f"B3 respondeu {response.status_code}; nova tentativa em {delay:.2f}s ({attempt}/{max_attempts})")
+            response.close()
+            time.sleep(delay)
+        return response
+
+    def close(self) -> None:
+        self.session.close()
@@ -1,18 +1,108 @@
+from __future__ import annotations
+
 import os
 import logging
+import importlib
 import requests
 import base64
 import json
 import urllib
-import pandas as pd
-import awswrangler as wr
-from datetime import datetime
-from requests.adapters import HTTPAdapter, Retry
+import uuid
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, date, timedelta, timezone
+from requests.adapters import HTTPAdapter
+
+# Módulo compartilhado (src/shared), empacotado junto com a Lambda
+import instrumentation
+# Cliente HTTP da B3 (b3_client.py, ao lado deste arquivo)
+import b3_client
 
 # Logging estruturado
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+class _LazyModule:
+    """
+    Adia o import de um módulo pesado até o primeiro acesso a um atributo,
+    reduzindo o cold start e o custo de caminhos que não usam o módulo (ex.: validação 400).
+    """
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+pd = _LazyModule("pandas")
+pa = _LazyModule("pyarrow")
+pc = _LazyModule("pyarrow.compute")
+pafs = _LazyModule("pyarrow.fs")
+pq = _LazyModule("pyarrow.parquet")
+wr = _LazyModule("awswrangler")
+# Dependência opcional, usada apenas no modo stream (incluir 'ijson' no pacote/layer da Lambda)
+ijson = _LazyModule("ijson")
+
+# Sessão HTTP reaproveitada entre invocações quentes da Lambda
+_session = None
+_session_pool_maxsize = 0
+# Cliente da B3 sobre a sessão; o limite de concorrência aprendido e o circuit breaker valem entre invocações quentes
+_client = None
+
+# Métricas por etapa e correlation id da invocação (STAGE_METRICS, STAGE_METRICS_FORMAT, STAGE_METRICS_NAMESPACE)
+_stage_metrics = instrumentation.StageMetrics.from_env("lambda-extract-bovespa")
+
+# Número máximo de páginas buscadas em paralelo no modo all_pages
+DEFAULT_MAX_WORKERS = 8
+
+# Camada raw particionada por data e, dentro do dia, pelo índice consultado (coluna 'index')
+PARTITION_COLS = ["year", "month", "day", "index"]
+
+# Configuração padrão do modo backfill
+BACKFILL_DEFAULT_CONCURRENCY = 4
+BACKFILL_DEFAULT_DATE_PARAM = "date"
+BACKFILL_DEFAULT_DATE_FORMAT = "%Y-%m-%d"
+
+# Quantidade de itens de 'results' convertidos e gravados por vez no modo stream
+STREAM_BATCH_SIZE = 10000
+
+# Manifesto gravado em cada partição raw com o hash do payload (ignorado pelo Spark por começar com '_')
+MANIFEST_FILE = "_manifest.json"
+
+# Arquivo dos payloads originais da B3 (JSON comprimido com zstd) lido pelo modo replay,
+# e quantidade de dias reconstruídos por escrita Parquet no replay
+ARCHIVE_SUFFIX = ".json.zst"
+ARCHIVE_COMPRESSION = "zstd"
+REPLAY_DEFAULT_CHUNK_DAYS = 31
+
+# Mapeamento coluna de saída -> chave no JSON da B3, na ordem gravada na camada raw
+PAGE_FIELDS = [
+    ("page_pageNumber", "pageNumber"), ("page_pageSize", "pageSize"),
+    ("page_totalRecords", "totalRecords"), ("page_totalPages", "totalPages")
+]
+HEADER_FIELDS = [
+    ("header_date", "date"), ("header_text", "text"), ("header_part", "part"),
+    ("header_partAcum", "partAcum"), ("header_textReductor", "textReductor"),
+    ("header_reductor", "reductor"), ("header_theoricalQty", "theoricalQty")
+]
+RESULT_FIELDS = [
+    ("results_segment", "segment"), ("results_cod", "cod"), ("results_asset", "asset"),
+    ("results_type", "type"), ("results_part", "part"), ("results_partAcum", "partAcum"),
+    ("results_theoricalQty", "theoricalQty")
+]
+
+# Campos numéricos de 'results' convertidos uma única vez na ingestão a partir do formato brasileiro
+# ('2,802' e '1.482.105.837'). Valores inválidos viram nulos, como no cast do Spark.
+DECIMAL_FIELDS = ["results_part", "results_partAcum"]
+INTEGER_FIELDS = ["results_theoricalQty"]
+RAW_DECIMAL_PRECISION = 9
+RAW_DECIMAL_SCALE = 3
+
+# Campos de baixa cardinalidade gravados como dictionary (Arrow) / category (pandas)
+CATEGORICAL_FIELDS = ["results_segment", "results_type"] + [column for column, _ in HEADER_FIELDS]
+
 def decode_api_params(api_token:str) -> dict:
     decoded_bytes = base64.b64decode(api_token)
     return json.loads(urllib.parse.unquote(decoded_bytes.decode('utf-8')))
@@ -44,86 +134,897 @@ def build_b3_url(api_conf: dict) -> str:
         raise ValueError(f"URL malformada detectada: {url}")
     return url
 
+def index_confs(api_conf: dict) -> list:
+    """
+    Expande 'api.parameters' em uma configuração por par índice/segmento. 'index' e 'segment'
+    aceitam um valor ou uma lista; um 'segment' único vale para todos os índices.
+    """
+    params = api_conf["parameters"]
+    indices = params["index"] if isinstance(params["index"], list) else [params["index"]]
+    segments = params["segment"] if isinstance(params["segment"], list) else [params["segment"]] * len(indices)
+    return [
+        {**api_conf, "parameters": {**params, "index": index, "segment": segment}}
+        for index, segment in zip(indices, segments)
+    ]
+
+def tag_pages(pages: list, index: str) -> list:
+    """Marca cada página com o índice consultado (a resposta da B3 não traz o índice)."""
+    for page in pages:
+        if page:
+            page["index"] = index
+    return pages
+
 def get_portfolio_day(api_conf: dict, session: requests.Session) -> dict:
-    """Consulta a API da B3 e retorna o JSON, usando a função de montagem e validação da URL."""
+    """
+    Consulta a API da B3 e retorna o JSON, usando a função de montagem e validação da URL.
+    Qualquer erro é relançado: a página nunca é devolvida vazia.
+    """
     try:
-        url = build_b3_url(api_conf)
-        response = session.get(
-            url,
-            timeout=api_conf.get("timeout", 60),
-            headers=api_conf.get("headers", {"Content-Type": "application/json"})
-        )
-        response.raise_for_status()
-        return response.json()
+        with _stage_metrics.stage("build_url"):
+            url = build_b3_url(api_conf)
+        with _stage_metrics.stage("http_fetch") as stage:
+            response = session.get(
+                url,
+                timeout=api_conf.get("timeout", 60),
+                headers=api_conf.get("headers", {"Content-Type": "application/json"})
+            )
+            stage.retries = instrumentation.http_retries(response) + b3_client.client_retries(response)
+            stage.bytes = len(response.content)
+            response.raise_for_status()
+            json_data = response.json()
+            stage.rows = len(json_data.get("results") or []) if isinstance(json_data, dict) else 0
+        return json_data
     except requests.RequestException as e:
         logger.error(f"Erro na requisição HTTP: {e}")
         raise
     except Exception as e:
-        logger.error(f"Erro ao montar a URL da API: {e}")
+        logger.error(f"Erro ao consultar a API da B3: {e}")
+        raise
+
+def require_pages(pages: list) -> list:
+    """
+    Garante que todas as páginas foram obtidas. Uma página sem resposta não pode ser descartada: a escrita
+    substitui a partição do índice e o dedup registraria o snapshot parcial como completo no manifesto.
+    """
+    missing = sum(1 for page in pages if page is None)
+    if missing:
+        raise RuntimeError(f"{missing} de {len(pages)} páginas da B3 sem resposta. Escrita cancelada.")
+    return pages
+
+def get_portfolio_all_pages(api_conf: dict, session: requests.Session, max_workers: int = DEFAULT_MAX_WORKERS) -> list:
+    """
+    Consulta a primeira página da API da B3, lê o 'page.totalPages' e busca as demais páginas
+    concorrentemente sobre a mesma sessão. Retorna a lista de JSONs ordenada por página.
+    """
+    first_conf = {**api_conf, "parameters": {**api_conf["parameters"], "pageNumber": 1}}
+    first_page = get_portfolio_day(first_conf, session)
+    if not first_page:
+        return [first_page]
+    total_pages = int(first_page.get("page", {}).get("totalPages") or 1)
+    if total_pages <= 1:
+        return [first_page]
+
+    page_confs = [
+        {**api_conf, "parameters": {**api_conf["parameters"], "pageNumber": page_number}}
+        for page_number in range(2, total_pages + 1)
+    ]
+    logger.info(f"Buscando {total_pages - 1} páginas adicionais com até {max_workers} workers")
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(page_confs)))) as executor:
+        other_pages = list(executor.map(lambda conf: get_portfolio_day(conf, session), page_confs))
+    return [first_page] + other_pages
+
+def get_portfolio_indices(api_conf: dict, session: requests.Session, all_pages: bool = False,
+                          max_workers: int = DEFAULT_MAX_WORKERS) -> list:
+    """
+    Consulta os pares índice/segmento de 'api.parameters' concorrentemente sobre a mesma sessão
+    e marca as páginas com o índice. Retorna as páginas na ordem dos índices.
+    """
+    def fetch(conf: dict) -> list:
+        if all_pages:
+            pages = get_portfolio_all_pages(conf, session, max_workers=max_workers)
+        else:
+            pages = [get_portfolio_day(conf, session)]
+        return tag_pages(pages, conf["parameters"]["index"])
+
+    confs = index_confs(api_conf)
+    if len(confs) == 1:
+        return fetch(confs[0])
+    logger.info(f"Buscando {len(confs)} índices com até {max_workers} workers")
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(confs)))) as executor:
+        return [page for pages in executor.map(fetch, confs) for page in pages]
+
+def parse_br_decimal(values: pa.Array, precision: int = RAW_DECIMAL_PRECISION, scale: int = RAW_DECIMAL_SCALE) -> pa.Array:
+    """
+    Converte de forma vetorizada strings no formato brasileiro ('1.234,567') em decimal(precision, scale),
+    com arredondamento HALF_UP e nulo para valores inválidos ou que estouram a precisão.
+    """
+    text = pc.replace_substring(pc.replace_substring(pc.utf8_trim_whitespace(values), ".", ""), ",", ".")
+    valid = pc.match_substring_regex(text, r"^[+-]?\d{1,20}(\.\d{1,18})?$")
+    number = pc.if_else(valid, text, pa.scalar(None, pa.string())).cast(pa.decimal128(38, 18))
+    number = pc.round(number, ndigits=scale, round_mode="half_towards_infinity")
+    fits = pc.less(pc.abs(number), pa.scalar(10 ** (precision - scale)).cast(number.type))
+    return pc.if_else(fits, number, pa.scalar(None, number.type)).cast(pa.decimal128(precision, scale))
+
+def parse_br_integer(values: pa.Array) -> pa.Array:
+    """
+    Converte de forma vetorizada strings como '1.482.105.837' em int64 (nulo se inválido).
+    """
+    text = pc.replace_substring_regex(pc.utf8_trim_whitespace(values), r"[. ]", "")
+    valid = pc.match_substring_regex(text, r"^[+-]?\d{1,18}$")
+    return pc.if_else(valid, text, pa.scalar(None, pa.string())).cast(pa.int64())
+
+def typed_column(column: str, values) -> pa.Array:
+    """
+    Monta a coluna Arrow tipada da camada raw: numéricos convertidos, baixa cardinalidade como dictionary.
+    """
+    array = pa.array(values, pa.string())
+    if column in DECIMAL_FIELDS:
+        return parse_br_decimal(array)
+    if column in INTEGER_FIELDS:
+        return parse_br_integer(array)
+    if column in CATEGORICAL_FIELDS:
+        return array.dictionary_encode()
+    return array
+
+def raw_dtypes() -> dict:
+    """Tipos (Athena) dos campos numéricos da camada raw, usados na escrita pelo awswrangler."""
+    decimal_type = f"decimal({RAW_DECIMAL_PRECISION},{RAW_DECIMAL_SCALE})"
+    return {**{column: decimal_type for column in DECIMAL_FIELDS}, **{column: "bigint" for column in INTEGER_FIELDS}}
 
 def portfolio_day_to_df(json_data: dict) -> pd.DataFrame:
-    """Converte o JSON da B3 em DataFrame."""
+    """
+    Converte o JSON da B3 em DataFrame com o esquema tipado da camada raw: campos numéricos convertidos
+    (DECIMAL_FIELDS/INTEGER_FIELDS) e campos de baixa cardinalidade como category.
+    A conversão é feita por coluna: a data do header é lida uma única vez e os campos de 'page' e
+    'header' são replicados como constantes, sem montar um dicionário por linha.
+    """
     try:
         page_info = json_data['page']
         header_info = json_data['header']
-        rows = []
-        for result_item in json_data.get('results', []):
-            date_partition = datetime.strptime(header_info['date'], '%d/%m/%y')
-            row = {
-                'page_pageNumber': page_info.get('pageNumber'),
-                'page_pageSize': page_info.get('pageSize'),
-                'page_totalRecords': page_info.get('totalRecords'),
-                'page_totalPages': page_info.get('totalPages'),
-                'header_date': header_info.get('date'),
-                'header_text': header_info.get('text'),
-                'header_part': header_info.get('part'),
-                'header_partAcum': header_info.get('partAcum'),
-                'header_textReductor': header_info.get('textReductor'),
-                'header_reductor': header_info.get('reductor'),
-                'header_theoricalQty': header_info.get('theoricalQty'),
-                'results_segment': result_item.get('segment'),
-                'results_cod': result_item.get('cod'),
-                'results_asset': result_item.get('asset'),
-                'results_type': result_item.get('type'),
-                'results_part': result_item.get('part'),
-                'results_partAcum': result_item.get('partAcum'),
-                'results_theoricalQty': result_item.get('theoricalQty'),
-                "year": date_partition.year,
-                "month": date_partition.month,
-                "day": date_partition.day
-            }
-            rows.append(row)
-        if not rows:
-            logger.warning("Nenhum dado encontrado em 'results'.")
-        return pd.DataFrame(rows)
+        results = json_data.get('results', [])
+        date_partition = datetime.strptime(header_info['date'], '%d/%m/%y')
     except KeyError as e:
         logger.error(f"JSON está faltando a Key: {e}")
         raise ValueError(f"JSON está faltando a Key: {e}")
 
-def validate_event(event: dict) -> tuple:
-    """Valida se todos os parâmetros obrigatórios foram fornecidos corretamente."""
-    required_fields = ["s3_bucket", "s3_prefix", "api"]
-    missing = [field for field in required_fields if field not in event or not event[field]]
-    if missing:
-        logger.error(f"Parâmetros obrigatórios ausentes: {missing}")
-        return False, f"Parâmetros obrigatórios ausentes: {missing}"
+    if not results:
+        logger.warning("Nenhum dado encontrado em 'results'.")
+        return pd.DataFrame()
+
+    length = len(results)
+    columns = {}
+    for column, key in PAGE_FIELDS:
+        columns[column] = [page_info.get(key)] * length
+    for column, key in HEADER_FIELDS:
+        columns[column] = [header_info.get(key)] * length
+    for column, key in RESULT_FIELDS:
+        columns[column] = [item.get(key) for item in results]
+    columns["index"] = [json_data.get('index')] * length
+    columns["year"] = [date_partition.year] * length
+    columns["month"] = [date_partition.month] * length
+    columns["day"] = [date_partition.day] * length
+    for column in DECIMAL_FIELDS + INTEGER_FIELDS:
+        columns[column] = typed_column(column, columns[column]).to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+    df = pd.DataFrame(columns)
+    df[CATEGORICAL_FIELDS] = df[CATEGORICAL_FIELDS].astype("category")
+    return df
+
+def portfolio_pages_to_df(pages: list) -> pd.DataFrame:
+    """Converte uma lista de JSONs da B3 (uma ou mais páginas) em um único DataFrame."""
+    frames = [portfolio_day_to_df(json_data) for json_data in pages]
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+def _constant_column(value, length: int, value_type: pa.DataType) -> pa.Array:
+    """
+    Replica um valor constante em uma coluna Arrow sem materializar cópias por linha.
+    Strings viram colunas dictionary-encoded com um único valor no dicionário.
+    """
+    if pa.types.is_string(value_type) and value is None:
+        return pa.nulls(length, pa.dictionary(pa.int32(), pa.string()))
+    if value is None:
+        return pa.nulls(length, value_type)
+    if pa.types.is_string(value_type):
+        indices = pa.repeat(pa.scalar(0, pa.int32()), length)
+        return pa.DictionaryArray.from_arrays(indices, pa.array([value], pa.string()))
+    return pa.repeat(pa.scalar(value, value_type), length)
+
+def portfolio_day_to_table(json_data: dict) -> pa.Table:
+    """
+    Converte o JSON da B3 em uma pyarrow.Table de forma colunar.
+    Os campos de 'page' e 'header' são transmitidos uma única vez como colunas constantes, e os de
+    'results' seguem o mesmo esquema tipado de portfolio_day_to_df.
+    """
+    try:
+        page_info = json_data['page']
+        header_info = json_data['header']
+        results = json_data.get('results', [])
+        length = len(results)
+        date_partition = datetime.strptime(header_info['date'], '%d/%m/%y')
+    except KeyError as e:
+        logger.error(f"JSON está faltando a Key: {e}")
+        raise ValueError(f"JSON está faltando a Key: {e}")
+
+    if not results:
+        logger.warning("Nenhum dado encontrado em 'results'.")
+
+    columns = {}
+    for column, key in PAGE_FIELDS:
+        columns[column] = _constant_column(page_info.get(key), length, pa.int64())
+    for column, key in HEADER_FIELDS:
+        columns[column] = _constant_column(header_info.get(key), length, pa.string())
+    for column, key in RESULT_FIELDS:
+        columns[column] = typed_column(column, [item.get(key) for item in results])
+    columns["index"] = _constant_column(json_data.get("index"), length, pa.string())
+    columns["year"] = _constant_column(date_partition.year, length, pa.int64())
+    columns["month"] = _constant_column(date_partition.month, length, pa.int64())
+    columns["day"] = _constant_column(date_partition.day, length, pa.int64())
+    return pa.table(columns)
+
+def portfolio_pages_to_table(pages: list) -> pa.Table:
+    """Converte uma lista de JSONs da B3 em uma única pyarrow.Table."""
+    tables = [portfolio_day_to_table(json_data) for json_data in pages]
+    tables = [table for table in tables if table.num_rows > 0]
+    if not tables:
+        return pa.table({})
+    return tables[0] if len(tables) == 1 else pa.concat_tables(tables)
+
+def resolve_filesystem(path: str) -> tuple:
+    """Resolve o filesystem pyarrow (S3 ou local) e o caminho sem esquema para 'path'."""
+    if "://" in path:
+        return pafs.FileSystem.from_uri(path)
+    return pafs.LocalFileSystem(), os.path.abspath(path)
+
+def raw_file_prefix() -> str:
+    """
+    Prefixo dos arquivos da camada raw com o correlation id da invocação ('<id>_'), que a Lambda de trigger
+    repassa ao job Glue. Vazio fora de uma invocação do handler.
+    """
+    correlation_id = _stage_metrics.correlation_id
+    return f"{correlation_id}_" if correlation_id else ""
+
+def write_table_to_parquet(table: pa.Table, path: str, partition_cols: list = PARTITION_COLS, compression: str = "snappy") -> None:
+    """
+    Grava a pyarrow.Table como dataset Parquet particionado (s3:// ou caminho local),
+    substituindo apenas as partições presentes na tabela.
+    """
+    filesystem, root_path = resolve_filesystem(path)
+    pq.write_to_dataset(
+        table,
+        root_path=root_path,
+        partition_cols=partition_cols,
+        filesystem=filesystem,
+        compression=compression,
+        existing_data_behavior="delete_matching",
+        basename_template=f"{raw_file_prefix()}{uuid.uuid4().hex}-{{i}}.{compression}.parquet"
+    )
+
+def iter_portfolio_batches(api_conf: dict, session: requests.Session, batch_size: int = STREAM_BATCH_SIZE, meta: dict = None):
+    """
+    Consulta a API da B3 com 'stream=True' e lê o corpo incrementalmente com ijson, gerando tuplas
+    (page, header, results) com no máximo 'batch_size' itens, sem carregar o JSON inteiro em memória.
+    Os campos de 'page' e 'header' também são preenchidos em 'meta', quando informado.
+    """
+    meta = meta if meta is not None else {}
+    page_info = meta.setdefault("page", {})
+    header_info = meta.setdefault("header", {})
+    url = build_b3_url(api_conf)
+    with session.get(
+        url,
+        timeout=api_conf.get("timeout", 60),
+        headers=api_conf.get("headers", {"Content-Type": "application/json"}),
+        stream=True
+    ) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        batch = []
+        item = None
+        for prefix, event, value in ijson.parse(response.raw):
+            if prefix == "results.item":
+                if event == "start_map":
+                    item = {}
+                elif event == "end_map":
+                    batch.append(item)
+                    if len(batch) >= batch_size and header_info:
+                        yield page_info, header_info, batch
+                        batch = []
+            elif prefix.startswith("results.item."):
+                item[prefix[len("results.item."):]] = value
+            elif prefix.startswith("page.") and event not in ("start_map", "end_map"):
+                page_info[prefix[len("page."):]] = value
+            elif prefix.startswith("header.") and event not in ("start_map", "end_map"):
+                header_info[prefix[len("header."):]] = value
+        if batch:
+            yield page_info, header_info, batch
+
+def _delete_other_files(filesystem, partition_dir: str, keep_path: str) -> None:
+    """Remove os arquivos antigos da partição, mantendo apenas o arquivo recém-gravado."""
+    selector = pafs.FileSelector(partition_dir, allow_not_found=True)
+    for info in filesystem.get_file_info(selector):
+        if info.type == pafs.FileType.File and info.path != keep_path:
+            filesystem.delete_file(info.path)
+
+def stream_portfolio_to_parquet(api_conf: dict, session: requests.Session, s3_path: str,
+                                batch_size: int = STREAM_BATCH_SIZE, all_pages: bool = False,
+                                compression: str = "snappy") -> int:
+    """
+    Grava a resposta da B3 em Parquet por lotes de 'batch_size' registros, mantendo a memória
+    constante independente do tamanho do payload. Com 'all_pages', as páginas seguintes são
+    lidas em sequência para o mesmo arquivo. Ao final, substitui os arquivos antigos da partição.
+    'api_conf' deve ter um único índice (ver index_confs). Retorna a quantidade de linhas gravadas.
+    """
+    index = api_conf["parameters"]["index"]
+    filesystem, root_path = resolve_filesystem(s3_path)
+    writer = None
+    file_path = None
+    partition_dir = None
+    rows = 0
+    page_number = 1 if all_pages else api_conf["parameters"]["pageNumber"]
+    total_pages = page_number
+    try:
+        while page_number <= total_pages:
+            page_conf = {**api_conf, "parameters": {**api_conf["parameters"], "pageNumber": page_number}}
+            meta = {}
+            for page_info, header_info, batch in iter_portfolio_batches(page_conf, session, batch_size, meta):
+                table = portfolio_day_to_table({"page": page_info, "header": header_info, "results": batch, "index": index})
+                day = datetime.strptime(header_info["date"], '%d/%m/%y')
+                day_dir = f"{root_path.rstrip('/')}/year={day.year}/month={day.month}/day={day.day}/index={index}"
+                if writer is None:
+                    partition_dir = day_dir
+                    file_path = f"{partition_dir}/{raw_file_prefix()}{uuid.uuid4().hex}-0.{compression}.parquet"
+                    if isinstance(filesystem, pafs.LocalFileSystem):
+                        filesystem.create_dir(partition_dir, recursive=True)
+                    data_schema = table.drop_columns(PARTITION_COLS).schema
+                    writer = pq.ParquetWriter(file_path, data_schema, filesystem=filesystem, compression=compression)
+                elif day_dir != partition_dir:
+                    raise ValueError(f"Páginas com datas diferentes no modo stream: {partition_dir} e {day_dir}")
+                writer.write_table(table.drop_columns(PARTITION_COLS))
+                rows += table.num_rows
+            if all_pages:
+                total_pages = int(meta.get("page", {}).get("totalPages") or 1)
+            page_number += 1
+    except Exception:
+        if writer is not None:
+            writer.close()
+            filesystem.delete_file(file_path)
+        raise
+
+    if writer is None:
+        logger.warning("Nenhum dado encontrado em 'results'.")
+        return 0
+    writer.close()
+    _delete_other_files(filesystem, partition_dir, file_path)
+    logger.info(f"{rows} registros gravados em lotes de {batch_size} no modo stream.")
+    return rows
+
+def write_pages(pages: list, s3_path: str, columnar: bool = False) -> int:
+    """
+    Converte as páginas da B3 e grava tudo em uma única escrita Parquet particionada.
+    Retorna a quantidade de linhas gravadas (0 quando não há dados e nada é escrito).
+    """
+    if columnar:
+        with _stage_metrics.stage("convert") as stage:
+            table = portfolio_pages_to_table(pages)
+            stage.rows = table.num_rows
+            stage.bytes = table.nbytes
+        if table.num_rows == 0:
+            logger.warning("Tabela retornada está vazia.")
+            return 0
+        with _stage_metrics.stage("s3_write") as stage:
+            write_table_to_parquet(table, s3_path)
+            stage.rows = table.num_rows
+        return table.num_rows
+
+    with _stage_metrics.stage("convert") as stage:
+        df = portfolio_pages_to_df(pages)
+        stage.rows = len(df)
+    if df.empty:
+        logger.warning("DataFrame retornado está vazio.")
+        return 0
+    with _stage_metrics.stage("s3_write") as stage:
+        wr.s3.to_parquet(
+            df=df,
+            path=s3_path,
+            dataset=True,
+            mode='overwrite_partitions',
+            partition_cols=PARTITION_COLS,
+            compression="snappy",
+            dtype=raw_dtypes(),
+            filename_prefix=raw_file_prefix() or None
+        )
+        stage.rows = len(df)
+    return len(df)
+
+def payload_hash(pages: list) -> str:
+    """
+    Calcula o hash canônico (SHA-256) de índice, 'header' e 'results' das páginas, independente da ordem
+    das chaves e das páginas, para detectar snapshots idênticos da B3.
+    """
+    ordered = sorted(pages, key=lambda page: (page.get("index") or "", page.get("page", {}).get("pageNumber") or 0))
+    canonical = [
+        {"index": page.get("index"), "header": page.get("header"), "results": page.get("results", [])}
+        for page in ordered
+    ]
+    encoded = json.dumps(canonical, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+def pages_partition_day(pages: list) -> date:
+    """Retorna o dia da partição (header.date) das páginas da B3."""
+    return datetime.strptime(pages[0]["header"]["date"], '%d/%m/%y').date()
+
+def manifest_path(s3_path: str, day: date, index: str) -> str:
+    """
+    Monta o caminho do manifesto da partição year/month/day/index. Um manifesto por índice permite
+    agendas separadas por índice sem que uma sobrescreva o manifesto da outra.
+    """
+    return f"{s3_path.rstrip('/')}/year={day.year}/month={day.month}/day={day.day}/index={index}/{MANIFEST_FILE}"
+
+def read_manifest(s3_path: str, day: date, index: str) -> dict:
+    """Lê o manifesto da partição. Retorna None se não existir ou não puder ser lido."""
+    filesystem, path = resolve_filesystem(manifest_path(s3_path, day, index))
+    try:
+        with filesystem.open_input_stream(path) as stream:
+            return json.loads(stream.read().decode('utf-8'))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Não foi possível ler o manifesto da partição {day}/{index}: {e}")
+        return None
+
+def write_manifest(s3_path: str, day: date, index: str, digest: str, rows: int) -> None:
+    """Grava o manifesto da partição após a escrita dos dados."""
+    filesystem, path = resolve_filesystem(manifest_path(s3_path, day, index))
+    manifest = {"sha256": digest, "rows": rows, "written_at": datetime.now(timezone.utc).isoformat()}
+    if isinstance(filesystem, pafs.LocalFileSystem):
+        filesystem.create_dir(os.path.dirname(path), recursive=True)
+    with filesystem.open_output_stream(path) as stream:
+        stream.write(json.dumps(manifest).encode('utf-8'))
 
-    api_conf = event["api"]
+def is_unchanged(s3_path: str, day: date, index: str, digest: str) -> bool:
+    """Indica se o hash do payload é igual ao registrado no manifesto da partição."""
+    manifest = read_manifest(s3_path, day, index)
+    return bool(manifest) and manifest.get("sha256") == digest
+
+def changed_pages(pages: list, s3_path: str, day: date) -> tuple:
+    """
+    Separa as páginas do dia por índice e descarta os índices cujo hash coincide com o manifesto da partição.
+    Retorna as páginas dos índices alterados e, para cada um deles, o hash e as linhas a registrar no manifesto.
+    """
+    by_index = {}
+    for page in pages:
+        by_index.setdefault(page.get("index"), []).append(page)
+    changed = []
+    digests = {}
+    for index, index_pages in by_index.items():
+        digest = payload_hash(index_pages)
+        if is_unchanged(s3_path, day, index, digest):
+            logger.info(f"Snapshot da B3 inalterado para {day}/{index}.")
+            continue
+        changed.extend(index_pages)
+        digests[index] = (digest, sum(len(page.get("results") or []) for page in index_pages))
+    return changed, digests
+
+def write_manifests(s3_path: str, day: date, digests: dict) -> None:
+    """Grava os manifestos dos índices escritos no dia (ver changed_pages)."""
+    for index, (digest, rows) in digests.items():
+        write_manifest(s3_path, day, index, digest, rows)
+
+def default_archive_prefix(s3_prefix: str) -> str:
+    """Prefixo padrão do arquivo de payloads, ao lado da camada raw (ex.: raw-zone/ -> raw-zone_archive/)."""
+    return f"{s3_prefix.rstrip('/')}_archive/"
+
+def params_digest(parameters: dict) -> str:
+    """Hash curto dos parâmetros da consulta (sem 'pageNumber'), que identifica o snapshot no arquivo."""
+    params = {key: value for key, value in parameters.items() if key != "pageNumber"}
+    encoded = json.dumps(params, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:16]
+
+def archive_day_dir(root_path: str, day: date) -> str:
+    """Diretório do dia no arquivo de payloads (mesmo particionamento year/month/day da camada raw)."""
+    return f"{root_path.rstrip('/')}/year={day.year}/month={day.month}/day={day.day}"
+
+def archive_pages(pages: list, api_conf: dict, archive_path: str) -> int:
+    """
+    Grava cada página da B3 como JSON comprimido com zstd em
+    <archive>/year=/month=/day=/index=/<hash dos parâmetros>-<página>.json.zst, removendo as páginas
+    que sobraram de uma gravação anterior do mesmo snapshot. Retorna a quantidade de arquivos gravados.
+    """
+    digests = {conf["parameters"]["index"]: params_digest(conf["parameters"]) for conf in index_confs(api_conf)}
+    filesystem, root_path = resolve_filesystem(archive_path)
+    written = {}
+    for page in pages:
+        if not page or not page.get("header", {}).get("date"):
+            continue
+        day = datetime.strptime(page["header"]["date"], '%d/%m/%y').date()
+        index = page["index"]
+        directory = f"{archive_day_dir(root_path, day)}/index={index}"
+        digest = digests[index]
+        page_number = int(page.get("page", {}).get("pageNumber") or 1)
+        path = f"{directory}/{digest}-{page_number:04d}{ARCHIVE_SUFFIX}"
+        # O índice não faz parte da resposta da B3: fica apenas no caminho
+        payload = {key: value for key, value in page.items() if key != "index"}
+        if isinstance(filesystem, pafs.LocalFileSystem):
+            filesystem.create_dir(directory, recursive=True)
+        with filesystem.open_output_stream(path, compression=ARCHIVE_COMPRESSION) as stream:
+            stream.write(json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+        written.setdefault((directory, digest), set()).add(path)
+
+    for (directory, digest), paths in written.items():
+        for info in filesystem.get_file_info(pafs.FileSelector(directory, allow_not_found=True)):
+            name = info.path.rsplit("/", 1)[-1]
+            if info.type == pafs.FileType.File and name.startswith(f"{digest}-") and info.path not in paths:
+                filesystem.delete_file(info.path)
+    files = sum(len(paths) for paths in written.values())
+    logger.info(f"{files} páginas arquivadas em {archive_path}")
+    return files
+
+def read_archived_day(archive_path: str, day: date) -> list:
+    """
+    Lê as páginas arquivadas de um dia (todos os índices), marcadas com o índice do caminho. Se o mesmo índice
+    tiver snapshots com parâmetros diferentes, usa o gravado por último. Retorna [] se o dia não foi arquivado.
+    """
+    filesystem, root_path = resolve_filesystem(archive_path)
+    selector = pafs.FileSelector(archive_day_dir(root_path, day), recursive=True, allow_not_found=True)
+    snapshots = {}
+    for info in filesystem.get_file_info(selector):
+        if info.type != pafs.FileType.File or not info.path.endswith(ARCHIVE_SUFFIX):
+            continue
+        index_dir, name = info.path.rsplit("/", 1)
+        snapshots.setdefault(index_dir, {}).setdefault(name.split("-", 1)[0], []).append(info)
+
+    pages = []
+    for index_dir, by_digest in sorted(snapshots.items()):
+        latest = max(by_digest.values(), key=lambda infos: max(info.mtime_ns or 0 for info in infos))
+        index = index_dir.rsplit("/index=", 1)[-1]
+        for info in sorted(latest, key=lambda info: info.path):
+            with filesystem.open_input_stream(info.path, compression=ARCHIVE_COMPRESSION) as stream:
+                page = json.loads(stream.read().decode('utf-8'))
+            page["index"] = index
+            pages.append(page)
+    return pages
+
+def days_report(statuses: dict, message: str) -> dict:
+    """Resposta do backfill e do replay: status de cada dia e lista 'failed_dates' para reprocessamento."""
+    report = [{"date": day.isoformat(), **statuses[day]} for day in sorted(statuses)]
+    failed_dates = [item["date"] for item in report if item["status"] in ("error", "date_mismatch")]
+    status_code = 207 if failed_dates else 200
+    logger.info(f"{message} Dias com falha: {failed_dates}")
+    return {
+        'statusCode': status_code,
+        'body': json.dumps({
+            "message": message,
+            "days": report,
+            "failed_dates": failed_dates
+        })
+    }
+
+def run_replay(replay_conf: dict, archive_path: str, s3_path: str, columnar: bool = False,
+               max_workers: int = DEFAULT_MAX_WORKERS) -> dict:
+    """
+    Reconstrói a camada raw a partir do arquivo de payloads, sem chamar a B3: lê e descomprime os dias em
+    paralelo e grava cada bloco de 'chunk_days' dias em uma única escrita Parquet particionada.
+    Dias sem payload arquivado são marcados como 'missing'. Retorna o status de cada dia.
+    """
+    days = backfill_days(replay_conf)
+    chunk_days = max(1, int(replay_conf.get("chunk_days", REPLAY_DEFAULT_CHUNK_DAYS)))
+    logger.info(f"Iniciando replay de {len(days)} dias de {archive_path} em blocos de {chunk_days} dias")
+
+    statuses = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(days)))) as executor:
+        for start in range(0, len(days), chunk_days):
+            chunk = days[start:start + chunk_days]
+            with _stage_metrics.stage("replay_read") as stage:
+                futures = {executor.submit(read_archived_day, archive_path, day): day for day in chunk}
+                chunk_pages = {}
+                for future in as_completed(futures):
+                    day = futures[future]
+                    try:
+                        pages = future.result()
+                    except Exception as e:
+                        logger.error(f"Erro ao ler o arquivo do dia {day}: {e}")
+                        statuses[day] = {"status": "error", "rows": 0, "error": str(e)}
+                        continue
+                    rows = sum(len(page.get("results", [])) for page in pages)
+                    statuses[day] = {"status": "ok" if rows else "missing", "rows": rows}
+                    chunk_pages[day] = pages
+                    stage.rows += rows
+            collected = [page for day in chunk for page in chunk_pages.get(day, [])]
+            try:
+                if any(page.get("results") for page in collected):
+                    write_pages(collected, s3_path, columnar=columnar)
+            except Exception as e:
+                logger.error(f"Erro ao gravar as partições do replay: {e}", exc_info=True)
+                for day in chunk:
+                    if statuses[day]["status"] == "ok":
+                        statuses[day] = {"status": "error", "rows": 0, "error": f"Erro na escrita: {e}"}
+    return days_report(statuses, "Replay do arquivo B3 finalizado.")
+
+def backfill_days(backfill_conf: dict) -> list:
+    """
+    Retorna a lista de dias do backfill: a lista explícita em 'dates' ou o intervalo
+    'start_date'..'end_date' (inclusive), ignorando fins de semana por padrão.
+    """
+    if backfill_conf.get("dates"):
+        return sorted({date.fromisoformat(day) for day in backfill_conf["dates"]})
+
+    start = date.fromisoformat(backfill_conf["start_date"])
+    end = date.fromisoformat(backfill_conf["end_date"])
+    skip_weekends = backfill_conf.get("skip_weekends", True)
+    days = []
+    current = start
+    while current <= end:
+        if not (skip_weekends and current.weekday() >= 5):
+            days.append(current)
+        current += timedelta(days=1)
+    return days
+
+def fetch_backfill_day(api_conf: dict, session: requests.Session, day: date, backfill_conf: dict,
+                       all_pages: bool = False, max_workers: int = DEFAULT_MAX_WORKERS) -> list:
+    """Consulta a API da B3 para um dia do backfill (todos os índices), injetando a data em 'api.parameters'."""
+    date_param = backfill_conf.get("date_param", BACKFILL_DEFAULT_DATE_PARAM)
+    date_format = backfill_conf.get("date_format", BACKFILL_DEFAULT_DATE_FORMAT)
+    day_conf = {**api_conf, "parameters": {**api_conf["parameters"], date_param: day.strftime(date_format)}}
+    return get_portfolio_indices(day_conf, session, all_pages=all_pages, max_workers=max_workers)
+
+def run_backfill(api_conf: dict, backfill_conf: dict, session: requests.Session, s3_path: str,
+                 columnar: bool = False, all_pages: bool = False, max_workers: int = DEFAULT_MAX_WORKERS,
+                 dedup: bool = False, archive_path: str = None) -> dict:
+    """
+    Executa o backfill: busca os dias em paralelo (limitado por 'max_concurrency'), grava todas as
+    partições year/month/day em uma única escrita e retorna o status de cada dia.
+    Com 'dedup', apenas os índices cujo hash difere do manifesto da partição são gravados, e dias sem
+    nenhum índice alterado são marcados como 'unchanged'.
+    Com 'archive_path', os payloads gravados também são arquivados para o modo replay.
+    """
+    days = backfill_days(backfill_conf)
+    concurrency = max(1, int(backfill_conf.get("max_concurrency", BACKFILL_DEFAULT_CONCURRENCY)))
+    logger.info(f"Iniciando backfill de {len(days)} dias com concorrência {concurrency}")
+
+    statuses = {}
+    collected = []
+    digests = {}
+    with ThreadPoolExecutor(max_workers=min(concurrency, max(1, len(days)))) as executor:
+        futures = {
+            executor.submit(fetch_backfill_day, api_conf, session, day, backfill_conf, all_pages, max_workers): day
+            for day in days
+        }
+        for future in as_completed(futures):
+            day = futures[future]
+            try:
+                pages = require_pages(future.result())
+                rows = sum(len(page.get("results", [])) for page in pages)
+                if rows == 0:
+                    statuses[day] = {"status": "empty", "rows": 0}
+                    continue
+                returned_day = datetime.strptime(pages[0]["header"]["date"], '%d/%m/%y').date()
+                if returned_day != day:
+                    logger.warning(f"API retornou {returned_day} para o dia {day} do backfill.")
+                    statuses[day] = {"status": "date_mismatch", "rows": 0, "returned_date": returned_day.isoformat()}
+                    continue
+                if dedup:
+                    pages, digests[day] = changed_pages(pages, s3_path, day)
+                    if not pages:
+                        statuses[day] = {"status": "unchanged", "rows": rows}
+                        continue
+                    rows = sum(len(page.get("results", [])) for page in pages)
+                collected.extend(pages)
+                statuses[day] = {"status": "ok", "rows": rows}
+            except Exception as e:
+                logger.error(f"Erro no backfill do dia {day}: {e}")
+                statuses[day] = {"status": "error", "rows": 0, "error": str(e)}
+
+    try:
+        if collected:
+            write_pages(collected, s3_path, columnar=columnar)
+            if archive_path:
+                with _stage_metrics.stage("archive") as stage:
+                    stage.rows = archive_pages(collected, api_conf, archive_path)
+            if dedup:
+                for day, status in statuses.items():
+                    if status["status"] == "ok":
+                        write_manifests(s3_path, day, digests[day])
+    except Exception as e:
+        logger.error(f"Erro ao gravar as partições do backfill: {e}", exc_info=True)
+        for day, status in statuses.items():
+            if status["status"] == "ok":
+                statuses[day] = {"status": "error", "rows": 0, "error": f"Erro na escrita: {e}"}
+
+    return days_report(statuses, "Backfill B3 finalizado.")
+
+def validate_positive_integers(conf: dict, fields: list, prefix: str = "") -> tuple:
+    """Valida que os campos informados em 'conf' são inteiros maiores ou iguais a 1."""
+    invalid = [
+        f"{prefix}{name}" for name in fields
+        if name in conf and (isinstance(conf[name], bool) or not isinstance(conf[name], int) or conf[name] < 1)
+    ]
+    if invalid:
+        return False, f"Os campos {invalid} devem ser inteiros maiores ou iguais a 1."
+    return True, ""
+
+def validate_backfill(backfill_conf: dict, field: str = "backfill") -> tuple:
+    """Valida a configuração de dias do modo backfill (ou do modo replay, com field='replay')."""
+    if not isinstance(backfill_conf, dict):
+        return False, f"O campo '{field}' deve ser um dicionário."
+    is_valid, msg = validate_positive_integers(backfill_conf, ["max_concurrency", "chunk_days"], f"{field}.")
+    if not is_valid:
+        return False, msg
+    try:
+        if backfill_conf.get("dates"):
+            [date.fromisoformat(day) for day in backfill_conf["dates"]]
+        else:
+            missing = [name for name in ["start_date", "end_date"] if not backfill_conf.get(name)]
+            if missing:
+                return False, f"Parâmetros obrigatórios ausentes em '{field}': {missing}"
+            if date.fromisoformat(backfill_conf["start_date"]) > date.fromisoformat(backfill_conf["end_date"]):
+                return False, f"'{field}.start_date' deve ser menor ou igual a '{field}.end_date'."
+    except (TypeError, ValueError) as e:
+        return False, f"Data inválida em '{field}' (use YYYY-MM-DD): {e}"
+    return True, ""
+
+def validate_indices(params: dict) -> tuple:
+    """Valida 'index' e 'segment' de 'api.parameters' (um valor ou uma lista, um segmento por índice)."""
+    indices = params["index"] if isinstance(params["index"], list) else [params["index"]]
+    if any(not isinstance(index, str) or not index.strip() for index in indices):
+        return False, "'api.parameters.index' deve ser um texto ou uma lista de textos não vazios."
+    if len(set(indices)) != len(indices):
+        return False, "'api.parameters.index' não pode repetir índices."
+    if isinstance(params["segment"], list) and len(params["segment"]) != len(indices):
+        return False, "'api.parameters.segment' deve ter um segmento por índice (ou um valor único para todos)."
+    return True, ""
+
+def validate_api(api_conf: dict) -> tuple:
+    """Valida a configuração 'api' da consulta à B3."""
+    if not isinstance(api_conf, dict):
+        return False, "O campo 'api' deve ser um dicionário."
     api_required = ["host", "route", "parameters"]
     api_missing = [field for field in api_required if field not in api_conf or not api_conf[field]]
     if api_missing:
-        logger.error(f"Parâmetros obrigatórios ausentes em 'api': {api_missing}")
         return False, f"Parâmetros obrigatórios ausentes em 'api': {api_missing}"
 
     params_required = ["language", "pageNumber", "pageSize", "index", "segment"]
     params = api_conf["parameters"]
-    params_missing = [field for field in params_required if field not in params or params[field] in [None, ""]]
+    if not isinstance(params, dict):
+        return False, "O campo 'api.parameters' deve ser um dicionário."
+    params_missing = [field for field in params_required if field not in params or params[field] in [None, "", []]]
     if params_missing:
-        logger.error(f"Parâmetros obrigatórios ausentes em 'api.parameters': {params_missing}")
         return False, f"Parâmetros obrigatórios ausentes em 'api.parameters': {params_missing}"
 
+    return validate_indices(params)
+
+def validate_rate_limit(rate_limit: dict) -> tuple:
+    """Valida as opções do cliente da B3 (limite de taxa, concorrência, retentativas e circuit breaker)."""
+    if not isinstance(rate_limit, dict):
+        return False, "O campo 'rate_limit' deve ser um dicionário."
+    unknown = sorted(set(rate_limit) - set(b3_client.DEFAULT_SETTINGS))
+    if unknown:
+        return False, f"Opções desconhecidas em 'rate_limit': {unknown}"
+    invalid = [
+        name for name, value in rate_limit.items()
+        if not (name == "burst" and value is None)
+        and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0)
+    ]
+    if invalid:
+        return False, f"Opções de 'rate_limit' devem ser números não negativos: {invalid}"
+    positive = ["initial_concurrency", "min_concurrency", "max_concurrency", "max_attempts", "failure_threshold"]
+    if any(rate_limit.get(name) is not None and rate_limit[name] < 1 for name in positive):
+        return False, f"As opções {positive} de 'rate_limit' devem ser maiores ou iguais a 1."
+    if "max_concurrency" in rate_limit and rate_limit.get("min_concurrency", 1) > rate_limit["max_concurrency"]:
+        return False, "'rate_limit.min_concurrency' deve ser menor ou igual a 'rate_limit.max_concurrency'."
     return True, ""
 
+def validate_event(event: dict) -> tuple:
+    """Valida se todos os parâmetros obrigatórios foram fornecidos corretamente."""
+    # O modo replay lê apenas o arquivo de payloads e não consulta a API
+    replay = "replay" in event
+    required_fields = ["s3_bucket", "s3_prefix"] + ([] if replay else ["api"])
+    missing = [field for field in required_fields if field not in event or not event[field]]
+    if missing:
+        logger.error(f"Parâmetros obrigatórios ausentes: {missing}")
+        return False, f"Parâmetros obrigatórios ausentes: {missing}"
+
+    prefixes = [field for field in ("s3_bucket", "s3_prefix", "archive_prefix")
+                if field in event and not isinstance(event[field], str)]
+    if prefixes:
+        msg = f"Os campos {prefixes} devem ser textos."
+        logger.error(msg)
+        return False, msg
+
+    if not replay:
+        is_valid, msg = validate_api(event["api"])
+        if not is_valid:
+            logger.error(msg)
+            return False, msg
+
+    # Validados aqui porque dimensionam a sessão e os pools antes do processamento
+    is_valid, msg = validate_positive_integers(event, ["max_workers", "batch_size"])
+    if not is_valid:
+        logger.error(msg)
+        return False, msg
+
+    if "correlation_id" in event and not instrumentation.is_valid_correlation_id(event["correlation_id"]):
+        msg = "'correlation_id' deve ter até 64 caracteres entre letras, números e '-'."
+        logger.error(msg)
+        return False, msg
+
+    if replay and "backfill" in event:
+        msg = "Os modos 'replay' e 'backfill' não podem ser usados juntos."
+        logger.error(msg)
+        return False, msg
+
+    if "rate_limit" in event:
+        is_valid, msg = validate_rate_limit(event["rate_limit"])
+        if not is_valid:
+            logger.error(msg)
+            return False, msg
+
+    for field in ("backfill", "replay"):
+        if field in event:
+            is_valid, msg = validate_backfill(event[field], field)
+            if not is_valid:
+                logger.error(msg)
+                return False, msg
+
+    # Fora da camada raw: o job Glue lê toda a raiz raw como Parquet
+    archive_prefix = event.get("archive_prefix") or default_archive_prefix(event["s3_prefix"])
+    if archive_prefix.strip("/").startswith(f"{event['s3_prefix'].strip('/')}/") or \
+            archive_prefix.strip("/") == event["s3_prefix"].strip("/"):
+        msg = "'archive_prefix' não pode ficar dentro de 's3_prefix'."
+        logger.error(msg)
+        return False, msg
+
+    return True, ""
+
+def create_session(pool_maxsize: int = DEFAULT_MAX_WORKERS) -> requests.Session:
+    """
+    Cria a sessão HTTP com pool de conexões dimensionado para as requisições paralelas. As retentativas
+    ficam no B3Client, que alimenta o limite de concorrência e o circuit breaker com cada falha.
+    """
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(max_retries=0, pool_connections=1, pool_maxsize=pool_maxsize))
+    return session
+
+def get_session(pool_maxsize: int = DEFAULT_MAX_WORKERS) -> requests.Session:
+    """
+    Retorna a sessão HTTP em cache no escopo do módulo, criando-a na primeira chamada
+    ou quando o pool atual é menor que o necessário.
+    """
+    global _session, _session_pool_maxsize
+    if _session is None or _session_pool_maxsize < pool_maxsize:
+        if _session is not None:
+            _session.close()
+        _session = create_session(pool_maxsize=pool_maxsize)
+        _session_pool_maxsize = pool_maxsize
+    return _session
+
+def get_client(pool_maxsize: int = DEFAULT_MAX_WORKERS, rate_limit: dict = None) -> b3_client.B3Client:
+    """
+    Retorna o cliente da B3 em cache sobre a sessão atual. O cliente (e o estado aprendido) é recriado
+    apenas quando a configuração 'rate_limit' muda; 'max_concurrency' tem como padrão o tamanho do pool.
+    """
+    global _client
+    settings = {"max_concurrency": pool_maxsize, **(rate_limit or {})}
+    session = get_session(pool_maxsize=pool_maxsize)
+    if _client is None or _client.settings != {**b3_client.DEFAULT_SETTINGS, **settings}:
+        _client = b3_client.B3Client(session, **settings)
+    _client.session = session
+    return _client
+
+def reset_session() -> None:
+    """
+    Descarta a sessão em cache (usado após erros para não reaproveitar conexões quebradas).
+    O cliente da B3 é mantido: a próxima invocação troca apenas a sessão, preservando o circuit breaker.
+    """
+    global _session, _session_pool_maxsize
+    if _session is not None:
+        try:
+            _session.close()
+        except Exception:
+            pass
+    _session = None
+    _session_pool_maxsize = 0
+
 def lambda_handler(event, context):
     # Validação dos parâmetros
     is_valid, msg = validate_event(event)
@@ -132,35 +1033,96 @@ def lambda_handler(event, context):
 
     s3_bucket = event["s3_bucket"]
     s3_prefix = event["s3_prefix"]
-    api_conf = event["api"]
+    api_conf = event.get("api")
 
     # Garante que o prefixo termina com '/'
     if s3_prefix and not s3_prefix.endswith('/'):
         s3_prefix += '/'
 
     s3_path = f"s3://{s3_bucket}/{s3_prefix}"
+    all_pages = bool(event.get("all_pages", False))
+    columnar = bool(event.get("columnar", False))
+    stream = bool(event.get("stream", False))
+    batch_size = event.get("batch_size", STREAM_BATCH_SIZE)
+    max_workers = event.get("max_workers", DEFAULT_MAX_WORKERS)
 
-    session = requests.Session()
-    retries = Retry(total=3, backoff_factor=1, status_forcelist=[502, 503, 504])
-    session.mount('https://', HTTPAdapter(max_retries=retries))
+    dedup = bool(event.get("dedup", False))
+    backfill_conf = event.get("backfill")
+    replay_conf = event.get("replay")
+    # Arquivo dos payloads originais, lido pelo modo replay
+    archive = bool(event.get("archive", False))
+    archive_path = f"s3://{s3_bucket}/{event.get('archive_prefix') or default_archive_prefix(s3_prefix)}"
+
+    # O correlation id segue nos nomes dos arquivos raw até o job Glue (ver raw_file_prefix)
+    correlation_id = _stage_metrics.start(instrumentation.resolve_correlation_id(
+        event.get("correlation_id"), getattr(context, "aws_request_id", None)
+    ))
+    logger.info(f"Correlation id: {correlation_id}")
 
     try:
+        session = None
+        if not replay_conf:
+            # Com vários índices, cada um pode buscar suas páginas em paralelo sobre a mesma sessão
+            num_indices = len(index_confs(api_conf))
+            pool_maxsize = max_workers * (min(num_indices, max_workers) if all_pages else 1)
+            if backfill_conf:
+                concurrency = backfill_conf.get("max_concurrency", BACKFILL_DEFAULT_CONCURRENCY)
+                pool_maxsize = max(pool_maxsize, concurrency * min(num_indices, max_workers))
+            session = get_client(pool_maxsize=pool_maxsize, rate_limit=event.get("rate_limit"))
+
+        if replay_conf:
+            return run_replay(replay_conf, archive_path, s3_path, columnar=columnar, max_workers=max_workers)
+
+        if backfill_conf:
+            return run_backfill(api_conf, backfill_conf, session, s3_path,
+                                columnar=columnar, all_pages=all_pages, max_workers=max_workers, dedup=dedup,
+                                archive_path=archive_path if archive else None)
+
         logger.info("Iniciando scrap B3")
-        json_data = get_portfolio_day(api_conf, session)
-        df = portfolio_day_to_df(json_data)
-        if df.empty:
-            logger.warning("DataFrame retornado está vazio.")
+        if stream:
+            if dedup:
+                logger.warning("O modo stream não calcula o hash do payload; 'dedup' será ignorado.")
+            if archive:
+                logger.warning("O modo stream não mantém o payload em memória; 'archive' será ignorado.")
+            # Um índice por vez: o modo stream mantém um único writer aberto para limitar a memória.
+            # Busca, conversão e escrita são intercaladas por lote, então são medidas como uma única etapa
+            with _stage_metrics.stage("stream_write") as stage:
+                rows = sum(
+                    stream_portfolio_to_parquet(conf, session, s3_path, batch_size=batch_size, all_pages=all_pages)
+                    for conf in index_confs(api_conf)
+                )
+                stage.rows = rows
+            if rows == 0:
+                return {'statusCode': 204, 'body': json.dumps('Nenhum dado encontrado.')}
+            logger.info("Scrap B3 realizado com sucesso!")
+            return {'statusCode': 200, 'body': json.dumps('Scrap B3 realizado com sucesso!')}
+
+        pages = require_pages(get_portfolio_indices(api_conf, session, all_pages=all_pages, max_workers=max_workers))
+
+        digests = None
+        if dedup and any(page and page.get("results") for page in pages):
+            with _stage_metrics.stage("dedup"):
+                day = pages_partition_day(pages)
+                # Apenas os índices alterados são regravados; as partições dos demais ficam intactas
+                pages, digests = changed_pages(pages, s3_path, day)
+            if not pages:
+                logger.info(f"Snapshot da B3 inalterado para {day}. Escrita ignorada.")
+                return {'statusCode': 304, 'body': json.dumps('Dados inalterados. Escrita ignorada.')}
+
+        rows = write_pages(pages, s3_path, columnar=columnar)
+        if rows == 0:
             return {'statusCode': 204, 'body': json.dumps('Nenhum dado encontrado.')}
-        wr.s3.to_parquet(
-            df=df,
-            path=s3_path,
-            dataset=True,
-            mode='overwrite_partitions',
-            partition_cols=["year", "month", "day"],
-            compression="snappy"
-        )
+        if archive:
+            # Antes do manifesto: uma nova tentativa após falha no arquivo não é tratada como 'inalterado'
+            with _stage_metrics.stage("archive") as stage:
+                stage.rows = archive_pages(pages, api_conf, archive_path)
+        if digests:
+            write_manifests(s3_path, day, digests)
         logger.info("Scrap B3 realizado com sucesso!")
         return {'statusCode': 200, 'body': json.dumps('Scrap B3 realizado com sucesso!')}
     except Exception as e:
         logger.error(f"Erro ao realizar o scrap B3: {str(e)}", exc_info=True)
-        return {'statusCode': 500, 'body': json.dumps(f'Erro ao realizar o scrap B3: {str(e)}')}
\ No newline at end of file
+        reset_session()
+        return {'statusCode': 500, 'body': json.dumps(f'Erro ao realizar o scrap B3: {str(e)}')}
+    finally:
+        _stage_metrics.flush()
\ No newline at end of file
@@ -1,10 +1,70 @@
+import os
+import re
 import json
 import boto3
 import logging
+from urllib.parse import unquote_plus
+from typing import Dict, List, Optional, Tuple
+
+# Módulo compartilhado (src/shared), empacotado junto com a Lambda
+import instrumentation
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Estados em que uma execução do job ainda ocupa a saída (não iniciar outra em paralelo)
+ACTIVE_RUN_STATES = ("STARTING", "RUNNING", "WAITING", "STOPPING")
+
+# Execuções mais recentes consultadas pelo get_job_runs na checagem de concorrência
+ACTIVE_RUN_LOOKUP = 25
+
+# Política quando já existe execução ativa: 'defer' adia o disparo até a execução terminar. Não há como
+# anexar o evento à execução ativa: ela foi iniciada com os próprios --PARTITIONS/--OBJECT_KEY e não leria os novos dados
+ACTIVE_RUN_POLICIES = ("defer",)
+DEFAULT_ACTIVE_RUN_POLICY = "defer"
+
+# Configuração do job usada quando o evento é a notificação S3 nativa (sem payload montado)
+GLUE_JOB_NAME = os.environ.get("GLUE_JOB_NAME", "glue-refined-zone-bovespa")
+GLUE_TABLE_NAME = os.environ.get("GLUE_TABLE_NAME", "tbl_refined_bovespa")
+GLUE_DATABASE_NAME = os.environ.get("GLUE_DATABASE_NAME", "db_default")
+S3_OUTPUT_BUCKET = os.environ.get("S3_OUTPUT_BUCKET", "fiap-ml-tc-fase2-data")
+S3_OUTPUT_PREFIX = os.environ.get("S3_OUTPUT_PREFIX", "refined-zone/tbl_refined_bovespa/")
+
+# Apenas os arquivos de dados da camada raw disparam o job (ignora _manifest.json e afins)
+RAW_FILE_SUFFIX = ".parquet"
+
+# Raiz da tabela e partição year=/month=/day= de uma chave da camada raw
+RAW_PARTITION_PATTERN = re.compile(r"^(?P<root>.*?)(?P<partition>year=[^/]+/month=[^/]+/day=[^/]+)/")
+
+# Correlation id gravado pela Lambda de extração como prefixo do nome do arquivo ('<id>_<uuid>-0.snappy.parquet')
+RAW_CORRELATION_ID_PATTERN = re.compile(r"^(?P<correlation_id>[A-Za-z0-9-]{1,64})_")
+
+# Métricas por etapa e correlation id da invocação (STAGE_METRICS, STAGE_METRICS_FORMAT, STAGE_METRICS_NAMESPACE)
+_stage_metrics = instrumentation.StageMetrics.from_env("lambda-trigger-glue-bovespa")
+
+# Cliente Glue reaproveitado entre invocações quentes da Lambda
+_glue_client = None
+
+class DispatchError(RuntimeError):
+    """
+    Disparo adiado ou com erro de um evento S3 recebido em invocação direta (assíncrona). Relançado para
+    que as retentativas assíncronas da Lambda reenviem o evento, em vez de descartá-lo com um 409.
+    """
+
+def get_glue_client():
+    """
+    Retorna o cliente Glue em cache no escopo do módulo, criando-o na primeira chamada.
+    """
+    global _glue_client
+    if _glue_client is None:
+        _glue_client = boto3.client('glue')
+    return _glue_client
+
+def reset_glue_client() -> None:
+    """Descarta o cliente em cache para que a próxima invocação crie um novo."""
+    global _glue_client
+    _glue_client = None
+
 def validate_event(event: dict) -> tuple:
     """
     Valida se todos os parâmetros obrigatórios foram fornecidos corretamente.
@@ -19,19 +79,236 @@ def validate_event(event: dict) -> tuple:
         logger.error("O campo 'job_parameters' deve ser um dicionário não vazio.")
         return False, "O campo 'job_parameters' deve ser um dicionário não vazio."
 
+    if event.get("on_active_run", DEFAULT_ACTIVE_RUN_POLICY) not in ACTIVE_RUN_POLICIES:
+        logger.error(f"Valor inválido para 'on_active_run': {event.get('on_active_run')}")
+        return False, f"O campo 'on_active_run' deve ser um de {list(ACTIVE_RUN_POLICIES)}."
+
     return True, ""
 
+def merge_object_keys(keys: List[str]) -> str:
+    """
+    Junta as chaves S3 de vários eventos em uma só: a própria chave, se todas forem iguais,
+    ou o maior diretório comum (ex.: a partição year=/month=/day= de uma escrita com vários arquivos).
+    Chaves sem diretório em comum levariam o job a ler o bucket inteiro e são rejeitadas.
+    """
+    unique = sorted(set(keys))
+    if len(unique) == 1:
+        return unique[0]
+    directories = [key.split("/")[:-1] for key in unique]
+    common = []
+    for parts in zip(*directories):
+        if len(set(parts)) > 1:
+            break
+        common.append(parts[0])
+    if not common:
+        raise ValueError(f"Chaves sem diretório em comum não podem ser unidas em um --OBJECT_KEY: {unique}")
+    return "/".join(common) + "/"
+
+def payload_root(payload: dict) -> str:
+    """
+    Raiz da tabela raw do --OBJECT_KEY do payload: o prefixo antes de year=/month=/day= ou, fora de partições,
+    o diretório da chave. Sem prefixo (chave na raiz do bucket), a própria chave.
+    """
+    object_key = payload["job_parameters"].get("--OBJECT_KEY", "")
+    match = RAW_PARTITION_PATTERN.match(object_key)
+    if match:
+        root = match.group("root")
+    else:
+        root = object_key.rsplit("/", 1)[0] + "/" if "/" in object_key else ""
+    return root or object_key
+
+def group_payloads(payloads: List[dict]) -> List[List[int]]:
+    """
+    Agrupa os índices dos payloads por job e raiz da tabela raw: cada grupo vira uma execução do job.
+    Eventos de raízes diferentes não são unidos, para que o --OBJECT_KEY combinado não suba acima da tabela.
+    """
+    groups: Dict[Tuple[str, str], List[int]] = {}
+    for position, payload in enumerate(payloads):
+        groups.setdefault((payload["job_name"], payload_root(payload)), []).append(position)
+    return list(groups.values())
+
+def merge_list_parameter(parameters_list: List[dict], name: str) -> Optional[str]:
+    """União ordenada dos valores separados por vírgula do parâmetro 'name' (None se nenhum evento o tiver)."""
+    values = sorted({
+        value for parameters in parameters_list if parameters.get(name) for value in parameters[name].split(",")
+    })
+    return ",".join(values) if values else None
+
+def merge_job_parameters(job_name: str, parameters_list: List[dict]) -> dict:
+    """
+    Junta os argumentos de vários eventos do mesmo job e raiz em um único conjunto, com o --OBJECT_KEY
+    combinado por merge_object_keys e a união dos --PARTITIONS e --CORRELATION_ID.
+    """
+    job_parameters = dict(parameters_list[0])
+    for parameters in parameters_list[1:]:
+        conflicts = [name for name, value in parameters.items()
+                     if name not in ("--OBJECT_KEY", "--CORRELATION_ID") and job_parameters.get(name, value) != value]
+        if conflicts:
+            logger.warning(f"Parâmetros divergentes entre eventos do job {job_name}: {conflicts}. Mantendo o primeiro valor.")
+        for name, value in parameters.items():
+            job_parameters.setdefault(name, value)
+    object_keys = [parameters["--OBJECT_KEY"] for parameters in parameters_list if parameters.get("--OBJECT_KEY")]
+    if object_keys:
+        job_parameters["--OBJECT_KEY"] = merge_object_keys(object_keys)
+    if all(parameters.get("--PARTITIONS") for parameters in parameters_list):
+        job_parameters["--PARTITIONS"] = merge_list_parameter(parameters_list, "--PARTITIONS")
+    else:
+        # Algum evento sem partição identificada: lê o --OBJECT_KEY combinado inteiro
+        job_parameters.pop("--PARTITIONS", None)
+    correlation_ids = merge_list_parameter(parameters_list, "--CORRELATION_ID")
+    if correlation_ids:
+        job_parameters["--CORRELATION_ID"] = correlation_ids
+    logger.info(f"{len(parameters_list)} eventos agrupados em uma execução do job {job_name}.")
+    return job_parameters
+
+def coalesce_payloads(payloads: List[dict]) -> List[Tuple[str, dict]]:
+    """
+    Agrupa os payloads por job e raiz da tabela raw (group_payloads) e retorna, por grupo,
+    o job e os argumentos unidos da execução.
+    """
+    runs = []
+    for group in group_payloads(payloads):
+        job_name = payloads[group[0]]["job_name"]
+        runs.append((job_name, merge_job_parameters(job_name, [payloads[position]["job_parameters"] for position in group])))
+    return runs
+
+def correlation_id_from_key(object_key: str) -> Optional[str]:
+    """Extrai o correlation id do prefixo do nome do arquivo raw, se houver."""
+    match = RAW_CORRELATION_ID_PATTERN.match(object_key.rsplit("/", 1)[-1])
+    return match.group("correlation_id") if match else None
+
+def build_s3_payload(bucket_name: str, object_key: str, region: str) -> dict:
+    """
+    Monta o payload do job para um objeto gravado na camada raw.
+    Se a chave estiver em uma partição year=/month=/day=, o job recebe a partição em --PARTITIONS
+    e lê apenas os dados recém-gravados. O correlation id da extração, quando presente no nome do arquivo,
+    segue em --CORRELATION_ID.
+    """
+    job_parameters = {
+        "--JOB_NAME": GLUE_JOB_NAME,
+        "--TABLE_NAME": GLUE_TABLE_NAME,
+        "--DATABASE_NAME": GLUE_DATABASE_NAME,
+        "--S3_BUCKET": bucket_name,
+        "--OBJECT_KEY": object_key,
+        "--S3_OUTPUT_BUCKET": S3_OUTPUT_BUCKET,
+        "--S3_OUTPUT_PREFIX": S3_OUTPUT_PREFIX,
+        "--AWS_REGION": region
+    }
+    match = RAW_PARTITION_PATTERN.match(object_key)
+    if match:
+        job_parameters["--OBJECT_KEY"] = f"{match.group('root')}{match.group('partition')}/"
+        job_parameters["--PARTITIONS"] = match.group("partition")
+    correlation_id = correlation_id_from_key(object_key)
+    if correlation_id:
+        job_parameters["--CORRELATION_ID"] = correlation_id
+    return {"job_name": GLUE_JOB_NAME, "job_parameters": job_parameters}
+
+def payloads_from_message(message: dict) -> List[dict]:
+    """
+    Converte uma mensagem em payloads do job. Aceita notificações S3 nativas (Records),
+    eventos "Object Created" do EventBridge e o payload montado (job_name/job_parameters).
+    """
+    if "Records" in message:
+        payloads = []
+        for record in message["Records"]:
+            object_key = unquote_plus(record.get("s3", {}).get("object", {}).get("key", ""))
+            if not record.get("eventName", "").startswith("ObjectCreated") or not object_key.endswith(RAW_FILE_SUFFIX):
+                continue
+            payloads.append(build_s3_payload(record["s3"]["bucket"]["name"], object_key, record.get("awsRegion", "")))
+        return payloads
+    if message.get("source") == "aws.s3":
+        object_key = message.get("detail", {}).get("object", {}).get("key", "")
+        if message.get("detail-type") != "Object Created" or not object_key.endswith(RAW_FILE_SUFFIX):
+            return []
+        return [build_s3_payload(message["detail"]["bucket"]["name"], object_key, message.get("region", ""))]
+    return [message]
+
+def is_s3_event(event: dict) -> bool:
+    """
+    Indica se o evento é uma notificação S3 nativa ou um evento S3 do EventBridge.
+    """
+    if event.get("source") == "aws.s3":
+        return True
+    return any(record.get("eventSource") == "aws:s3" for record in event.get("Records", []))
+
+def parse_records(event: dict) -> Tuple[List[Tuple[str, dict]], List[str]]:
+    """
+    Extrai os payloads dos registros SQS do evento (cada mensagem pode trazer vários objetos S3).
+    Retorna os pares (messageId, payload) válidos e os messageIds descartados por payload inválido.
+    """
+    payloads, invalid = [], []
+    for record in event.get("Records", []):
+        message_id = record.get("messageId", "")
+        try:
+            message = json.loads(record.get("body") or "{}")
+        except json.JSONDecodeError:
+            message = {}
+        for payload in payloads_from_message(message):
+            is_valid, msg = validate_event(payload)
+            if not is_valid:
+                logger.error(f"Registro {message_id} descartado: {msg}")
+                invalid.append(message_id)
+                continue
+            payloads.append((message_id, payload))
+    return payloads, invalid
+
+def find_active_run(job_name: str) -> Optional[dict]:
+    """
+    Retorna a execução mais recente do job que ainda está em andamento ou na fila, se houver.
+    """
+    with _stage_metrics.stage("get_job_runs") as stage:
+        response = get_glue_client().get_job_runs(JobName=job_name, MaxResults=ACTIVE_RUN_LOOKUP)
+        stage.retries = instrumentation.boto_retries(response)
+    for job_run in response.get("JobRuns", []):
+        if job_run.get("JobRunState") in ACTIVE_RUN_STATES:
+            return job_run
+    return None
+
+def deferred_response(job_name: str, job_run_id: Optional[str] = None) -> dict:
+    """
+    Resposta para disparo adiado por já existir execução ativa do job.
+    """
+    logger.info(f"Execução do job {job_name} adiada: já existe execução ativa ({job_run_id}).")
+    return {
+        "statusCode": 409,
+        "body": json.dumps({
+            "message": "Glue Job já em execução. Disparo adiado.",
+            "JobRunId": job_run_id
+        })
+    }
+
+def dispatch_glue_job(job_name: str, job_parameters: dict, on_active_run: str = DEFAULT_ACTIVE_RUN_POLICY) -> dict:
+    """
+    Inicia o job apenas se não houver execução ativa; caso haja, adia o disparo (on_active_run 'defer').
+    """
+    # Métricas do disparo ficam sob o correlation id da extração, quando ele vem nos parâmetros
+    _stage_metrics.correlation_id = job_parameters.get("--CORRELATION_ID") or _stage_metrics.correlation_id
+    try:
+        active_run = find_active_run(job_name)
+    except Exception as e:
+        logger.error(f"Erro ao consultar execuções do Glue Job: {str(e)}", exc_info=True)
+        reset_glue_client()
+        return {
+            "statusCode": 500,
+            "body": json.dumps(f"Erro ao consultar execuções do Glue Job: {str(e)}")
+        }
+    if active_run is None:
+        return start_glue_job(job_name, job_parameters)
+    return deferred_response(job_name, active_run.get("Id"))
+
 def start_glue_job(job_name: str, job_parameters: dict) -> dict:
     """
     Inicia um job do AWS Glue com os parâmetros fornecidos.
     """
-    glue_client = boto3.client('glue')
     try:
+        glue_client = get_glue_client()
         logger.info(f"Iniciando Glue Job: {job_name} com parâmetros: {job_parameters}")
-        response = glue_client.start_job_run(
-            JobName=job_name,
-            Arguments=job_parameters
-        )
+        with _stage_metrics.stage("start_job_run") as stage:
+            response = glue_client.start_job_run(
+                JobName=job_name,
+                Arguments=job_parameters
+            )
+            stage.retries = instrumentation.boto_retries(response)
         logger.info(f"Glue Job iniciado com sucesso: {response.get('JobRunId')}")
         return {
             "statusCode": 200,
@@ -41,17 +318,79 @@ def start_glue_job(job_name: str, job_parameters: dict) -> dict:
             })
         }
     except Exception as e:
+        if getattr(e, "response", {}).get("Error", {}).get("Code") == "ConcurrentRunsExceededException":
+            return deferred_response(job_name)
         logger.error(f"Erro ao iniciar Glue Job: {str(e)}", exc_info=True)
+        reset_glue_client()
         return {
             "statusCode": 500,
             "body": json.dumps(f"Erro ao iniciar Glue Job: {str(e)}")
         }
 
+def handle_records(event: dict) -> dict:
+    """
+    Processa um lote de registros SQS: agrupa os eventos em uma execução por job e
+    devolve como batchItemFailures as mensagens adiadas ou com erro, para nova entrega pela fila.
+    """
+    with _stage_metrics.stage("parse") as stage:
+        payloads, invalid = parse_records(event)
+        stage.rows = len(payloads)
+    if invalid:
+        logger.warning(f"{len(invalid)} registros inválidos descartados.")
+    failures: Dict[str, None] = {}
+    for group in group_payloads([payload for _, payload in payloads]):
+        job_name = payloads[group[0]][1]["job_name"]
+        on_active_run = payloads[group[0]][1].get("on_active_run", DEFAULT_ACTIVE_RUN_POLICY)
+        job_parameters = merge_job_parameters(job_name, [payloads[position][1]["job_parameters"] for position in group])
+        response = dispatch_glue_job(job_name, job_parameters, on_active_run)
+        if response["statusCode"] != 200:
+            failures.update(dict.fromkeys(payloads[position][0] for position in group))
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in failures]}
+
+def handle_s3_event(event: dict) -> dict:
+    """
+    Processa a notificação S3 invocando a Lambda diretamente: uma execução por job e raiz para os objetos
+    do evento. Sem fila para reentregar o evento, um disparo adiado ou com erro lança DispatchError e a
+    invocação assíncrona é retentada pela própria Lambda.
+    """
+    with _stage_metrics.stage("parse") as stage:
+        payloads = payloads_from_message(event)
+        stage.rows = len(payloads)
+    runs = coalesce_payloads(payloads)
+    if not runs:
+        logger.info("Nenhum arquivo de dados da camada raw no evento. Nada a processar.")
+        return {
+            "statusCode": 200,
+            "body": json.dumps("Nenhum arquivo de dados da camada raw no evento.")
+        }
+    responses = [dispatch_glue_job(job_name, job_parameters) for job_name, job_parameters in runs]
+    failed = [response for response in responses if response["statusCode"] != 200]
+    if failed:
+        raise DispatchError(f"{len(failed)} de {len(responses)} disparos não iniciados: {[response['body'] for response in failed]}")
+    return responses[0]
+
 def lambda_handler(event, context):
     """
     Handler principal da Lambda.
     """
     logger.info(f"Evento recebido: {json.dumps(event)}")
+    _stage_metrics.start(instrumentation.resolve_correlation_id(
+        event.get("correlation_id"), getattr(context, "aws_request_id", None)
+    ))
+    try:
+        return handle_event(event)
+    finally:
+        _stage_metrics.flush()
+
+def handle_event(event: dict) -> dict:
+    """
+    Encaminha o evento conforme a origem: notificação S3, lote SQS ou payload montado.
+    """
+    if is_s3_event(event):
+        return handle_s3_event(event)
+    if "Records" in event:
+        return handle_records(event)
+
     is_valid, msg = validate_event(event)
     if not is_valid:
         return {
@@ -61,4 +400,4 @@ def lambda_handler(event, context):
 
     job_name = event["job_name"]
     job_parameters = event["job_parameters"]
-    return start_glue_job(job_name, job_parameters)
\ No newline at end of file
+    return dispatch_glue_job(job_name, job_parameters, event.get("on_active_run", DEFAULT_ACTIVE_RUN_POLICY))
\ No newline at end of file
@@ -0,0 +1,208 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import threading
+from typing import Dict, List, Optional, TextIO
+
+# Instrumentação por etapa compartilhada pelas Lambdas de extração e de trigger e pelo job Glue:
+# tempo de parede, linhas, bytes e retentativas acumulados por etapa e emitidos uma vez por invocação,
+# como CloudWatch Embedded Metric Format (EMF) ou JSON estruturado, com um correlation id que acompanha
+# os dados da extração até a execução do Glue.
+# Empacotamento: incluir este arquivo no pacote (ou layer) das Lambdas e em --extra-py-files do job Glue.
+
+# 'emf' é extraído automaticamente como métrica dos logs da Lambda; 'json' apenas estrutura o log
+METRICS_FORMATS = ("emf", "json")
+DEFAULT_FORMAT = "emf"
+DEFAULT_NAMESPACE = "Bovespa/Pipeline"
+
+# Medidas acumuladas por etapa e suas unidades no EMF
+MEASURES: Dict[str, str] = {
+    "seconds": "Seconds",
+    "rows": "Count",
+    "bytes": "Bytes",
+    "retries": "Count",
+    "calls": "Count"
+}
+
+# Correlation id aceito em eventos e nomes de arquivo (uuid hex ou aws_request_id)
+CORRELATION_ID_PATTERN = re.compile(r"^[A-Za-z0-9-]{1,64}$")
+
+def new_correlation_id() -> str:
+    """Gera um novo correlation id."""
+    return uuid.uuid4().hex
+
+def is_valid_correlation_id(value) -> bool:
+    """Indica se o valor pode ser usado como correlation id (inclusive em nomes de arquivo)."""
+    return isinstance(value, str) and bool(CORRELATION_ID_PATTERN.match(value))
+
+def resolve_correlation_id(*candidates) -> str:
+    """Retorna o primeiro candidato válido (ex.: id do evento, aws_request_id) ou um novo correlation id."""
+    for candidate in candidates:
+        if is_valid_correlation_id(candidate):
+            return candidate
+    return new_correlation_id()
+
+def is_enabled(value: Optional[str]) -> bool:
+    """Interpreta flags textuais ('true', '1', 'yes') de variáveis de ambiente e parâmetros de job."""
+    return str(value or "").strip().lower() in ("true", "1", "yes")
+
+def http_retries(response) -> int:
+    """Retentativas feitas pelo urllib3 (Retry do HTTPAdapter) até obter a resposta do requests."""
+    retries = getattr(getattr(response, "raw", None), "retries", None)
+    return len(getattr(retries, "history", None) or ())
+
+def boto_retries(response: dict) -> int:
+    """Retentativas feitas pelo botocore até obter a resposta da chamada."""
+    return int((response or {}).get("ResponseMetadata", {}).get("RetryAttempts", 0))
+
+class Stage:
+    """Medidas de uma execução de etapa; rows, bytes e retries são preenchidos pelo chamador dentro do bloco."""
+    __slots__ = ("rows", "bytes", "retries")
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self.retries = 0
+
+class _NoopStage:
+    """Etapa descartada quando a instrumentação está desligada: atribuições são ignoradas."""
+    __slots__ = ()
+    rows = 0
+    bytes = 0
+    retries = 0
+
+    def __setattr__(self, name, value):
+        pass
+
+class _NoopTimer:
+    """Context manager constante da instrumentação desligada (sem relógio nem alocação por etapa)."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return _NOOP_STAGE
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NOOP_STAGE = _NoopStage()
+_NOOP_TIMER = _NoopTimer()
+
+class _StageTimer:
+    """Mede o tempo de parede do bloco e acumula as medidas da etapa ao sair (inclusive com erro)."""
+    __slots__ = ("metrics", "name", "stage", "start")
+
+    def __init__(self, metrics: "StageMetrics", name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self) -> Stage:
+        self.stage = Stage()
+        self.start = time.perf_counter()
+        return self.stage
+
+    def __exit__(self, *exc_info):
+        stage = self.stage
+        self.metrics.add(self.name, time.perf_counter() - self.start, stage.rows, stage.bytes, stage.retries)
+        return False
+
+class StageMetrics:
+    """
+    Acumula as medidas por etapa de uma invocação (thread-safe, para as buscas em paralelo) e as emite
+    em flush(), uma linha por etapa. Desligada, stage() devolve um context manager constante e add() retorna
+    de imediato.
+    """
+
+    def __init__(self, component: str, enabled: bool = False, fmt: str = DEFAULT_FORMAT,
+                 namespace: str = DEFAULT_NAMESPACE, stream: Optional[TextIO] = None):
+        if fmt not in METRICS_FORMATS:
+            raise ValueError(f"Formato de métricas inválido: {fmt}. Use um de {list(METRICS_FORMATS)}")
+        self.component = component
+        self.enabled = enabled
+        self.fmt = fmt
+        self.namespace = namespace
+        self.stream = stream
+        self.correlation_id: Optional[str] = None
+        self._totals: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, component: str, environ: Optional[Dict[str, str]] = None) -> "StageMetrics":
+        """Configura pelas variáveis STAGE_METRICS, STAGE_METRICS_FORMAT e STAGE_METRICS_NAMESPACE."""
+        environ = os.environ if environ is None else environ
+        return cls(
+            component,
+            enabled=is_enabled(environ.get("STAGE_METRICS")),
+            fmt=environ.get("STAGE_METRICS_FORMAT", DEFAULT_FORMAT),
+            namespace=environ.get("STAGE_METRICS_NAMESPACE", DEFAULT_NAMESPACE)
+        )
+
+    def start(self, correlation_id: Optional[str] = None) -> str:
+        """Inicia uma invocação: descarta as medidas anteriores e define o correlation id (novo, se ausente)."""
+        self.correlation_id = correlation_id or new_correlation_id()
+        self._totals = {}
+        return self.correlation_id
+
+    def stage(self, name: str):
+        """Context manager que mede a etapa; o objeto retornado recebe rows, bytes e retries."""
+        if not self.enabled:
+            return _NOOP_TIMER
+        return _StageTimer(self, name)
+
+    def add(self, name: str, seconds: float = 0.0, rows: int = 0, bytes: int = 0, retries: int = 0, calls: int = 1) -> None:
+        """Acumula medidas na etapa (ex.: linhas conhecidas só depois da ação do Spark, com calls=0)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            totals = self._totals.setdefault(name, dict.fromkeys(MEASURES, 0))
+            totals["seconds"] += seconds
+            totals["rows"] += rows or 0
+            totals["bytes"] += bytes or 0
+            totals["retries"] += retries or 0
+            totals["calls"] += calls
+
+    def documents(self) -> List[dict]:
+        """Monta um documento por etapa no formato configurado."""
+        documents = []
+        for name, totals in self._totals.items():
+            measures = {**totals, "seconds": round(totals["seconds"], 6)}
+            if self.fmt == "json":
+                documents.append({
+                    "metric": "stage", "component": self.component, "stage": name,
+                    "correlation_id": self.correlation_id, **measures
+                })
+                continue
+            documents.append({
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [{
+                        "Namespace": self.namespace,
+                        "Dimensions": [["Component", "Stage"]],
+                        "Metrics": [{"Name": measure, "Unit": unit} for measure, unit in MEASURES.items()]
+                    }]
+                },
+                "Component": self.component,
+                "Stage": name,
+                # Propriedade (não dimensão): pesquisável no Logs Insights sem multiplicar as séries de métricas
+                "CorrelationId": self.correlation_id,
+                **measures
+            })
+        return documents
+
+    def flush(self) -> List[dict]:
+        """
+        Emite as medidas acumuladas, uma linha JSON por etapa, e as descarta. A escrita é direta no stdout,
+        sem o prefixo do logging, que impediria a extração do EMF.
+        """
+        if not self.enabled or not self._totals:
+            return []
+        with self._lock:
+            documents = self.documents()
+            self._totals = {}
+        stream = self.stream or sys.stdout
+        for document in documents:
+            stream.write(json.dumps(document, ensure_ascii=False) + "\n")
+        stream.flush()
+        return documents
@@ -0,0 +1,134 @@
+"""
+Benchmark do layout Parquet da camada refinada: bytes lidos por consultas filtradas em nom_empresa.
+
+Grava a mesma agregação (carga sintética da B3) sem ordenação e com ordenação por nom_empresa +
+row groups menores + bloom filter, e estima, pelas estatísticas min/max de cada row group, os bytes que um
+motor com predicate pushdown (Athena/Trino, Spark) precisa ler para `WHERE nom_empresa = '<valor>'`.
+Os bloom filters podem descartar ainda mais row groups; a estimativa considera apenas min/max e é, portanto, conservadora.
+
+Uso (a partir da raiz do repositório):
+    python tests/benchmark/benchmark_layout.py --size 1000000 --row-group-kb 256 --lookups 50
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from benchmark_pipeline import DEFAULT_OUTPUT, EXTRACT_MODULE_PATH, GLUE_MODULE_PATH, git_commit, load_module
+from synthetic_b3 import make_portfolio_day
+
+FILTER_COLUMN = "nom_empresa"
+
+def scanned_bytes(files: List[str], column: str, value: str) -> int:
+    """
+    Soma o tamanho comprimido dos row groups cujo intervalo min/max da coluna contém o valor,
+    ou seja, os que não podem ser descartados pelas estatísticas.
+    """
+    total = 0
+    for path in files:
+        metadata = pq.ParquetFile(path).metadata
+        index = metadata.schema.names.index(column)
+        for row_group_index in range(metadata.num_row_groups):
+            row_group = metadata.row_group(row_group_index)
+            statistics = row_group.column(index).statistics
+            if statistics is None or not statistics.has_min_max or statistics.min <= value <= statistics.max:
+                total += sum(row_group.column(i).total_compressed_size for i in range(row_group.num_columns))
+    return total
+
+def layout_summary(name: str, path: str, lookups: List[str]) -> Dict:
+    """Resume o layout gravado (arquivos, row groups, bytes) e a média de bytes lidos por consulta."""
+    files = sorted(glob.glob(os.path.join(path, "**", "*.parquet"), recursive=True))
+    row_groups = sum(pq.ParquetFile(file).metadata.num_row_groups for file in files)
+    total_bytes = sum(os.path.getsize(file) for file in files)
+    avg_scanned = sum(scanned_bytes(files, FILTER_COLUMN, value) for value in lookups) / len(lookups)
+    result = {
+        "name": f"layout_{name}",
+        "files": len(files),
+        "row_groups": row_groups,
+        "total_bytes": total_bytes,
+        "avg_scanned_bytes": round(avg_scanned),
+        "scanned_fraction": round(avg_scanned / total_bytes, 4) if total_bytes else None
+    }
+    logging.info(f"{name}: {len(files)} arquivos, {row_groups} row groups, {total_bytes} bytes, "
+                 f"{result['avg_scanned_bytes']} bytes lidos por consulta ({result['scanned_fraction']:.1%})")
+    return result
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark de layout Parquet (bytes lidos por consulta filtrada).")
+    parser.add_argument("--size", type=int, default=1_000_000, help="Itens em 'results' da carga sintética.")
+    parser.add_argument("--row-group-kb", type=int, default=256, help="Tamanho do row group no layout otimizado.")
+    parser.add_argument("--lookups", type=int, default=50, help="Quantidade de valores de nom_empresa consultados.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Arquivo (JSON por linha) onde a execução é acrescentada.")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args = parse_args(argv)
+    from pyspark.sql import SparkSession
+    lf = load_module("bench_lambda_extract_bovespa", EXTRACT_MODULE_PATH)
+    job = load_module("bench_glue_refined_zone_bovespa", GLUE_MODULE_PATH)
+    logging.getLogger(job.__name__).setLevel(logging.WARNING)
+    spark = (
+        SparkSession.builder.master("local[*]")
+        .appName("benchmark-layout-refined-zone-bovespa")
+        .config("spark.ui.enabled", "false")
+        .getOrCreate()
+    )
+    spark.sparkContext.setLogLevel("ERROR")
+    layouts = {
+        "unsorted": {"sort_columns": None, "parquet_options": job.parquet_layout_options()},
+        "sorted_bloom": {
+            "sort_columns": [FILTER_COLUMN],
+            "parquet_options": {
+                **job.parquet_layout_options(bloom_filter_columns=[FILTER_COLUMN]),
+                "parquet.block.size": str(args.row_group_kb * 1024)
+            }
+        }
+    }
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            raw_path = os.path.join(workdir, "raw")
+            lf.write_table_to_parquet(lf.portfolio_day_to_table(make_portfolio_day(args.size)), raw_path)
+            agg_df = job.aggregate_data(job.process_data(spark.read.schema(job.RAW_READ_SCHEMA).parquet(raw_path)))
+            agg_df = agg_df.persist()
+            companies = [row[FILTER_COLUMN] for row in agg_df.select(FILTER_COLUMN).distinct().collect()]
+            lookups = random.Random(42).sample(companies, min(args.lookups, len(companies)))
+            for name, layout in layouts.items():
+                output_path = os.path.join(workdir, name)
+                # write_data grava em s3://<bucket>/<prefix>; no benchmark o destino é o disco local
+                agg_df.repartition(*job.REFINED_PARTITION_KEYS) \
+                    .sortWithinPartitions(*job.REFINED_PARTITION_KEYS, *(layout["sort_columns"] or [])) \
+                    .write.mode("overwrite") \
+                    .options(**layout["parquet_options"]) \
+                    .partitionBy(*job.REFINED_PARTITION_KEYS) \
+                    .parquet(output_path)
+                results.append(dict(layout_summary(name, output_path, lookups), size=args.size))
+    finally:
+        spark.stop()
+
+    unsorted, optimized = results
+    if optimized["avg_scanned_bytes"]:
+        logging.info(f"Redução de bytes lidos: {unsorted['avg_scanned_bytes'] / optimized['avg_scanned_bytes']:.1f}x")
+    run = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "benchmark": "layout",
+        "results": results
+    }
+    with open(args.output, "a", encoding="utf-8") as f:
+        f.write(json.dumps(run, ensure_ascii=False) + "\n")
+    logging.info(f"Resultados gravados em {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+"""
+Benchmark do pipeline com carga sintética da B3.
+
+Mede build_b3_url, portfolio_day_to_df / portfolio_day_to_table e a escrita Parquet local (Lambda de extração),
+o cold start da Lambda (import com e sem os módulos pesados) e a invocação quente com a sessão reaproveitada,
+e process_data + aggregate_data do job Glue em uma SparkSession local, em vários tamanhos de carga.
+Cada execução acrescenta uma linha JSON ao arquivo de saída; --baseline compara com a última execução de outro arquivo.
+
+Uso (a partir da raiz do repositório):
+    python tests/benchmark/benchmark_pipeline.py --sizes 100 10000 1000000 --spark-sizes 10000 100000
+    python tests/benchmark/benchmark_pipeline.py --baseline bench_baseline.txt --fail-on-regression
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+from unittest.mock import patch
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# Módulo compartilhado importado pelas Lambdas e pelo job Glue (src/shared)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src", "shared"))
+# Módulos carregados pelo lambda_function.py da extração a partir do próprio diretório
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src", "lambda", "lambda-extract-bovespa"))
+from synthetic_b3 import DEFAULT_SIZES, make_portfolio_day
+
+EXTRACT_MODULE_PATH = 'src/lambda/lambda-extract-bovespa/lambda_function.py'
+EXTRACT_MODULE_DIR = os.path.dirname(EXTRACT_MODULE_PATH)
+SHARED_MODULE_DIR = 'src/shared'
+GLUE_MODULE_PATH = 'src/glue/glue-refined-zone-bovespa/glue-refined-zone-bovespa.py'
+DEFAULT_SPARK_SIZES: List[int] = [10_000, 100_000, 1_000_000]
+DEFAULT_OUTPUT = 'bench_output.txt'
+DEFAULT_REGRESSION_THRESHOLD = 1.2
+URL_ITERATIONS = 1000
+
+API_CONF: Dict = {
+    "host": "sistemaswebb3-listados.b3.com.br",
+    "route": "/indexProxy/indexCall/GetPortfolioDay/",
+    "parameters": {"language": "pt-br", "pageNumber": 1, "pageSize": 120, "index": "IBOV", "segment": "2"}
+}
+
+def load_module(name: str, path: str):
+    """Carrega um módulo do repositório pelo caminho (os scripts não formam um pacote importável)."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def time_call(func: Callable, repeat: int) -> List[float]:
+    """Executa func repeat vezes, após uma execução de aquecimento, e retorna a duração de cada uma em segundos."""
+    func()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def summarize(name: str, size: int, durations: List[float], rows: Optional[int] = None) -> Dict:
+    """Resume as medições de um benchmark (mínimo e mediana) com a vazão em linhas por segundo."""
+    best = min(durations)
+    result = {
+        "name": name,
+        "size": size,
+        "repeat": len(durations),
+        "seconds_min": round(best, 6),
+        "seconds_median": round(statistics.median(durations), 6)
+    }
+    if rows:
+        result["rows_per_second"] = round(rows / best, 1) if best > 0 else None
+    logging.info(f"{name} [{size}]: min={result['seconds_min']}s mediana={result['seconds_median']}s")
+    return result
+
+def bench_extract(sizes: List[int], repeat: int, workdir: str) -> List[Dict]:
+    """Benchmarks da Lambda de extração: montagem da URL, conversão do JSON e escrita Parquet local."""
+    lf = load_module("bench_lambda_extract_bovespa", EXTRACT_MODULE_PATH)
+    results = [summarize(
+        "build_b3_url", URL_ITERATIONS,
+        time_call(lambda: [lf.build_b3_url(API_CONF) for _ in range(URL_ITERATIONS)], repeat)
+    )]
+    for size in sizes:
+        json_data = make_portfolio_day(size)
+        results.append(summarize("portfolio_day_to_df", size, time_call(lambda: lf.portfolio_day_to_df(json_data), repeat), size))
+        results.append(summarize("portfolio_day_to_table", size, time_call(lambda: lf.portfolio_day_to_table(json_data), repeat), size))
+        df = lf.portfolio_day_to_df(json_data)
+        table = lf.portfolio_day_to_table(json_data)
+        df_path = os.path.join(workdir, f"df_{size}")
+        table_path = os.path.join(workdir, f"table_{size}")
+        results.append(summarize(
+            "parquet_write_pandas", size,
+            time_call(lambda: df.to_parquet(
+                df_path, partition_cols=lf.PARTITION_COLS, compression="snappy", existing_data_behavior="delete_matching"
+            ), repeat), size
+        ))
+        results.append(summarize(
+            "parquet_write_pyarrow", size, time_call(lambda: lf.write_table_to_parquet(table, table_path), repeat), size
+        ))
+    return results
+
+def time_import(statement: str, repeat: int) -> List[float]:
+    """Mede o import em um processo novo (cold start), repeat vezes, no diretório do pacote da Lambda."""
+    code = f"import time; t = time.perf_counter(); {statement}; print(time.perf_counter() - t)"
+    durations = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=EXTRACT_MODULE_DIR,
+            env={**os.environ, "PYTHONPATH": os.path.abspath(SHARED_MODULE_DIR)}
+        )
+        durations.append(float(result.stdout.strip().splitlines()[-1]))
+    return durations
+
+def bench_startup(repeat: int) -> List[Dict]:
+    """
+    Cold start da Lambda de extração (import do módulo com os imports pesados adiados, comparado ao import
+    antecipado de pandas/pyarrow/awswrangler) e invocações quentes, que reaproveitam a sessão HTTP.
+    """
+    results = [
+        summarize("import_heavy_modules", 1, time_import("import requests, pandas, pyarrow, awswrangler", repeat)),
+        summarize("import_lambda_function", 1, time_import("import lambda_function", repeat))
+    ]
+    lf = load_module("bench_lambda_extract_bovespa", EXTRACT_MODULE_PATH)
+    event = {"s3_bucket": "bucket", "s3_prefix": "prefix", "api": API_CONF}
+    # Sem rede nem S3: mede apenas validação, sessão/cliente e o fluxo do handler
+    with patch.object(lf, "get_portfolio_day", return_value={}), patch.object(lf, "write_pages", return_value=1):
+        lf.reset_session()
+        start = time.perf_counter()
+        lf.lambda_handler(event, None)
+        first = time.perf_counter() - start
+        results.append(summarize("invocation_first", 1, [first]))
+        results.append(summarize("invocation_warm", 1, time_call(lambda: lf.lambda_handler(event, None), repeat)))
+        lf.reset_session()
+    return results
+
+def bench_refine(sizes: List[int], repeat: int, workdir: str) -> List[Dict]:
+    """Benchmarks do job Glue em SparkSession local: process_data + aggregate_data sobre dados raw sintéticos."""
+    try:
+        from pyspark.sql import SparkSession
+    except ImportError:
+        logging.warning("pyspark não instalado: benchmarks do job Glue ignorados.")
+        return []
+    lf = load_module("bench_lambda_extract_bovespa", EXTRACT_MODULE_PATH)
+    job = load_module("bench_glue_refined_zone_bovespa", GLUE_MODULE_PATH)
+    logging.getLogger(job.__name__).setLevel(logging.WARNING)
+    spark = (
+        SparkSession.builder.master("local[*]")
+        .appName("benchmark-refined-zone-bovespa")
+        .config("spark.ui.enabled", "false")
+        .getOrCreate()
+    )
+    spark.sparkContext.setLogLevel("ERROR")
+    results = []
+    try:
+        for size in sizes:
+            raw_path = os.path.join(workdir, f"raw_{size}")
+            lf.write_table_to_parquet(lf.portfolio_day_to_table(make_portfolio_day(size)), raw_path)
+
+            def run() -> None:
+                raw_df = spark.read.schema(job.RAW_READ_SCHEMA).parquet(raw_path)
+                agg_df = job.aggregate_data(job.process_data(raw_df))
+                # Formato noop: executa o plano completo sem custo de escrita
+                agg_df.write.format("noop").mode("overwrite").save()
+                spark.catalog.clearCache()
+
+            results.append(summarize("process_and_aggregate", size, time_call(run, repeat), size))
+    finally:
+        spark.stop()
+    return results
+
+def git_commit() -> Optional[str]:
+    """Commit atual do repositório, para identificar a execução."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_last_run(path: str) -> Optional[Dict]:
+    """Retorna a última execução registrada no arquivo de resultados."""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        lines = [line for line in f if line.strip()]
+    return json.loads(lines[-1]) if lines else None
+
+def compare_runs(current: Dict, baseline: Dict, threshold: float = DEFAULT_REGRESSION_THRESHOLD) -> List[Dict]:
+    """
+    Compara o tempo mínimo de cada benchmark com a execução de referência.
+    Retorna os benchmarks cuja razão atual/referência passou do limite.
+    """
+    reference = {(result["name"], result["size"]): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        previous = reference.get((result["name"], result["size"]))
+        if not previous or not previous["seconds_min"]:
+            continue
+        ratio = result["seconds_min"] / previous["seconds_min"]
+        logging.info(f"{result['name']} [{result['size']}]: {ratio:.2f}x da referência ({baseline.get('git_commit')})")
+        if ratio > threshold:
+            regressions.append({"name": result["name"], "size": result["size"], "ratio": round(ratio, 3)})
+    return regressions
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline Bovespa com carga sintética.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Tamanhos de carga da extração.")
+    parser.add_argument("--spark-sizes", type=int, nargs="*", default=DEFAULT_SPARK_SIZES, help="Tamanhos de carga do job Glue (vazio para pular).")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetições por benchmark.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Arquivo (JSON por linha) onde a execução é acrescentada.")
+    parser.add_argument("--baseline", help="Arquivo de resultados de referência para comparação.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD, help="Razão de tempo que caracteriza regressão.")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Retorna código 1 se houver regressão.")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as workdir:
+        results = bench_extract(args.sizes, args.repeat, workdir)
+        results += bench_startup(args.repeat)
+        if args.spark_sizes:
+            results += bench_refine(args.spark_sizes, args.repeat, workdir)
+    run = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "results": results
+    }
+    with open(args.output, "a", encoding="utf-8") as f:
+        f.write(json.dumps(run, ensure_ascii=False) + "\n")
+    logging.info(f"Resultados gravados em {args.output}")
+
+    if args.baseline:
+        baseline = load_last_run(args.baseline)
+        if baseline is None:
+            logging.warning(f"Arquivo de referência vazio ou inexistente: {args.baseline}")
+            return 0
+        regressions = compare_runs(run, baseline, args.threshold)
+        if regressions:
+            logging.warning(f"Regressões acima de {args.threshold}x: {regressions}")
+            if args.fail_on_regression:
+                return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
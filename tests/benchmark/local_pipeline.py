@@ -0,0 +1,282 @@
+"""
+Execução local de ponta a ponta do pipeline: extração -> disparo do job -> refinamento.
+
+Roda o lambda_handler da extração contra uma resposta gravada da B3 (ou uma carga sintética com --size),
+gravando em um S3 substituto no disco local (um diretório por bucket). A notificação S3 dos arquivos gravados
+passa pela Lambda de disparo, cujo cliente Glue é substituído por um que apenas registra os argumentos do job.
+Esses argumentos alimentam o run_pipeline do job Glue em uma SparkSession local (CATALOG_MODE=none).
+Para cada etapa são reportados tempo de parede, linhas e bytes; a execução é acrescentada ao arquivo de saída.
+
+Uso (a partir da raiz do repositório):
+    python tests/benchmark/local_pipeline.py
+    python tests/benchmark/local_pipeline.py --size 100000 --features --profile pipeline.prof
+"""
+import argparse
+import cProfile
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+from unittest.mock import patch
+from urllib.parse import quote_plus
+
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+import requests
+from requests.adapters import BaseAdapter
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from benchmark_pipeline import DEFAULT_OUTPUT, EXTRACT_MODULE_PATH, GLUE_MODULE_PATH, git_commit, load_module
+from synthetic_b3 import make_portfolio_day
+
+TRIGGER_MODULE_PATH = 'src/lambda/lambda-trigger-glue-bovespa/lambda_function.py'
+EXTRACT_RULE_PATH = 'src/event-bridge/start-lambda-lambda-extract-bovespa/start-lambda-lambda-extract-bovespa.json'
+DEFAULT_RESPONSE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'b3_portfolio_day_2025-07-14.json')
+AWS_REGION = 'us-east-1'
+
+class LocalS3:
+    """
+    Substituto do S3 no disco local: s3://bucket/chave corresponde a <root>/bucket/chave.
+    """
+    def __init__(self, root: str):
+        self.root = root
+
+    def local_path(self, bucket: str, key: str = "") -> str:
+        return os.path.join(self.root, bucket, key)
+
+    def resolve_filesystem(self, path: str) -> tuple:
+        """Mesma assinatura do resolve_filesystem da extração, apontando s3:// para o disco local."""
+        if path.startswith("s3://"):
+            bucket, _, key = path[len("s3://"):].partition("/")
+            return pafs.LocalFileSystem(), self.local_path(bucket, key)
+        return pafs.LocalFileSystem(), os.path.abspath(path)
+
+    def list_objects(self, bucket: str, prefix: str = "") -> Dict[str, Tuple[int, float]]:
+        """Lista as chaves do bucket sob o prefixo, com tamanho e data de modificação."""
+        objects = {}
+        base = self.local_path(bucket)
+        for directory, _, files in os.walk(base):
+            for name in files:
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, base).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    stat = os.stat(path)
+                    objects[key] = (stat.st_size, stat.st_mtime)
+        return objects
+
+    def parquet_stats(self, bucket: str, prefix: str) -> Dict[str, int]:
+        """Arquivos, linhas (pelos footers) e bytes dos arquivos Parquet sob o prefixo."""
+        keys = {key: size for key, (size, _) in self.list_objects(bucket, prefix).items() if key.endswith(".parquet")}
+        rows = sum(pq.ParquetFile(self.local_path(bucket, key)).metadata.num_rows for key in keys)
+        return {"files": len(keys), "rows": rows, "bytes": sum(keys.values())}
+
+def object_created_event(bucket: str, objects: Dict[str, Tuple[int, float]], region: str = AWS_REGION) -> dict:
+    """Notificação S3 nativa (ObjectCreated:Put) para os objetos gravados, como a entregue à Lambda de disparo."""
+    return {"Records": [
+        {
+            "eventSource": "aws:s3",
+            "eventName": "ObjectCreated:Put",
+            "awsRegion": region,
+            "s3": {"bucket": {"name": bucket}, "object": {"key": quote_plus(key, safe="/="), "size": size}}
+        }
+        for key, (size, _) in sorted(objects.items())
+    ]}
+
+class RecordedResponseAdapter(BaseAdapter):
+    """Adapter HTTP que responde toda requisição com o corpo gravado da API da B3."""
+    def __init__(self, body: bytes):
+        super().__init__()
+        self.body = body
+        self.requests = 0
+
+    def send(self, request, **kwargs):
+        self.requests += 1
+        response = requests.Response()
+        response.status_code = 200
+        response.headers["Content-Type"] = "application/json"
+        response.raw = io.BytesIO(self.body)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+class LocalGlueClient:
+    """Cliente Glue substituto: sem execuções ativas; start_job_run apenas registra os argumentos."""
+    def __init__(self):
+        self.job_runs: List[Dict] = []
+
+    def get_job_runs(self, JobName: str, MaxResults: int = 25) -> dict:
+        return {"JobRuns": []}
+
+    def start_job_run(self, JobName: str, Arguments: Dict[str, str]) -> dict:
+        job_run_id = f"jr_local_{uuid.uuid4().hex[:12]}"
+        self.job_runs.append({"JobName": JobName, "Arguments": dict(Arguments), "Id": job_run_id})
+        return {"JobRunId": job_run_id}
+
+def extract_event(stream: bool = False, indices: Optional[List[str]] = None) -> dict:
+    """
+    Evento da regra do EventBridge que agenda a extração, em modo colunar (ou stream) para gravar via pyarrow.
+    Com 'indices', consulta esses índices da B3 (todos respondidos com o mesmo corpo gravado).
+    """
+    with open(EXTRACT_RULE_PATH, encoding="utf-8") as f:
+        rule = json.load(f)
+    event = json.loads(next(iter(rule["Resources"].values()))["Properties"]["Targets"][0]["Input"])
+    event["columnar"] = True
+    event["stream"] = stream
+    if indices:
+        event["api"]["parameters"]["index"] = indices
+    return event
+
+def job_args(arguments: Dict[str, str], defaults: Dict[str, str], overrides: Dict[str, str]) -> Dict[str, str]:
+    """Converte os argumentos do start_job_run (--CHAVE) no dicionário resolvido pelo job."""
+    args = dict(defaults)
+    args.update({name.lstrip("-"): value for name, value in arguments.items()})
+    args.update(overrides)
+    return args
+
+def timed(stage: str, func: Callable, stages: List[Dict]):
+    """Executa func e registra o tempo de parede da etapa; linhas e bytes são preenchidos pelo chamador."""
+    start = time.perf_counter()
+    result = func()
+    stages.append({"stage": stage, "seconds": round(time.perf_counter() - start, 6)})
+    return result
+
+def run(body: bytes, workdir: str, features: bool = False, stream: bool = False,
+        indices: Optional[List[str]] = None) -> List[Dict]:
+    """Executa as três etapas sobre o S3 substituto em workdir e retorna as medições de cada uma."""
+    local_s3 = LocalS3(workdir)
+    lf = load_module("local_lambda_extract_bovespa", EXTRACT_MODULE_PATH)
+    trigger = load_module("local_lambda_trigger_glue_bovespa", TRIGGER_MODULE_PATH)
+    job = load_module("local_glue_refined_zone_bovespa", GLUE_MODULE_PATH)
+    stages: List[Dict] = []
+
+    # Extração: resposta gravada servida pelo adapter HTTP, escrita no S3 substituto
+    event = extract_event(stream, indices)
+    bucket, raw_prefix = event["s3_bucket"], event["s3_prefix"]
+    adapter = RecordedResponseAdapter(body)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    before = local_s3.list_objects(bucket, raw_prefix)
+    with patch.object(lf, "get_session", return_value=session), \
+            patch.object(lf, "resolve_filesystem", side_effect=local_s3.resolve_filesystem):
+        response = timed("extract", lambda: lf.lambda_handler(event, None), stages)
+    if response["statusCode"] != 200:
+        raise RuntimeError(f"Extração retornou {response['statusCode']}: {response['body']}")
+    written = {key: value for key, value in local_s3.list_objects(bucket, raw_prefix).items() if before.get(key) != value}
+    raw_stats = local_s3.parquet_stats(bucket, raw_prefix)
+    stages[-1].update(rows_in=len(json.loads(body).get("results", [])) * adapter.requests, bytes_in=len(body) * adapter.requests,
+                      rows_out=raw_stats["rows"], bytes_out=raw_stats["bytes"], files_out=raw_stats["files"],
+                      http_requests=adapter.requests)
+
+    # Disparo: notificação S3 dos arquivos gravados -> argumentos do job
+    s3_event = object_created_event(bucket, {key: value for key, value in written.items() if key.endswith(".parquet")})
+    glue_client = LocalGlueClient()
+    with patch.object(trigger, "get_glue_client", return_value=glue_client):
+        response = timed("trigger", lambda: trigger.lambda_handler(s3_event, None), stages)
+    if response["statusCode"] != 200 or not glue_client.job_runs:
+        raise RuntimeError(f"Disparo do job retornou {response['statusCode']}: {response['body']}")
+    arguments = glue_client.job_runs[0]["Arguments"]
+    stages[-1].update(rows_in=len(s3_event["Records"]), bytes_in=len(json.dumps(s3_event)),
+                      rows_out=len(glue_client.job_runs), bytes_out=len(json.dumps(arguments)))
+
+    # Refinamento: run_pipeline do job em SparkSession local, sem catálogo
+    from pyspark.sql import SparkSession
+    spark = timed("spark_startup", lambda: (
+        SparkSession.builder.master("local[*]")
+        .appName("local-pipeline-bovespa")
+        .config("spark.ui.enabled", "false")
+        .getOrCreate()
+    ), stages)
+    spark.sparkContext.setLogLevel("ERROR")
+    try:
+        args = job_args(arguments, job.OPTIONAL_PARAMS, {
+            "CATALOG_MODE": "none",
+            "FEATURES": "true" if features else "false"
+        })
+        job.LOCAL_STORAGE_ROOT = workdir
+        timed("refine", lambda: job.run_pipeline(spark, args), stages)
+    finally:
+        spark.stop()
+    refined_stats = local_s3.parquet_stats(args["S3_OUTPUT_BUCKET"], args["S3_OUTPUT_PREFIX"])
+    stages[-1].update(rows_in=raw_stats["rows"], bytes_in=raw_stats["bytes"],
+                      rows_out=refined_stats["rows"], bytes_out=refined_stats["bytes"], files_out=refined_stats["files"])
+    if features:
+        features_stats = local_s3.parquet_stats(args["S3_OUTPUT_BUCKET"], job.default_features_prefix(args["S3_OUTPUT_PREFIX"]))
+        stages[-1].update(features_rows_out=features_stats["rows"], features_bytes_out=features_stats["bytes"])
+    return stages
+
+def report(stages: List[Dict]) -> None:
+    """Loga uma tabela com tempo, linhas e bytes de cada etapa."""
+    logging.info(f"{'etapa':<14}{'segundos':>10}{'linhas in':>11}{'linhas out':>12}{'bytes in':>12}{'bytes out':>12}")
+    for stage in stages:
+        logging.info(
+            f"{stage['stage']:<14}{stage['seconds']:>10.3f}{stage.get('rows_in', ''):>11}{stage.get('rows_out', ''):>12}"
+            f"{stage.get('bytes_in', ''):>12}{stage.get('bytes_out', ''):>12}"
+        )
+    logging.info(f"{'total':<14}{sum(stage['seconds'] for stage in stages):>10.3f}")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Execução local de ponta a ponta do pipeline Bovespa com tempo por etapa.")
+    parser.add_argument("--response", default=DEFAULT_RESPONSE, help="Resposta gravada da API da B3 (JSON).")
+    parser.add_argument("--size", type=int, help="Usa uma carga sintética com esse número de itens em vez da resposta gravada.")
+    parser.add_argument("--stream", action="store_true", help="Extrai no modo stream (ijson) em vez do colunar.")
+    parser.add_argument("--indices", nargs="+", help="Índices da B3 consultados na extração (padrão: o da regra do EventBridge).")
+    parser.add_argument("--features", action="store_true", help="Atualiza também a tabela de features por ação.")
+    parser.add_argument("--workdir", help="Diretório do S3 substituto (padrão: temporário, removido ao final).")
+    parser.add_argument("--profile", help="Grava o perfil (cProfile) da execução completa nesse arquivo.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Arquivo (JSON por linha) onde a execução é acrescentada.")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args = parse_args(argv)
+    if args.size:
+        body = json.dumps(make_portfolio_day(args.size), ensure_ascii=False).encode("utf-8")
+    else:
+        with open(args.response, "rb") as f:
+            body = f.read()
+    # As Lambdas e o job logam cada etapa em INFO; durante a execução só avisos e erros são exibidos
+    handlers = logging.getLogger().handlers
+    for handler in handlers:
+        handler.setLevel(logging.WARNING)
+
+    profiler = cProfile.Profile() if args.profile else None
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = os.path.abspath(args.workdir) if args.workdir else tmpdir
+        if profiler:
+            profiler.enable()
+        try:
+            stages = run(body, workdir, features=args.features, stream=args.stream, indices=args.indices)
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(args.profile)
+    for handler in handlers:
+        handler.setLevel(logging.NOTSET)
+    logging.getLogger().setLevel(logging.INFO)
+    report(stages)
+    if profiler:
+        logging.info(f"Perfil gravado em {args.profile} (python -m pstats {args.profile})")
+
+    result = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "benchmark": "e2e",
+        "source": f"synthetic:{args.size}" if args.size else os.path.basename(args.response),
+        "stages": stages
+    }
+    with open(args.output, "a", encoding="utf-8") as f:
+        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    logging.info(f"Resultados gravados em {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+import random
+from datetime import date
+from typing import Dict, List
+
+# Setores e tipos de ação no formato retornado pela API da B3 (amostra em data/tbl_raw_bovespa)
+SEGMENTS: List[str] = [
+    "Bens Indls / Máqs e Equips", "Bens Indls / Mat Transporte", "Bens Indls/Transporte",
+    "Cons N Cíclico / Bebidas", "Consumo Cíclico / Comércio", "Consumo Cíclico/Constr Civil",
+    "Financ e Outros / Interms Financs", "Financ e Outros / Explor Imóveis", "Mats Básicos / Mineração",
+    "Mats Básicos / Sid Metalurgia", "Petróleo, Gás e Biocombustíveis", "Saúde/SM Hosp An.Diag",
+    "Tec.Informação/Programas Servs", "Telecomunicação", "Utilidade Públ / Energ Elétrica",
+    "Utilidade Públ / Água Saneamento"
+]
+TYPES: List[str] = ["ON      NM", "PN      N2", "ON", "UNT     N1", "PN      N1", "PNB     N1"]
+
+# Tamanhos de carga padrão (quantidade de itens em 'results')
+DEFAULT_SIZES: List[int] = [100, 10_000, 100_000, 1_000_000]
+
+def format_br_decimal(value: float, scale: int = 3) -> str:
+    """Formata o número como a B3: vírgula decimal (ex.: 2,802)."""
+    return f"{value:.{scale}f}".replace(".", ",")
+
+def format_br_integer(value: int) -> str:
+    """Formata o inteiro como a B3: ponto como separador de milhar (ex.: 1.482.105.837)."""
+    return f"{value:,}".replace(",", ".")
+
+def make_portfolio_day(num_results: int, day: date = date(2025, 7, 14), seed: int = 42, index: str = "IBOV") -> Dict:
+    """
+    Gera uma resposta sintética da API da B3 no formato consumido por portfolio_day_to_df,
+    com num_results itens em 'results' e já marcada com o índice (como em get_portfolio_indices).
+    O número de empresas cresce com a carga (cerca de 3 ativos por empresa).
+    """
+    rng = random.Random(seed)
+    num_assets = max(1, num_results // 3)
+    results = []
+    part_acum = 0.0
+    for position in range(num_results):
+        asset_index = position % num_assets
+        part = rng.uniform(0.001, 3.0)
+        part_acum += part
+        results.append({
+            "segment": SEGMENTS[asset_index % len(SEGMENTS)],
+            "cod": f"T{position:07d}",
+            "asset": f"EMPRESA {asset_index:06d}",
+            "type": TYPES[position % len(TYPES)],
+            "part": format_br_decimal(part),
+            "partAcum": format_br_decimal(part_acum),
+            "theoricalQty": format_br_integer(rng.randint(1_000_000, 5_000_000_000))
+        })
+    return {
+        "page": {"pageNumber": 1, "pageSize": num_results, "totalRecords": num_results, "totalPages": 1},
+        "header": {
+            "date": day.strftime("%d/%m/%y"),
+            "text": "Quantidade Teórica Total",
+            "part": "100,000",
+            "partAcum": "100,000",
+            "textReductor": "Redutor",
+            "reductor": "15.438.607,05630450",
+            "theoricalQty": format_br_integer(rng.randint(10**10, 10**11))
+        },
+        "results": results,
+        "index": index
+    }
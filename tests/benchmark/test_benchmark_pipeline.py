@@ -0,0 +1,72 @@
+import unittest
+import json
+import os
+import tempfile
+import pandas as pd
+
+import sys
+sys.path.append('tests/benchmark')
+import benchmark_pipeline as bp
+import local_pipeline as lp
+from synthetic_b3 import format_br_decimal, format_br_integer, make_portfolio_day
+
+class TestBenchmarkPipeline(unittest.TestCase):
+    def test_synthetic_day_matches_extract_shape(self):
+        lf = bp.load_module("bench_lambda_extract_bovespa", bp.EXTRACT_MODULE_PATH)
+        json_data = make_portfolio_day(300)
+        df = lf.portfolio_day_to_df(json_data)
+        self.assertEqual(len(df), 300)
+        self.assertEqual(df["results_asset"].nunique(), 100)
+        self.assertEqual(lf.portfolio_day_to_table(json_data).num_rows, 300)
+        self.assertEqual(make_portfolio_day(10), make_portfolio_day(10))
+
+    def test_typed_raw_matches_legacy_raw(self):
+        lf = bp.load_module("bench_lambda_extract_bovespa", bp.EXTRACT_MODULE_PATH)
+        rzp = bp.load_module("bench_refined_zone_pandas", 'src/glue/glue-refined-zone-bovespa/refined_zone_pandas.py')
+        with open(lp.DEFAULT_RESPONSE, encoding="utf-8") as f:
+            json_data = json.load(f)
+        with tempfile.TemporaryDirectory() as root:
+            lf.write_table_to_parquet(lf.portfolio_day_to_table(dict(json_data, index="IBOV")), root)
+            typed = rzp.process_data(rzp.read_data(root))
+        legacy = rzp.process_data(rzp.read_data('data/tbl_raw_bovespa'))
+        pd.testing.assert_frame_equal(typed, legacy, check_categorical=False)
+
+    def test_br_number_format(self):
+        self.assertEqual(format_br_decimal(2.8024), "2,802")
+        self.assertEqual(format_br_integer(1482105837), "1.482.105.837")
+
+    def test_compare_runs(self):
+        baseline = {"git_commit": "abc", "results": [
+            {"name": "portfolio_day_to_df", "size": 100, "seconds_min": 1.0},
+            {"name": "build_b3_url", "size": 1000, "seconds_min": 1.0}
+        ]}
+        current = {"results": [
+            {"name": "portfolio_day_to_df", "size": 100, "seconds_min": 1.5},
+            {"name": "build_b3_url", "size": 1000, "seconds_min": 1.1},
+            {"name": "parquet_write_pyarrow", "size": 100, "seconds_min": 9.0}
+        ]}
+        regressions = bp.compare_runs(current, baseline, threshold=1.2)
+        self.assertEqual(regressions, [{"name": "portfolio_day_to_df", "size": 100, "ratio": 1.5}])
+
+    def test_local_s3_event_reaches_trigger_payload(self):
+        trigger = bp.load_module("bench_lambda_trigger_glue_bovespa", lp.TRIGGER_MODULE_PATH)
+        with tempfile.TemporaryDirectory() as root:
+            local_s3 = lp.LocalS3(root)
+            _, path = local_s3.resolve_filesystem("s3://bucket/raw/year=2025/month=7/day=14/a b.parquet")
+            self.assertEqual(path, os.path.join(root, "bucket", "raw/year=2025/month=7/day=14/a b.parquet"))
+            os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as f:
+                f.write(b"x")
+            event = lp.object_created_event("bucket", local_s3.list_objects("bucket", "raw/"))
+        self.assertTrue(trigger.is_s3_event(event))
+        payloads = trigger.payloads_from_message(event)
+        self.assertEqual(payloads[0]["job_parameters"]["--PARTITIONS"], "year=2025/month=7/day=14")
+        self.assertEqual(payloads[0]["job_parameters"]["--OBJECT_KEY"], "raw/year=2025/month=7/day=14/")
+
+    def test_job_args(self):
+        args = lp.job_args({"--S3_BUCKET": "bucket", "--CATALOG_MODE": "msck"}, {"CATALOG_MODE": "partitions", "FEATURES": "false"},
+                           {"CATALOG_MODE": "none"})
+        self.assertEqual(args, {"S3_BUCKET": "bucket", "CATALOG_MODE": "none", "FEATURES": "false"})
+
+if __name__ == "__main__":
+    unittest.main()
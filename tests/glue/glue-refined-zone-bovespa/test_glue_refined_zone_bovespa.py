@@ -1,9 +1,31 @@
 import unittest
 from unittest.mock import patch, MagicMock
+import importlib.util
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import date
+from decimal import Decimal
+from botocore.exceptions import ClientError
+
 import sys
+sys.path.append('src/shared')
+
+SPARK_SCRIPT = 'src/glue/glue-refined-zone-bovespa/glue-refined-zone-bovespa.py'
+RAW_PATH = 'data/tbl_raw_bovespa'
+# Chaves da tabela refinada criada antes de cod_indice
+LEGACY_REFINED_PARTITIONS = [
+    {'Name': 'year', 'Type': 'int'}, {'Name': 'month', 'Type': 'int'},
+    {'Name': 'day', 'Type': 'int'}, {'Name': 'nom_setor', 'Type': 'string'}
+]
 
-sys.path.append('src/glue/glue-refined-zone-bovespa')
-import glue_refined_zone_bovespa as grzb
+# O script do job tem hífens no nome: carregado pelo caminho e registrado em sys.modules para os patch()
+spec = importlib.util.spec_from_file_location("glue_refined_zone_bovespa", SPARK_SCRIPT)
+grzb = importlib.util.module_from_spec(spec)
+sys.modules["glue_refined_zone_bovespa"] = grzb
+spec.loader.exec_module(grzb)
 
 class TestGlueRefinedZoneBovespa(unittest.TestCase):
     def test_validate_params(self):
@@ -29,5 +51,541 @@ class TestGlueRefinedZoneBovespa(unittest.TestCase):
         with self.assertRaises(ValueError):
             grzb.validate_schema(DummyDF(), ["a", "b", "c"])
 
+    @patch("glue_refined_zone_bovespa.getResolvedOptions", return_value={'DATA_QUALITY_CHECKS': 'false'})
+    def test_resolve_optional_params(self, mock_resolved):
+        resolved = grzb.resolve_optional_params(['job.py', '--DATA_QUALITY_CHECKS', 'false'])
+        self.assertEqual(resolved['DATA_QUALITY_CHECKS'], 'false')
+        mock_resolved.assert_called_once()
+        mock_resolved.reset_mock()
+        resolved = grzb.resolve_optional_params(['job.py'])
+        self.assertEqual(resolved['DATA_QUALITY_CHECKS'], 'true')
+        mock_resolved.assert_not_called()
+
+    def test_is_enabled(self):
+        self.assertTrue(grzb.is_enabled('true'))
+        self.assertTrue(grzb.is_enabled('True'))
+        self.assertFalse(grzb.is_enabled('false'))
+
+    def test_job_metrics_disabled(self):
+        metrics = grzb.JobMetrics(enabled=False)
+        df = MagicMock()
+        self.assertIs(metrics.observe(df, "input"), df)
+        df.observe.assert_not_called()
+        self.assertEqual(metrics.log(), {})
+
+    def test_job_metrics_to_dict(self):
+        metrics = grzb.JobMetrics()
+        input_obs, processed_obs = MagicMock(), MagicMock()
+        input_obs.get = {"input_rows": 10, "null_rows_results_cod": 2}
+        processed_obs.get = {"processed_rows": 8}
+        metrics._observations = {"input": input_obs, "processed": processed_obs}
+        self.assertEqual(metrics.to_dict(), {
+            "input_rows": 10, "null_rows_results_cod": 2, "processed_rows": 8, "dropped_rows": 2
+        })
+
+    def test_raw_table_root(self):
+        self.assertEqual(
+            grzb.raw_table_root('raw-zone/tbl_raw_bovespa/year=2025/month=7/day=14/file.parquet'),
+            'raw-zone/tbl_raw_bovespa/'
+        )
+        self.assertEqual(grzb.raw_table_root('raw-zone/tbl_raw_bovespa'), 'raw-zone/tbl_raw_bovespa/')
+
+    @patch("glue_refined_zone_bovespa.boto3.client")
+    def test_list_raw_partitions(self, mock_boto):
+        root = 'raw-zone/tbl_raw_bovespa/'
+        mock_boto.return_value.get_paginator.return_value.paginate.return_value = [{
+            'Contents': [
+                {'Key': f'{root}year=2025/month=7/day=14/a.snappy.parquet', 'ETag': '"1"'},
+                {'Key': f'{root}year=2025/month=7/day=14/_manifest.json', 'ETag': '"2"'},
+                {'Key': f'{root}year=2025/month=7/day=15/b.snappy.parquet', 'ETag': '"3"'},
+                {'Key': f'{root}outro/c.parquet', 'ETag': '"4"'}
+            ]
+        }]
+        partitions = grzb.list_raw_partitions('bucket', root, 'us-east-1')
+        self.assertEqual(sorted(partitions), ['year=2025/month=7/day=14', 'year=2025/month=7/day=15'])
+
+    def test_select_pending_partitions(self):
+        current = {'year=2025/month=7/day=14': 'a', 'year=2025/month=7/day=15': 'b', 'year=2025/month=7/day=16': 'c'}
+        processed = {'year=2025/month=7/day=14': 'a', 'year=2025/month=7/day=15': 'old'}
+        self.assertEqual(
+            grzb.select_pending_partitions(current, processed),
+            ['year=2025/month=7/day=15', 'year=2025/month=7/day=16']
+        )
+
+    def test_raw_read_schema(self):
+        self.assertEqual(
+            grzb.RAW_READ_SCHEMA.fieldNames(),
+            grzb.EXPECTED_COLUMNS + ["year", "month", "day", "index"]
+        )
+        self.assertEqual(grzb.RAW_READ_SCHEMA["results_part"].dataType, grzb.RAW_DECIMAL_TYPE)
+        self.assertEqual(grzb.RAW_READ_SCHEMA["results_theoricalQty"].dataType, grzb.LongType())
+        self.assertEqual(grzb.LEGACY_RAW_READ_SCHEMA["results_part"].dataType, grzb.StringType())
+        self.assertEqual(grzb.LEGACY_RAW_READ_SCHEMA.fieldNames(), grzb.RAW_READ_SCHEMA.fieldNames())
+        # 'auto' converte as partições legadas para os tipos de 'typed' antes da união
+        self.assertEqual(grzb.raw_read_schema('auto'), grzb.RAW_READ_SCHEMA)
+
+    def test_parallelism_settings(self):
+        self.assertEqual(grzb.parallelism_settings(1, 40)["spark.sql.shuffle.partitions"], "1")
+        self.assertEqual(grzb.parallelism_settings(10, 40)["spark.sql.shuffle.partitions"], "10")
+        self.assertEqual(grzb.parallelism_settings(750, 40)["spark.sql.shuffle.partitions"], "188")
+        settings = grzb.parallelism_settings(10000, 40)
+        self.assertEqual(settings["spark.sql.shuffle.partitions"], str(grzb.MAX_SHUFFLE_PARTITIONS))
+        self.assertEqual(settings["spark.sql.adaptive.enabled"], "true")
+        self.assertEqual(settings["spark.sql.adaptive.skewJoin.enabled"], "true")
+
+    def test_apply_parallelism_profile(self):
+        df = MagicMock()
+        df.inputFiles.return_value = [
+            "s3://b/raw/year=2025/month=7/day=14/index=IBOV/a.parquet",
+            "s3://b/raw/year=2025/month=7/day=14/index=IBOV/b.parquet",
+            "s3://b/raw/year=2025/month=7/day=14/index=SMLL/a.parquet"
+        ]
+        spark = MagicMock()
+        spark.sparkContext.defaultParallelism = 8
+        settings = grzb.apply_parallelism_profile(spark, df)
+        self.assertEqual(settings["spark.sql.shuffle.partitions"], "2")
+        spark.conf.set.assert_any_call("spark.sql.shuffle.partitions", "2")
+        self.assertEqual(grzb.apply_parallelism_profile(spark, df, 'spark'), {})
+
+    def test_catalog_partitions_include_index(self):
+        self.assertEqual([column['Name'] for column in grzb.REFINED_CATALOG_PARTITIONS], grzb.REFINED_PARTITION_KEYS)
+        self.assertEqual([column['Name'] for column in grzb.FEATURES_CATALOG_PARTITIONS], grzb.FEATURES_PARTITION_KEYS)
+        self.assertIn('cod_indice', grzb.REFINED_PARTITION_KEYS)
+
+    def test_partition_date_filter(self):
+        self.assertIsNone(grzb.partition_date_filter())
+        with self.assertRaises(ValueError):
+            grzb.partition_date_filter("14/07/2025")
+
+    def test_s3_uri(self):
+        self.assertEqual(grzb.s3_uri("bucket", "raw/year=2025/"), "s3://bucket/raw/year=2025/")
+        with patch.object(grzb, "LOCAL_STORAGE_ROOT", "/tmp/s3/"):
+            self.assertEqual(grzb.s3_uri("bucket", "raw/year=2025/"), "file:///tmp/s3/bucket/raw/year=2025/")
+
+    def test_parse_partitions(self):
+        self.assertEqual(
+            grzb.parse_partitions("year=2025/month=7/day=15, year=2025/month=7/day=14/,year=2025/month=7/day=15"),
+            ["year=2025/month=7/day=14", "year=2025/month=7/day=15"]
+        )
+        with self.assertRaises(ValueError):
+            grzb.parse_partitions("year=2025/month=7")
+
+    def test_escape_partition_value(self):
+        self.assertEqual(grzb.escape_partition_value("Bens Indls / Máqs e Equips"), "Bens Indls %2F Máqs e Equips")
+        self.assertEqual(grzb.escape_partition_value("a:b=c"), "a%3Ab%3Dc")
+        self.assertEqual(grzb.escape_partition_value(None), "__HIVE_DEFAULT_PARTITION__")
+
+    def test_build_partition_inputs(self):
+        partitions = [{'year': '2025', 'month': '7', 'day': '14', 'nom_setor': 'Saúde/SM Hosp'}]
+        inputs = grzb.build_partition_inputs(
+            partitions, ["year", "month", "day", "nom_setor"], {'Columns': []}, 'bucket', 'refined/'
+        )
+        self.assertEqual(inputs[0]['Values'], ['2025', '7', '14', 'Saúde/SM Hosp'])
+        self.assertEqual(
+            inputs[0]['StorageDescriptor']['Location'],
+            's3://bucket/refined/year=2025/month=7/day=14/nom_setor=Saúde%2FSM Hosp/'
+        )
+
+    @patch("glue_refined_zone_bovespa.boto3")
+    def test_register_partitions(self, mock_boto):
+        glue = mock_boto.client.return_value
+        glue.get_table.return_value = {'Table': {'StorageDescriptor': {'Columns': []}}}
+        glue.batch_create_partition.return_value = {
+            'Errors': [{'ErrorDetail': {'ErrorCode': 'AlreadyExistsException'}}]
+        }
+        partitions = [{'year': '2025', 'month': '7', 'day': str(day)} for day in range(1, 151)]
+        grzb.register_partitions('db', 'table', 'bucket', 'refined', partitions, ["year", "month", "day"], 'us-east-1')
+        self.assertEqual(glue.batch_create_partition.call_count, 2)
+        # Partições já registradas (reescritas) também marcam a escrita na tabela
+        table_input = glue.update_table.call_args.kwargs['TableInput']
+        self.assertEqual(table_input['StorageDescriptor'], {'Columns': []})
+        self.assertIn(grzb.LAST_WRITE_PARAMETER, table_input['Parameters'])
+        # Uma atualização por execução: sem arquivar uma versão da tabela a cada uma
+        self.assertTrue(glue.update_table.call_args.kwargs['SkipArchive'])
+
+        glue.batch_create_partition.return_value = {
+            'Errors': [{'ErrorDetail': {'ErrorCode': 'AccessDeniedException'}}]
+        }
+        with self.assertRaises(RuntimeError):
+            grzb.register_partitions('db', 'table', 'bucket', 'refined', partitions[:1], ["year", "month", "day"], 'us-east-1')
+
+    @patch("glue_refined_zone_bovespa.boto3")
+    def test_register_partitions_empty(self, mock_boto):
+        grzb.register_partitions('db', 'table', 'bucket', 'refined', [], ["year"], 'us-east-1')
+        mock_boto.client.assert_not_called()
+
+    @patch("glue_refined_zone_bovespa.migrate_partition_keys")
+    @patch("glue_refined_zone_bovespa.boto3")
+    def test_ensure_partition_keys(self, mock_boto, mock_migrate):
+        glue = mock_boto.client.return_value
+        glue.get_table.side_effect = ClientError({'Error': {'Code': 'EntityNotFoundException'}}, 'GetTable')
+        grzb.ensure_partition_keys('db', 'tbl', 'out', 'refined/', grzb.REFINED_CATALOG_PARTITIONS, 'us-east-1')
+
+        glue.get_table.side_effect = None
+        glue.get_table.return_value = {'Table': {'PartitionKeys': grzb.REFINED_CATALOG_PARTITIONS}}
+        grzb.ensure_partition_keys('db', 'tbl', 'out', 'refined/', grzb.REFINED_CATALOG_PARTITIONS, 'us-east-1')
+        mock_migrate.assert_not_called()
+
+        # Tabela criada antes de cod_indice: falha sem MIGRATE_PARTITION_KEYS, migra com ela
+        glue.get_table.return_value = {'Table': {'PartitionKeys': LEGACY_REFINED_PARTITIONS}}
+        with self.assertRaises(RuntimeError):
+            grzb.ensure_partition_keys('db', 'tbl', 'out', 'refined/', grzb.REFINED_CATALOG_PARTITIONS, 'us-east-1')
+        grzb.ensure_partition_keys('db', 'tbl', 'out', 'refined/', grzb.REFINED_CATALOG_PARTITIONS, 'us-east-1', migrate=True)
+        mock_migrate.assert_called_once_with('db', 'tbl', 'out', 'refined/', grzb.REFINED_CATALOG_PARTITIONS, 'us-east-1')
+
+    @patch("glue_refined_zone_bovespa.register_partitions")
+    @patch("glue_refined_zone_bovespa.boto3")
+    def test_migrate_partition_keys(self, mock_boto, mock_register):
+        glue, s3 = MagicMock(), MagicMock()
+        mock_boto.client.side_effect = lambda service, **kwargs: {'glue': glue, 's3': s3}[service]
+        glue.get_table.return_value = {'Table': {
+            'Name': 'tbl', 'DatabaseName': 'db', 'PartitionKeys': LEGACY_REFINED_PARTITIONS,
+            'StorageDescriptor': {'Columns': []}, 'Parameters': {}
+        }}
+        glue.get_paginator.return_value.paginate.return_value = [{'Partitions': [
+            {'Values': ['2025', '7', '14', 'Energia'],
+             'StorageDescriptor': {'Location': 's3://out/refined/year=2025/month=7/day=14/nom_setor=Energia'}}
+        ]}]
+        s3.get_paginator.return_value.paginate.return_value = [{'Contents': [
+            {'Key': 'refined/year=2025/month=7/day=14/nom_setor=Energia/part-0.parquet'}
+        ]}]
+        migrated = grzb.migrate_partition_keys('db', 'tbl', 'out', 'refined/', grzb.REFINED_CATALOG_PARTITIONS, 'us-east-1')
+
+        self.assertEqual(migrated, 1)
+        s3.copy_object.assert_called_once_with(
+            Bucket='out', Key='refined/year=2025/month=7/day=14/cod_indice=IBOV/nom_setor=Energia/part-0.parquet',
+            CopySource={'Bucket': 'out', 'Key': 'refined/year=2025/month=7/day=14/nom_setor=Energia/part-0.parquet'}
+        )
+        glue.batch_delete_partition.assert_called_once_with(
+            DatabaseName='db', TableName='tbl', PartitionsToDelete=[{'Values': ['2025', '7', '14', 'Energia']}]
+        )
+        self.assertEqual(glue.update_table.call_args.kwargs['TableInput']['PartitionKeys'], grzb.REFINED_CATALOG_PARTITIONS)
+        self.assertTrue(all(call.kwargs['SkipArchive'] for call in glue.update_table.call_args_list))
+        self.assertEqual(mock_register.call_args.args[4],
+                         [{'year': '2025', 'month': '7', 'day': '14', 'nom_setor': 'Energia', 'cod_indice': 'IBOV'}])
+        # Os arquivos antigos só saem depois que o catálogo aponta para o novo layout
+        self.assertEqual(s3.delete_objects.call_args.kwargs['Delete']['Objects'],
+                         [{'Key': 'refined/year=2025/month=7/day=14/nom_setor=Energia/part-0.parquet'}])
+
+    @patch("glue_refined_zone_bovespa.boto3")
+    def test_touch_table_keeps_table_input(self, mock_boto):
+        glue = mock_boto.client.return_value
+        glue.get_table.return_value = {'Table': {
+            'Name': 'table', 'DatabaseName': 'db', 'CreateTime': 'x', 'UpdateTime': 'y', 'TableType': 'EXTERNAL_TABLE',
+            'PartitionKeys': [{'Name': 'year', 'Type': 'int'}], 'Parameters': {'classification': 'parquet'}
+        }}
+        grzb.touch_table('db', 'table', 'us-east-1')
+        table_input = glue.update_table.call_args.kwargs['TableInput']
+        self.assertEqual(set(table_input), {'Name', 'TableType', 'PartitionKeys', 'Parameters'})
+        self.assertEqual(table_input['Parameters']['classification'], 'parquet')
+        self.assertIn(grzb.LAST_WRITE_PARAMETER, table_input['Parameters'])
+
+    @patch("glue_refined_zone_bovespa.boto3")
+    def test_list_partition_files(self, mock_boto):
+        paginator = mock_boto.client.return_value.get_paginator.return_value
+        paginator.paginate.return_value = [{
+            'Contents': [
+                {'Key': 'refined/year=2025/month=7/day=14/nom_setor=A/p1.parquet', 'Size': 10},
+                {'Key': 'refined/year=2025/month=7/day=14/nom_setor=A/p2.parquet', 'Size': 20},
+                {'Key': 'refined/year=2025/month=7/day=14/nom_setor=B/p1.parquet', 'Size': 30},
+                {'Key': 'refined/year=2025/month=7/day=14/nom_setor=B/_SUCCESS', 'Size': 0}
+            ]
+        }]
+        files = grzb.list_partition_files('bucket', 'refined/', 'us-east-1')
+        self.assertEqual(len(files['refined/year=2025/month=7/day=14/nom_setor=A']), 2)
+        self.assertEqual(len(files['refined/year=2025/month=7/day=14/nom_setor=B']), 1)
+
+    def test_plan_compaction(self):
+        mb = 1024 * 1024
+        self.assertEqual(grzb.plan_compaction([{'Size': mb}] * 10, 128 * mb), 1)
+        self.assertEqual(grzb.plan_compaction([{'Size': 100 * mb}] * 3, 128 * mb), 0)
+        self.assertEqual(grzb.plan_compaction([{'Size': 100 * mb}] * 4, 128 * mb), 0)
+        self.assertEqual(grzb.plan_compaction([{'Size': 10 * mb}] * 30, 128 * mb), 3)
+        self.assertEqual(grzb.plan_compaction([{'Size': mb}], 128 * mb), 0)
+
+    @patch("glue_refined_zone_bovespa.boto3")
+    def test_compact_partition(self, mock_boto):
+        s3 = mock_boto.client.return_value
+        partition_dir = 'refined/year=2025/month=7/day=14/nom_setor=A'
+        staging = f'refined_compaction/{partition_dir}/'
+        s3.get_paginator.return_value.paginate.return_value = [{
+            'Contents': [{'Key': f'{staging}part-0.snappy.parquet'}, {'Key': f'{staging}_SUCCESS'}]
+        }]
+        spark = MagicMock()
+        df = spark.read.parquet.return_value
+        df.columns = ['nom_empresa', 'cod_indice']
+        files = [{'Key': f'{partition_dir}/p1.parquet', 'Size': 1}, {'Key': f'{partition_dir}/p2.parquet', 'Size': 1}]
+        options = grzb.parquet_layout_options(bloom_filter_columns=['nom_empresa'])
+        grzb.compact_partition(spark, 'bucket', partition_dir, files, 1, 'refined_compaction/', 'us-east-1',
+                               sort_columns=['nom_empresa', 'nom_setor'], parquet_options=options)
+        spark.read.parquet.assert_called_once_with(
+            f's3://bucket/{partition_dir}/p1.parquet', f's3://bucket/{partition_dir}/p2.parquet'
+        )
+        # Mesmo layout do write_data: ordenação pelas colunas de dados e opções do writer
+        df.repartitionByRange.assert_called_once_with(1, 'nom_empresa')
+        df.repartitionByRange.return_value.sortWithinPartitions.assert_called_once_with('nom_empresa')
+        writer = df.repartitionByRange.return_value.sortWithinPartitions.return_value.write
+        writer.mode.return_value.option.return_value.options.assert_called_once_with(**options)
+        s3.copy_object.assert_called_once_with(
+            Bucket='bucket', Key=f'{partition_dir}/part-0.snappy.parquet',
+            CopySource={'Bucket': 'bucket', 'Key': f'{staging}part-0.snappy.parquet'}
+        )
+        deleted = [[obj['Key'] for obj in call.kwargs['Delete']['Objects']] for call in s3.delete_objects.call_args_list]
+        self.assertEqual(deleted, [[file['Key'] for file in files], [f'{staging}part-0.snappy.parquet', f'{staging}_SUCCESS']])
+        s3.update_partition.assert_not_called()
+
+    @patch("glue_refined_zone_bovespa.boto3")
+    def test_swap_partition_files_through_catalog_location(self, mock_boto):
+        client = mock_boto.client.return_value
+        partition_dir = 'refined/year=2025/month=7/day=14/nom_setor=A'
+        staging = f'refined_compaction/{partition_dir}/'
+        client.get_paginator.return_value.paginate.return_value = [{'Contents': [{'Key': f'{staging}part-0.parquet'}]}]
+        partition = {
+            'Values': ['2025', '7', '14', 'A'], 'DatabaseName': 'db', 'TableName': 'tbl', 'CreationTime': 'x',
+            'StorageDescriptor': {'Columns': [], 'Location': f's3://bucket/{partition_dir}/'}
+        }
+        grzb.swap_partition_files('bucket', partition_dir, [f'{partition_dir}/p1.parquet'], staging, 'us-east-1',
+                                  'db', 'tbl', partition)
+        steps = [name for name, _, _ in client.method_calls if name in ('update_partition', 'copy_object', 'delete_objects')]
+        self.assertEqual(steps, ['update_partition', 'copy_object', 'delete_objects', 'update_partition', 'delete_objects'])
+        locations = [call.kwargs['PartitionInput']['StorageDescriptor']['Location'] for call in client.update_partition.call_args_list]
+        # Athena lê só os arquivos compactados enquanto o diretório da partição é trocado
+        self.assertEqual(locations, [f's3://bucket/{staging}', f's3://bucket/{partition_dir}/'])
+        self.assertEqual(set(client.update_partition.call_args.kwargs['PartitionInput']), {'Values', 'StorageDescriptor'})
+        self.assertEqual(client.update_partition.call_args.kwargs['PartitionValueList'], ['2025', '7', '14', 'A'])
+
+    @patch("glue_refined_zone_bovespa.boto3")
+    def test_list_catalog_partitions(self, mock_boto):
+        glue = mock_boto.client.return_value
+        glue.get_paginator.return_value.paginate.return_value = [{'Partitions': [
+            {'Values': ['A'], 'StorageDescriptor': {'Location': 's3://out/refined/nom_setor=A/'}},
+            {'Values': ['B'], 'StorageDescriptor': {'Location': 's3://out/refined_compaction/refined/nom_setor=B/'}}
+        ]}]
+        partitions = grzb.list_catalog_partitions('db', 'tbl', 'out', 'refined_compaction/', 'us-east-1')
+        self.assertEqual({key: value['Values'] for key, value in partitions.items()},
+                         {'refined/nom_setor=A': ['A'], 'refined/nom_setor=B': ['B']})
+
+        glue.get_paginator.return_value.paginate.side_effect = ClientError(
+            {'Error': {'Code': 'EntityNotFoundException'}}, 'GetPartitions'
+        )
+        self.assertEqual(grzb.list_catalog_partitions('db', 'tbl', 'out', 'refined_compaction/', 'us-east-1'), {})
+
+    @patch("glue_refined_zone_bovespa.swap_partition_files")
+    @patch("glue_refined_zone_bovespa.compact_partition")
+    @patch("glue_refined_zone_bovespa.list_catalog_partitions")
+    @patch("glue_refined_zone_bovespa.list_partition_files")
+    def test_compact_prefix_resumes_interrupted_swap(self, mock_files, mock_catalog, mock_compact, mock_swap):
+        interrupted, small = 'refined/year=2025/month=7/day=14/nom_setor=A', 'refined/year=2025/month=7/day=14/nom_setor=B'
+        mock_files.return_value = {
+            interrupted: [{'Key': f'{interrupted}/old.parquet', 'Size': 1}, {'Key': f'{interrupted}/new.parquet', 'Size': 1}],
+            small: [{'Key': f'{small}/p{i}.parquet', 'Size': 1} for i in range(3)]
+        }
+        mock_catalog.return_value = {
+            interrupted: {'StorageDescriptor': {'Location': f's3://out/refined_compaction/{interrupted}/'}},
+            small: {'StorageDescriptor': {'Location': f's3://out/{small}/'}}
+        }
+        summary = grzb.compact_prefix(MagicMock(), 'out', 'refined/', 'refined_compaction/', 'us-east-1',
+                                      sort_columns=['nom_empresa'], database_name='db', table_name='tbl')
+        mock_swap.assert_called_once()
+        self.assertEqual(mock_swap.call_args.args[:4], ('out', interrupted, [f'{interrupted}/old.parquet', f'{interrupted}/new.parquet'],
+                                                        f'refined_compaction/{interrupted}/'))
+        mock_compact.assert_called_once()
+        self.assertEqual(mock_compact.call_args.args[2], small)
+        self.assertEqual(mock_compact.call_args.args[-1], mock_catalog.return_value[small])
+        self.assertEqual(summary['partitions'], 1)
+
+    def test_parse_columns(self):
+        self.assertEqual(grzb.parse_columns(" nom_empresa, cod_acao ,"), ["nom_empresa", "cod_acao"])
+        self.assertEqual(grzb.parse_columns(""), [])
+
+    def test_parquet_layout_options(self):
+        self.assertEqual(grzb.parquet_layout_options(), {"parquet.enable.dictionary": "true"})
+        options = grzb.parquet_layout_options(row_group_size_mb=32, bloom_filter_columns=["nom_empresa"])
+        self.assertEqual(options["parquet.block.size"], str(32 * 1024 * 1024))
+        self.assertEqual(options["parquet.bloom.filter.enabled#nom_empresa"], "true")
+        self.assertEqual(options["parquet.bloom.filter.expected.ndv#nom_empresa"], str(grzb.BLOOM_FILTER_EXPECTED_NDV))
+
+    def test_default_features_prefix(self):
+        self.assertEqual(
+            grzb.default_features_prefix('refined-zone/tbl_refined_bovespa/'),
+            'refined-zone/tbl_refined_bovespa_features/'
+        )
+
+    def test_features_catalog_columns(self):
+        names = [column['Name'] for column in grzb.FEATURES_CATALOG_COLUMNS]
+        for window in grzb.FEATURE_WINDOWS:
+            self.assertIn(f'avg_qtd_teorica_{window}d', names)
+            self.assertIn(f'avg_participacao_setor_{window}d', names)
+        history = grzb.FEATURES_HISTORY_SCHEMA.fieldNames()
+        self.assertTrue(set(history) - set(grzb.FEATURES_PARTITION_KEYS) <= set(names))
+
+    @patch("glue_refined_zone_bovespa.boto3")
+    def test_create_table_with_features_schema(self, mock_boto):
+        from botocore.exceptions import ClientError
+        glue = mock_boto.client.return_value
+        glue.get_table.side_effect = ClientError({'Error': {'Code': 'EntityNotFoundException'}}, 'GetTable')
+        grzb.create_table_if_not_exists(
+            'db', 'tbl_features', 'bucket', 'features/', 'us-east-1',
+            columns=grzb.FEATURES_CATALOG_COLUMNS, partition_keys=grzb.FEATURES_CATALOG_PARTITIONS
+        )
+        table_input = glue.create_table.call_args.kwargs['TableInput']
+        self.assertEqual(table_input['StorageDescriptor']['Columns'], grzb.FEATURES_CATALOG_COLUMNS)
+        self.assertEqual([key['Name'] for key in table_input['PartitionKeys']], ['year', 'month', 'day', 'cod_indice'])
+
+    @patch("glue_refined_zone_bovespa.ensure_partition_keys")
+    @patch("glue_refined_zone_bovespa.register_partitions")
+    @patch("glue_refined_zone_bovespa.create_table_if_not_exists")
+    @patch("glue_refined_zone_bovespa.write_data", return_value=[])
+    @patch("glue_refined_zone_bovespa.aggregate_data")
+    @patch("glue_refined_zone_bovespa.process_data")
+    @patch("glue_refined_zone_bovespa.apply_parallelism_profile")
+    @patch("glue_refined_zone_bovespa.read_partitions")
+    def test_run_pipeline_stage_metrics(self, mock_read, mock_profile, mock_process, mock_aggregate,
+                                        mock_write, mock_create, mock_register, mock_ensure):
+        args = {
+            **grzb.OPTIONAL_PARAMS, 'JOB_NAME': 'job', 'TABLE_NAME': 'tbl', 'DATABASE_NAME': 'db', 'S3_BUCKET': 'raw',
+            'OBJECT_KEY': 'raw-zone/year=2025/month=7/day=14/', 'S3_OUTPUT_BUCKET': 'out', 'S3_OUTPUT_PREFIX': 'refined/',
+            'AWS_REGION': 'us-east-1', 'PARTITIONS': 'year=2025/month=7/day=14', 'DATA_QUALITY_CHECKS': 'false',
+            'STAGE_METRICS': 'true', 'CORRELATION_ID': 'req-1'
+        }
+        with patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            grzb.run_pipeline(MagicMock(), args)
+        documents = {document['stage']: document for document in map(json.loads, stdout.getvalue().splitlines())}
+        self.assertEqual(set(documents), {'read', 'write_refined', 'catalog'})
+        self.assertEqual(documents['read']['calls'], 1)
+        self.assertEqual(documents['write_refined']['correlation_id'], 'req-1')
+        mock_ensure.assert_called_once()
+        self.assertFalse(mock_ensure.call_args.kwargs['migrate'])
+
+        mock_write.side_effect = RuntimeError("falha na escrita")
+        with patch("sys.stdout", new_callable=io.StringIO) as stdout, self.assertRaises(RuntimeError):
+            grzb.run_pipeline(MagicMock(), args)
+        self.assertIn('write_refined', stdout.getvalue())
+
+class TestGlueRefinedZoneBovespaSpark(unittest.TestCase):
+    """Executa as transformações em uma SparkSession local sobre a amostra em data/tbl_raw_bovespa."""
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            from pyspark.sql import SparkSession
+            cls.spark = (
+                SparkSession.builder.master("local[1]")
+                .config("spark.ui.enabled", "false")
+                .config("spark.sql.session.timeZone", "UTC")
+                .getOrCreate()
+            )
+        except Exception as e:
+            raise unittest.SkipTest(f"SparkSession local indisponível: {e}")
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        # s3://bucket/chave passa a ser file://<tmp>/bucket/chave; a amostra é ligada como bucket 'bucket'
+        os.makedirs(f"{self.tmp}/bucket")
+        os.symlink(os.path.abspath(RAW_PATH), f"{self.tmp}/bucket/raw")
+        patcher = patch.object(grzb, "LOCAL_STORAGE_ROOT", self.tmp)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def read_raw(self, object_key: str = "raw/"):
+        return grzb.read_data(self.spark, "bucket", object_key)
+
+    def test_write_data_metrics_and_partitions(self):
+        metrics = grzb.JobMetrics()
+        agg = grzb.aggregate_data(grzb.process_data(self.read_raw(), metrics), metrics)
+        partitions = grzb.write_data(
+            agg, "bucket", "refined/", partition_keys=grzb.REFINED_PARTITION_KEYS, sort_columns=["nom_empresa"],
+            parquet_options=grzb.parquet_layout_options(bloom_filter_columns=["nom_empresa"])
+        )
+        written = self.spark.read.parquet(grzb.s3_uri("bucket", "refined/"))
+
+        values = metrics.to_dict()
+        self.assertEqual(values["input_rows"], 84)
+        self.assertEqual(values["processed_rows"], 84)
+        self.assertEqual(values["dropped_rows"], 0)
+        self.assertEqual(values["aggregated_groups"], written.count())
+        self.assertEqual(values["null_rows_index"], 0)
+
+        on_disk = sorted(
+            os.path.relpath(root, f"{self.tmp}/bucket/refined") for root, _, files in os.walk(f"{self.tmp}/bucket/refined")
+            if any(name.endswith(".parquet") for name in files)
+        )
+        self.assertEqual(len(partitions), len(on_disk))
+        self.assertEqual(
+            sorted(os.path.relpath(inputs["StorageDescriptor"]["Location"], "s3://bucket/refined")
+                   for inputs in grzb.build_partition_inputs(partitions, grzb.REFINED_PARTITION_KEYS, {}, "bucket", "refined/")),
+            on_disk
+        )
+        self.assertEqual({partition["cod_indice"] for partition in partitions}, {grzb.DEFAULT_INDEX})
+        self.assertEqual({(p["year"], p["month"], p["day"]) for p in partitions}, {("2025", "7", "14")})
+
+    def test_read_data_from_partition_keeps_partition_columns(self):
+        df = self.read_raw("raw/year=2025/month=07/day=14/")
+        row = df.select("year", "month", "day").distinct().collect()
+        self.assertEqual([tuple(r) for r in row], [(2025, 7, 14)])
+
+    def test_read_mixed_raw_layouts(self):
+        # Dia 14 com arquivo legado e index=SMLL no mesmo dia; dia 15 só no layout com index=
+        sample = next(
+            os.path.join(root, name) for root, _, files in os.walk(RAW_PATH) for name in files if name.endswith(".parquet")
+        )
+        for directory in ("year=2025/month=7/day=14", "year=2025/month=7/day=14/index=SMLL", "year=2025/month=7/day=15/index=IBOV"):
+            os.makedirs(f"{self.tmp}/bucket/mixed/{directory}")
+            shutil.copy(sample, f"{self.tmp}/bucket/mixed/{directory}/part-0.parquet")
+
+        df = grzb.read_data(self.spark, "bucket", "mixed/")
+        self.assertEqual(df.count(), 3 * 84)
+        counts = {(row["day"], row["index"]): row["count"] for row in df.groupBy("day", "index").count().collect()}
+        self.assertEqual(counts, {(14, None): 84, (14, "SMLL"): 84, (15, "IBOV"): 84})
+        indices = {row["cod_indice"]: row["count"] for row in grzb.process_data(df).groupBy("cod_indice").count().collect()}
+        self.assertEqual(indices, {"IBOV": 2 * 84, "SMLL": 84})
+
+        day = grzb.read_partitions(self.spark, "bucket", "mixed/", ["year=2025/month=7/day=14"])
+        self.assertEqual(day.count(), 2 * 84)
+        self.assertEqual(grzb.read_data(self.spark, "bucket", "mixed/year=2025/month=7/day=15/index=IBOV/").count(), 84)
+
+    def test_apply_parallelism_profile(self):
+        df = self.read_raw()
+        previous = self.spark.conf.get("spark.sql.shuffle.partitions")
+        self.addCleanup(self.spark.conf.set, "spark.sql.shuffle.partitions", previous)
+        settings = grzb.apply_parallelism_profile(self.spark, df)
+        self.assertEqual(settings["spark.sql.shuffle.partitions"], "1")
+        self.assertEqual(self.spark.conf.get("spark.sql.shuffle.partitions"), "1")
+        agg = grzb.aggregate_data(grzb.process_data(df))
+        self.assertEqual(agg.rdd.getNumPartitions(), 1)
+        # Todos os shuffles da agregação usam o número de partições do perfil, sem um shuffle a mais por data_ref
+        plan = agg._jdf.queryExecution().executedPlan().toString()
+        exchanges = [line for line in plan.splitlines() if "Exchange" in line]
+        self.assertTrue(exchanges)
+        self.assertTrue(all(", 1), ENSURE_REQUIREMENTS" in line for line in exchanges), exchanges)
+
+    def daily(self, day: date, qtd: int):
+        return self.spark.createDataFrame(
+            [("PETR4", "PETROBRAS", "Petróleo", qtd, Decimal("1.500"), day, day.year, day.month, day.day, "IBOV")],
+            grzb.FEATURES_HISTORY_SCHEMA
+        )
+
+    def test_incremental_ticker_features(self):
+        days = [date(2025, 7, 14), date(2025, 7, 15), date(2025, 7, 16)]
+        for day, qtd in zip(days, (100, 110, 121)):
+            # Cada execução grava apenas a nova data e lê a janela anterior da própria tabela de features
+            history = grzb.read_features_history(self.spark, "bucket", "features/", [day])
+            grzb.write_data(
+                grzb.build_ticker_features(self.daily(day, qtd), history), "bucket", "features/",
+                partition_keys=grzb.FEATURES_PARTITION_KEYS, sort_columns=grzb.FEATURES_SORT_COLUMNS
+            )
+        rows = {row["data_ref"]: row for row in
+                self.spark.read.parquet(grzb.s3_uri("bucket", "features/")).collect()}
+        self.assertEqual(sorted(rows), days)
+        last = rows[days[-1]]
+        self.assertEqual(last["data_ref_anterior"], days[1])
+        self.assertEqual(last["qtd_teorica_var_dia"], 11)
+        self.assertAlmostEqual(last["perc_qtd_teorica_var_dia"], 10.0)
+        self.assertAlmostEqual(last["avg_qtd_teorica_5d"], 331 / 3)
+        self.assertEqual(last["qtd_pregoes_5d"], 3)
+        self.assertIsNone(rows[days[0]]["data_ref_anterior"])
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,219 @@
+import unittest
+from unittest.mock import patch
+import importlib.util
+import os
+import tempfile
+from datetime import date, datetime, timezone
+from decimal import Decimal
+import pandas as pd
+import pyarrow.parquet as pq
+
+import sys
+sys.path.append('src/shared')
+sys.path.append('src/glue/glue-refined-zone-bovespa')
+sys.path.append('src/lambda/lambda-extract-bovespa')
+import refined_zone_pandas as rzp
+
+RAW_PATH = 'data/tbl_raw_bovespa'
+RAW_PARTITION = 'year=2025/month=07/day=14'
+SPARK_SCRIPT = 'src/glue/glue-refined-zone-bovespa/glue-refined-zone-bovespa.py'
+EXTRACT_SCRIPT = 'src/lambda/lambda-extract-bovespa/lambda_function.py'
+PROCESSING_TIME = datetime(2025, 7, 15, 12, 0, tzinfo=timezone.utc)
+
+def load_spark_job(name: str = "glue_refined_zone_bovespa_job", path: str = SPARK_SCRIPT):
+    """Carrega o script do job Spark (nome com hífens) como módulo."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def normalize(df: pd.DataFrame) -> list:
+    """Converte o resultado agregado em registros comparáveis entre as engines."""
+    columns = [column for column in rzp.REFINED_SCHEMA.names if column != "dth_etl_processamento"]
+    records = []
+    for row in df[columns].itertuples(index=False):
+        records.append(tuple(None if pd.isna(value) else (int(value) if hasattr(value, "__index__") else value) for value in row))
+    return sorted(records, key=lambda record: (record[-1], record[0]))
+
+class TestRefinedZonePandas(unittest.TestCase):
+    def test_read_data_sample(self):
+        df = rzp.read_data(RAW_PATH)
+        self.assertEqual(len(df), 84)
+        self.assertEqual(list(df.columns), rzp.EXPECTED_COLUMNS + rzp.RAW_PARTITION_KEYS + [rzp.RAW_INDEX_COLUMN])
+        # Amostra gravada antes da partição index=: sem índice na leitura
+        self.assertTrue(df[rzp.RAW_INDEX_COLUMN].isna().all())
+        self.assertEqual(len(rzp.read_data(RAW_PATH, start_date="2025-07-15")), 0)
+
+    def test_read_data_from_partition_path(self):
+        # OBJECT_KEY do gatilho aponta para o dia (ou um arquivo): as partições vêm da raiz da tabela
+        file_name = next(name for name in os.listdir(f"{RAW_PATH}/{RAW_PARTITION}") if name.endswith(".parquet"))
+        for path in (f"{RAW_PATH}/{RAW_PARTITION}/", f"{RAW_PATH}/{RAW_PARTITION}/{file_name}"):
+            df = rzp.read_data(path)
+            self.assertEqual(len(df), 84)
+            self.assertEqual(df[rzp.RAW_PARTITION_KEYS].drop_duplicates().values.tolist(), [[2025, 7, 14]])
+            self.assertEqual(len(rzp.process_data(df)), 84)
+
+    def test_read_data_partitions(self):
+        df = rzp.read_data(f"{RAW_PATH}/{RAW_PARTITION}/", partitions=[RAW_PARTITION])
+        self.assertEqual(len(df), 84)
+        self.assertEqual(rzp.raw_table_root(f"{RAW_PATH}/{RAW_PARTITION}/file.parquet"), f"{RAW_PATH}/")
+        self.assertEqual(rzp.parse_partitions("year=2025/month=7/day=14/, year=2025/month=7/day=14"), ["year=2025/month=7/day=14"])
+        with self.assertRaises(ValueError):
+            rzp.parse_partitions("year=2025/month=7")
+
+    def test_process_data_keeps_rows_without_partition_columns(self):
+        df = rzp.read_data(RAW_PATH).assign(year=None, month=None, day=None)
+        processed = rzp.process_data(df)
+        self.assertEqual(len(processed), 84)
+        self.assertEqual(processed[["year", "month", "day"]].drop_duplicates().values.tolist(), [[2025, 7, 14]])
+        self.assertEqual(len(rzp.process_data(df.assign(results_cod=None))), 0)
+
+    def test_parsers_follow_spark_semantics(self):
+        self.assertEqual(rzp._parse_decimal("2,802"), Decimal("2.802"))
+        self.assertEqual(rzp._parse_decimal("2,8025"), Decimal("2.803"))
+        self.assertIsNone(rzp._parse_decimal("100,000"))
+        self.assertIsNone(rzp._parse_decimal("abc"))
+        self.assertEqual(rzp._parse_bigint("1.482.105.837"), 1482105837)
+        self.assertIsNone(rzp._parse_bigint("1,5"))
+        self.assertEqual(rzp._parse_decimal(Decimal("2.8025")), Decimal("2.803"))
+        self.assertIsNone(rzp._parse_decimal(Decimal("100.000")))
+        self.assertEqual(rzp._parse_bigint(1482105837), 1482105837)
+        self.assertEqual(rzp._parse_date("14/07/25"), date(2025, 7, 14))
+
+    def test_process_and_aggregate(self):
+        processed = rzp.process_data(rzp.read_data(RAW_PATH))
+        self.assertEqual(len(processed), 84)
+        self.assertTrue((processed["cod_indice"] == rzp.DEFAULT_INDEX).all())
+        agg = rzp.aggregate_data(processed, processing_time=PROCESSING_TIME)
+        self.assertEqual(list(agg.columns), rzp.REFINED_SCHEMA.names)
+        self.assertEqual(agg["qtd_registros"].sum(), 84)
+        self.assertTrue((agg["qtd_dias_atraso"] == -1).all())
+
+    def test_escape_partition_value(self):
+        self.assertEqual(rzp.escape_partition_value("Bens Indls / Máqs e Equips"), "Bens Indls %2F Máqs e Equips")
+        self.assertEqual(rzp.escape_partition_value(None), "__HIVE_DEFAULT_PARTITION__")
+
+    def test_write_data_layout(self):
+        agg = rzp.aggregate_data(rzp.process_data(rzp.read_data(RAW_PATH)), processing_time=PROCESSING_TIME)
+        with tempfile.TemporaryDirectory() as tmp:
+            written = rzp.write_data(agg, tmp)
+            rzp.write_data(agg, tmp)
+            self.assertEqual(len(written), agg["nom_setor"].nunique())
+            self.assertTrue(os.path.isdir(f"{tmp}/year=2025/month=7/day=14/cod_indice=IBOV/nom_setor=Telecomunicação"))
+            table = pq.read_table(tmp)
+        self.assertEqual(table.num_rows, len(agg))
+
+    @patch("awswrangler.catalog.upsert_table_parameters")
+    @patch("awswrangler.catalog.add_parquet_partitions")
+    @patch("awswrangler.catalog.does_table_exist", return_value=True)
+    def test_register_partitions_marks_last_write(self, mock_exists, mock_add, mock_upsert):
+        written = [{"path": "s3://b/r/year=2025/month=7/day=14/cod_indice=IBOV/nom_setor=A/",
+                    "year": "2025", "month": "7", "day": "14", "cod_indice": "IBOV", "nom_setor": "A"}]
+        rzp.register_partitions("db", "tbl", "s3://b/r/", written)
+        self.assertEqual(list(mock_add.call_args.kwargs["partitions_values"].values()), [["2025", "7", "14", "IBOV", "A"]])
+        self.assertIn(rzp.LAST_WRITE_PARAMETER, mock_upsert.call_args.kwargs["parameters"])
+        self.assertFalse(mock_upsert.call_args.kwargs["catalog_versioning"])
+        mock_upsert.reset_mock()
+        rzp.register_partitions("db", "tbl", "s3://b/r/", [])
+        mock_upsert.assert_not_called()
+
+class TestRefinedZoneEngineParity(unittest.TestCase):
+    """Compara as engines Spark e pandas sobre a amostra em data/tbl_raw_bovespa."""
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            from pyspark.sql import SparkSession
+            cls.job = load_spark_job()
+            cls.spark = (
+                SparkSession.builder.master("local[1]")
+                .config("spark.ui.enabled", "false")
+                .config("spark.sql.session.timeZone", "UTC")
+                .getOrCreate()
+            )
+        except Exception as e:
+            raise unittest.SkipTest(f"SparkSession local indisponível: {e}")
+
+    def _spark_result(self):
+        from pyspark.sql import functions as sf
+        df = self.spark.read.schema(self.job.LEGACY_RAW_READ_SCHEMA).parquet(RAW_PATH)
+        agg = self.job.aggregate_data(self.job.process_data(df))
+        return agg.withColumn(
+            "qtd_dias_atraso", sf.date_diff("data_ref", sf.lit(PROCESSING_TIME.date()))
+        )
+
+    def test_engines_produce_identical_output(self):
+        spark_df = self._spark_result().toPandas()
+        pandas_df = rzp.aggregate_data(rzp.process_data(rzp.read_data(RAW_PATH)), processing_time=PROCESSING_TIME)
+        self.assertEqual(list(spark_df.columns), list(pandas_df.columns))
+        self.assertEqual(normalize(spark_df), normalize(pandas_df))
+
+    def test_engines_match_reading_partition_path(self):
+        # Mesmo caminho de partição para as duas engines (basePath no Spark, partition_base_dir no pyarrow)
+        from pyspark.sql import functions as sf
+        path = f"{RAW_PATH}/{RAW_PARTITION}/"
+        bucket_root, bucket = os.path.split(os.path.abspath(RAW_PATH))
+        with patch.object(self.job, "LOCAL_STORAGE_ROOT", bucket_root):
+            df = self.job.read_data(self.spark, bucket, f"{RAW_PARTITION}/")
+        spark_df = self.job.aggregate_data(self.job.process_data(df)).withColumn(
+            "qtd_dias_atraso", sf.date_diff("data_ref", sf.lit(PROCESSING_TIME.date()))
+        ).toPandas()
+        pandas_df = rzp.aggregate_data(rzp.process_data(rzp.read_data(path)), processing_time=PROCESSING_TIME)
+        self.assertEqual(len(pandas_df), len(spark_df))
+        self.assertGreater(len(pandas_df), 0)
+        self.assertEqual(normalize(spark_df), normalize(pandas_df))
+
+    def _typed_raw_table(self):
+        """Amostra legada convertida como a extração atual grava a raw ('typed')."""
+        lf = load_spark_job("lambda_extract_bovespa", EXTRACT_SCRIPT)
+        table = pq.read_table(RAW_PATH).drop_columns(rzp.RAW_PARTITION_KEYS)
+        for column in lf.DECIMAL_FIELDS + lf.INTEGER_FIELDS:
+            typed = lf.typed_column(column, table.column(column).to_pylist())
+            table = table.set_column(table.column_names.index(column), column, typed)
+        return table
+
+    def test_typed_raw_matches_legacy_raw(self):
+        from pyspark.sql import functions as sf
+        with tempfile.TemporaryDirectory() as tmp:
+            partition = f"{tmp}/year=2025/month=7/day=14/index=IBOV"
+            os.makedirs(partition)
+            pq.write_table(self._typed_raw_table(), f"{partition}/part-0.parquet")
+            df = self.spark.read.schema(self.job.RAW_READ_SCHEMA).parquet(tmp)
+            agg = self.job.aggregate_data(self.job.process_data(df)).withColumn(
+                "qtd_dias_atraso", sf.date_diff("data_ref", sf.lit(PROCESSING_TIME.date()))
+            ).toPandas()
+        self.assertEqual(normalize(agg), normalize(self._spark_result().toPandas()))
+
+    def test_auto_schema_reads_typed_and_legacy_partitions(self):
+        # Partição legada (strings, sem index=) e partição tipada no mesmo dia, lidas juntas com RAW_SCHEMA 'auto'
+        from pyspark.sql import functions as sf
+        with tempfile.TemporaryDirectory() as tmp:
+            day = f"{tmp}/raw/year=2025/month=7/day=14"
+            os.makedirs(f"{day}/index=SMLL")
+            pq.write_table(pq.read_table(RAW_PATH).drop_columns(rzp.RAW_PARTITION_KEYS), f"{day}/part-0.parquet")
+            pq.write_table(self._typed_raw_table(), f"{day}/index=SMLL/part-0.parquet")
+            with patch.object(self.job, "LOCAL_STORAGE_ROOT", tmp):
+                df = self.job.read_data(self.spark, "raw", "")
+                self.assertEqual(df.schema["results_part"].dataType, self.job.RAW_DECIMAL_TYPE)
+                agg = self.job.aggregate_data(self.job.process_data(df)).withColumn(
+                    "qtd_dias_atraso", sf.date_diff("data_ref", sf.lit(PROCESSING_TIME.date()))
+                ).toPandas()
+                with self.assertRaises(Exception):
+                    self.job.read_data(self.spark, "raw", "", raw_schema="typed").collect()
+        expected = self._spark_result().toPandas()
+        self.assertEqual(normalize(agg), normalize(pd.concat([expected, expected.assign(cod_indice="SMLL")])))
+
+    def test_engines_write_same_partition_layout(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self._spark_result().write.mode("overwrite").partitionBy(*rzp.REFINED_PARTITION_KEYS).parquet(f"{tmp}/spark")
+            agg = rzp.aggregate_data(rzp.process_data(rzp.read_data(RAW_PATH)), processing_time=PROCESSING_TIME)
+            rzp.write_data(agg, f"{tmp}/pandas")
+            layouts = [
+                sorted(os.path.relpath(root, f"{tmp}/{engine}") for root, _, files in os.walk(f"{tmp}/{engine}")
+                       if any(name.endswith(".parquet") for name in files))
+                for engine in ("spark", "pandas")
+            ]
+        self.assertEqual(layouts[0], layouts[1])
+
+if __name__ == "__main__":
+    unittest.main()
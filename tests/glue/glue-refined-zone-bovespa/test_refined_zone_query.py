@@ -0,0 +1,132 @@
+import unittest
+from unittest.mock import patch
+import os
+import tempfile
+import time
+from datetime import datetime
+import pandas as pd
+from botocore.exceptions import ClientError
+
+import sys
+sys.path.append('src/glue/glue-refined-zone-bovespa')
+import refined_zone_query as rzq
+
+SQL = 'SELECT nom_empresa, qtd_teorica_acumulada FROM "db_default"."tbl_refined_bovespa" WHERE year = 2025'
+
+class TestRefinedZoneQuery(unittest.TestCase):
+    def setUp(self):
+        rzq.reset_watermarks()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = rzq.QueryCache(cache_dir=self.tmp.name, max_bytes=10 * 1024 * 1024, max_age_minutes=60)
+        self.df = pd.DataFrame({"nom_empresa": ["WEG", "EMBRAER"], "qtd_teorica_acumulada": [1, 2]})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            rzq.normalize_sql("SELECT *\n   FROM t\tWHERE a = 'x  y' ;"),
+            "SELECT * FROM t WHERE a = 'x  y'"
+        )
+
+    def test_referenced_tables(self):
+        sql = 'SELECT * FROM "db_default"."tbl_refined_bovespa" r JOIN tbl_refined_bovespa_features f ON r.x = f.x'
+        self.assertEqual(
+            rzq.referenced_tables(sql),
+            [("db_default", "tbl_refined_bovespa"), ("db_default", "tbl_refined_bovespa_features")]
+        )
+        self.assertEqual(rzq.referenced_tables("SELECT * FROM outro.tabela", "db_default"), [("outro", "tabela")])
+
+    @patch("refined_zone_query.boto3.client")
+    def test_table_watermark_changes_with_new_write(self, mock_client):
+        glue = mock_client.return_value
+        table = {"UpdateTime": datetime(2025, 7, 14, 20, 0), "Parameters": {rzq.LAST_WRITE_PARAMETER: "2025-07-14T20:00:00"}}
+        glue.get_table.return_value = {"Table": table}
+        first = rzq.table_watermark("db_default", "tbl_refined_bovespa")
+        rzq.table_watermark("db_default", "tbl_refined_bovespa")
+        # Uma única chamada ao catálogo, sem listar partições
+        glue.get_table.assert_called_once_with(DatabaseName="db_default", Name="tbl_refined_bovespa")
+        glue.get_partitions.assert_not_called()
+        rzq.reset_watermarks()
+        table["Parameters"][rzq.LAST_WRITE_PARAMETER] = "2025-07-15T20:00:00"
+        self.assertNotEqual(rzq.table_watermark("db_default", "tbl_refined_bovespa"), first)
+
+        rzq.reset_watermarks()
+        glue.get_table.side_effect = ClientError({"Error": {"Code": "EntityNotFoundException"}}, "GetTable")
+        self.assertEqual(rzq.table_watermark("db_default", "cte"), "")
+
+    def test_tag_sql(self):
+        self.assertEqual(rzq.tag_sql(SQL, {"db_default.t": ""}), SQL)
+        tagged = rzq.tag_sql(SQL + " ;\n", {"db_default.t": "a"})
+        self.assertTrue(tagged.startswith(SQL + "\n-- watermark: "))
+        self.assertEqual(tagged, rzq.tag_sql(SQL, {"db_default.t": "a"}))
+        self.assertNotEqual(tagged, rzq.tag_sql(SQL, {"db_default.t": "b"}))
+
+    def test_cache_key(self):
+        self.assertEqual(rzq.cache_key(SQL, {"t": "a"}), rzq.cache_key(SQL.replace(" ", "  ") + ";", {"t": "a"}))
+        self.assertNotEqual(rzq.cache_key(SQL, {"t": "a"}), rzq.cache_key(SQL, {"t": "b"}))
+
+    @patch("refined_zone_query.wr.athena.read_sql_query")
+    @patch("refined_zone_query.table_watermark", return_value="a")
+    def test_read_sql_query_uses_cache_and_result_reuse(self, mock_watermark, mock_query):
+        mock_query.return_value = self.df
+        first = rzq.read_sql_query(SQL, cache=self.cache, max_age_minutes=30)
+        second = rzq.read_sql_query(SQL + "\n", cache=self.cache, max_age_minutes=30)
+        mock_query.assert_called_once()
+        kwargs = mock_query.call_args.kwargs
+        self.assertFalse(kwargs["ctas_approach"])
+        self.assertEqual(kwargs["result_reuse_configuration"]["ResultReuseByAgeConfiguration"]["MaxAgeInMinutes"], 30)
+        pd.testing.assert_frame_equal(first, second)
+
+    @patch("refined_zone_query.wr.athena.read_sql_query")
+    @patch("refined_zone_query.table_watermark")
+    def test_new_partition_invalidates_only_affected_entries(self, mock_watermark, mock_query):
+        watermarks = {"tbl_refined_bovespa": "a", "tbl_refined_bovespa_features": "a"}
+        mock_watermark.side_effect = lambda database, table, boto3_session=None: watermarks[table]
+        mock_query.return_value = self.df
+        other_sql = "SELECT * FROM db_default.tbl_refined_bovespa_features"
+        rzq.read_sql_query(SQL, cache=self.cache)
+        rzq.read_sql_query(other_sql, cache=self.cache)
+        self.assertEqual(mock_query.call_count, 2)
+        stale_sql = mock_query.call_args_list[0].kwargs["sql"]
+
+        watermarks["tbl_refined_bovespa"] = "b"
+        rzq.read_sql_query(SQL, cache=self.cache)
+        rzq.read_sql_query(other_sql, cache=self.cache)
+        self.assertEqual(mock_query.call_count, 3)
+        self.assertEqual(len([name for name in os.listdir(self.tmp.name) if name.endswith(".json")]), 2)
+        # A nova execução não pode casar com o resultado antigo no result reuse do Athena
+        self.assertNotEqual(mock_query.call_args.kwargs["sql"], stale_sql)
+
+    @patch("refined_zone_query.wr.athena.read_sql_query")
+    @patch("refined_zone_query.table_watermark")
+    def test_new_partition_bypasses_athena_result_reuse_without_local_cache(self, mock_watermark, mock_query):
+        mock_watermark.return_value = "a"
+        mock_query.return_value = self.df
+        rzq.read_sql_query(SQL)
+        rzq.read_sql_query(SQL)
+        self.assertEqual(mock_query.call_args_list[0].kwargs["sql"], mock_query.call_args_list[1].kwargs["sql"])
+        mock_watermark.return_value = "b"
+        rzq.read_sql_query(SQL)
+        self.assertNotEqual(mock_query.call_args_list[2].kwargs["sql"], mock_query.call_args_list[0].kwargs["sql"])
+
+    def test_cache_expiration_and_eviction(self):
+        self.cache.put("a", self.df, SQL, {})
+        self.assertIsNotNone(self.cache.get("a"))
+        self.cache.max_age_seconds = 0
+        time.sleep(0.01)
+        self.assertIsNone(self.cache.get("a"))
+
+        self.cache.max_age_seconds = 3600
+        self.cache.put("old", self.df, SQL, {})
+        past = time.time() - 100
+        os.utime(os.path.join(self.tmp.name, "old.parquet"), (past, past))
+        self.cache.put("new", self.df, SQL, {})
+        self.cache.max_bytes = os.path.getsize(os.path.join(self.tmp.name, "new.parquet")) + \
+            os.path.getsize(os.path.join(self.tmp.name, "new.json"))
+        self.assertEqual(self.cache.evict(), 1)
+        self.assertIsNone(self.cache.get("old"))
+        self.assertIsNotNone(self.cache.get("new"))
+
+if __name__ == "__main__":
+    unittest.main()
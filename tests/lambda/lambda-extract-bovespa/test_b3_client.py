@@ -0,0 +1,175 @@
+import unittest
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+import sys
+sys.path.append('src/lambda/lambda-extract-bovespa')
+import b3_client
+
+class StubB3:
+    """Servidor HTTP local que responde conforme 'respond(stub)' -> (status, headers) e conta requisições em paralelo."""
+
+    def __init__(self, respond, latency: float = 0.0):
+        self.respond = respond
+        self.latency = latency
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stub.lock:
+                    stub.requests += 1
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                    status, headers = stub.respond(stub)
+                time.sleep(stub.latency)
+                body = json.dumps({"results": []}).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with stub.lock:
+                    stub.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/portfolio/"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+class TestB3Client(unittest.TestCase):
+    def client(self, **settings) -> b3_client.B3Client:
+        session = requests.Session()
+        self.addCleanup(session.close)
+        return b3_client.B3Client(session, **settings)
+
+    def test_parse_retry_after(self):
+        now = datetime(2025, 7, 14, 12, 0, 0, tzinfo=timezone.utc)
+        self.assertEqual(b3_client.parse_retry_after("3"), 3.0)
+        self.assertEqual(b3_client.parse_retry_after("Mon, 14 Jul 2025 12:00:05 GMT", now=now), 5.0)
+        self.assertEqual(b3_client.parse_retry_after("Mon, 14 Jul 2025 11:00:00 GMT", now=now), 0.0)
+        self.assertIsNone(b3_client.parse_retry_after("amanhã"))
+        self.assertIsNone(b3_client.parse_retry_after(None))
+
+    def test_retry_after_pauses_client(self):
+        def respond(stub):
+            return (429, {"Retry-After": "1"}) if stub.requests == 1 else (200, {})
+
+        with StubB3(respond) as stub:
+            client = self.client()
+            start = time.monotonic()
+            response = client.get(stub.url, timeout=5)
+            elapsed = time.monotonic() - start
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b3_client.client_retries(response), 1)
+        self.assertGreaterEqual(elapsed, 1.0)
+        self.assertEqual(stub.requests, 2)
+        # 429 sinaliza sobrecarga, mas não falha do serviço
+        self.assertEqual(client.breaker.state, "closed")
+
+    def test_retry_after_above_limit_returns_response(self):
+        with StubB3(lambda stub: (429, {"Retry-After": "120"})) as stub:
+            response = self.client(max_retry_after=10).get(stub.url, timeout=5)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(stub.requests, 1)
+        with self.assertRaises(requests.HTTPError):
+            response.raise_for_status()
+
+    def test_circuit_breaker(self):
+        healthy = threading.Event()
+
+        def respond(stub):
+            return (200, {}) if healthy.is_set() else (503, {"Retry-After": "0"})
+
+        with StubB3(respond) as stub:
+            client = self.client(max_attempts=2, failure_threshold=4, reset_timeout=0.5)
+            for _ in range(2):
+                self.assertEqual(client.get(stub.url, timeout=5).status_code, 503)
+            self.assertEqual(client.breaker.state, "open")
+            with self.assertRaises(b3_client.CircuitOpenError):
+                client.get(stub.url, timeout=5)
+            self.assertEqual(stub.requests, 4)
+
+            healthy.set()
+            time.sleep(0.5)
+            self.assertEqual(client.get(stub.url, timeout=5).status_code, 200)
+        self.assertEqual(client.breaker.state, "closed")
+
+    def test_connection_errors_open_circuit(self):
+        with StubB3(lambda stub: (200, {})) as stub:
+            url = stub.url
+        client = self.client(max_attempts=1, failure_threshold=2, reset_timeout=60)
+        for _ in range(2):
+            with self.assertRaises(requests.ConnectionError):
+                client.get(url, timeout=1)
+        with self.assertRaises(b3_client.CircuitOpenError):
+            client.get(url, timeout=1)
+
+    def test_adaptive_concurrency_under_capacity_limit(self):
+        capacity = 3
+
+        def respond(stub):
+            return (429, {"Retry-After": "0"}) if stub.in_flight > capacity else (200, {})
+
+        with StubB3(respond, latency=0.02) as stub:
+            client = self.client(initial_concurrency=12, max_concurrency=16, requests_per_second=0, max_attempts=20)
+            with ThreadPoolExecutor(max_workers=16) as executor:
+                statuses = list(executor.map(lambda _: client.get(stub.url, timeout=5).status_code, range(60)))
+        self.assertEqual(statuses, [200] * 60)
+        # O limite inicial nunca é ultrapassado e converge para perto da capacidade do servidor
+        self.assertLessEqual(stub.max_in_flight, 12)
+        self.assertLessEqual(client.concurrency.limit, 2 * capacity)
+        self.assertLess(stub.requests, 2 * 60)
+
+    def test_concurrency_grows_when_saturated_and_shrinks_with_latency(self):
+        concurrency = b3_client.AdaptiveConcurrency(initial=2, minimum=1, maximum=4, latency_tolerance=2.0)
+        for _ in range(20):
+            slots = int(concurrency.limit)
+            for _ in range(slots):
+                concurrency.acquire()
+            for _ in range(slots):
+                concurrency.release(0.01)
+        self.assertEqual(concurrency.limit, 4)
+        for _ in range(20):
+            concurrency.acquire()
+            concurrency.release(0.5)
+        self.assertLess(concurrency.limit, 4)
+        self.assertGreaterEqual(concurrency.limit, 1)
+
+    def test_token_bucket_rate(self):
+        bucket = b3_client.TokenBucket(rate=50, burst=1)
+        start = time.monotonic()
+        for _ in range(11):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.18)
+
+        bucket.pause(0.2)
+        start = time.monotonic()
+        bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_unknown_setting(self):
+        with self.assertRaises(ValueError):
+            self.client(max_rps=10)
+
+if __name__ == "__main__":
+    unittest.main()
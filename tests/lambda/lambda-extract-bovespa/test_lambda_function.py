@@ -3,13 +3,24 @@ from unittest.mock import patch, MagicMock
 import pandas as pd
 import json
 import base64
+import tempfile
+import os
+import subprocess
+import io
+from datetime import datetime
+from decimal import Decimal
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 import sys
+sys.path.append('src/shared')
 sys.path.append('src/lambda/lambda-extract-bovespa')
 import lambda_function as lf
+import instrumentation
 
 class TestLambdaExtractBovespa(unittest.TestCase):
     def setUp(self):
+        lf.reset_session()
         self.api_conf = {
             "host": "api.b3.com.br",
             "route": "portfolio",
@@ -55,6 +66,23 @@ class TestLambdaExtractBovespa(unittest.TestCase):
         result = lf.get_portfolio_day(self.api_conf, session)
         self.assertEqual(result, {"foo": "bar"})
 
+    @patch("lambda_function.get_portfolio_day")
+    def test_get_portfolio_all_pages(self, mock_get_portfolio):
+        def fake_page(conf, session):
+            page_number = conf["parameters"]["pageNumber"]
+            return {"page": {"pageNumber": page_number, "totalPages": 3}}
+        mock_get_portfolio.side_effect = fake_page
+        pages = lf.get_portfolio_all_pages(self.api_conf, MagicMock(), max_workers=2)
+        self.assertEqual([p["page"]["pageNumber"] for p in pages], [1, 2, 3])
+        self.assertEqual(mock_get_portfolio.call_count, 3)
+        self.assertEqual(self.api_conf["parameters"]["pageNumber"], 1)
+
+    @patch("lambda_function.get_portfolio_day", return_value={"page": {"totalPages": 1}})
+    def test_get_portfolio_all_pages_single_page(self, mock_get_portfolio):
+        pages = lf.get_portfolio_all_pages(self.api_conf, MagicMock())
+        self.assertEqual(len(pages), 1)
+        mock_get_portfolio.assert_called_once()
+
     def test_portfolio_day_to_df_success(self):
         json_data = {
             "page": {"pageNumber": 1, "pageSize": 1, "totalRecords": 1, "totalPages": 1},
@@ -104,6 +132,353 @@ class TestLambdaExtractBovespa(unittest.TestCase):
         with self.assertRaises(ValueError):
             lf.portfolio_day_to_df({})
 
+    def _sample_json(self, results=None):
+        return {
+            "page": {"pageNumber": 1, "pageSize": 2, "totalRecords": 2, "totalPages": 1},
+            "header": {
+                "date": "14/07/25",
+                "text": "Quantidade Teórica Total",
+                "part": "100,000",
+                "partAcum": "100,000",
+                "textReductor": "Redutor",
+                "reductor": "15.438.607,05630450",
+                "theoricalQty": "91.922.324.640"
+            },
+            "results": results if results is not None else [
+                {"segment": "Bens Indls", "cod": "WEGE3", "asset": "WEG", "type": "ON NM",
+                 "part": "2,802", "partAcum": "2,802", "theoricalQty": "1.482.105.837"},
+                {"segment": "Bens Indls", "cod": "EMBR3", "asset": "EMBRAER", "type": "ON NM",
+                 "part": "1,100", "partAcum": "3,902", "theoricalQty": "734.337.925"}
+            ],
+            "index": "IBOV"
+        }
+
+    def test_portfolio_day_to_table_matches_df(self):
+        json_data = self._sample_json()
+        table = lf.portfolio_day_to_table(json_data)
+        self.assertIsInstance(table, pa.Table)
+        self.assertTrue(pa.types.is_dictionary(table.schema.field("header_date").type))
+        expected = lf.portfolio_day_to_df(json_data)
+        result = table.to_pandas()
+        for column in expected.columns:
+            result[column] = result[column].astype(expected[column].dtype)
+        pd.testing.assert_frame_equal(result[expected.columns], expected)
+
+    def test_parse_br_numbers(self):
+        decimals = lf.parse_br_decimal(pa.array(["2,802", " 1,2345", "100,000", "abc", None, "10.000,5"]))
+        self.assertEqual(decimals.type, pa.decimal128(lf.RAW_DECIMAL_PRECISION, lf.RAW_DECIMAL_SCALE))
+        self.assertEqual(
+            decimals.to_pylist(),
+            [Decimal("2.802"), Decimal("1.235"), Decimal("100.000"), None, None, Decimal("10000.500")]
+        )
+        self.assertIsNone(lf.parse_br_decimal(pa.array(["10.000,5"]), precision=5).to_pylist()[0])
+        integers = lf.parse_br_integer(pa.array(["1.482.105.837", "1,5", None]))
+        self.assertEqual(integers.to_pylist(), [1482105837, None, None])
+
+    def test_portfolio_day_to_table_typed_schema(self):
+        schema = lf.portfolio_day_to_table(self._sample_json()).schema
+        self.assertEqual(schema.field("results_part").type, pa.decimal128(lf.RAW_DECIMAL_PRECISION, lf.RAW_DECIMAL_SCALE))
+        self.assertEqual(schema.field("results_theoricalQty").type, pa.int64())
+        for column in lf.CATEGORICAL_FIELDS:
+            self.assertTrue(pa.types.is_dictionary(schema.field(column).type), column)
+        self.assertEqual(schema.field("results_cod").type, pa.string())
+        df = lf.portfolio_day_to_df(self._sample_json())
+        self.assertEqual(df["results_part"].tolist(), [Decimal("2.802"), Decimal("1.100")])
+        self.assertEqual(str(df["results_segment"].dtype), "category")
+
+    def test_portfolio_day_to_table_empty_results(self):
+        table = lf.portfolio_day_to_table(self._sample_json(results=[]))
+        self.assertEqual(table.num_rows, 0)
+        self.assertEqual(lf.portfolio_pages_to_table([self._sample_json(results=[])]).num_rows, 0)
+
+    def test_portfolio_day_to_table_key_error(self):
+        with self.assertRaises(ValueError):
+            lf.portfolio_day_to_table({})
+
+    def test_write_table_to_parquet_local(self):
+        table = lf.portfolio_pages_to_table([self._sample_json(), self._sample_json()])
+        with tempfile.TemporaryDirectory() as tmp:
+            lf.write_table_to_parquet(table, tmp)
+            lf.write_table_to_parquet(table, tmp)
+            written = pq.read_table(f"{tmp}/year=2025/month=7/day=14")
+        self.assertEqual(written.num_rows, 4)
+
+    def test_raw_file_prefix_carries_correlation_id(self):
+        table = lf.portfolio_day_to_table(self._sample_json())
+        metrics = instrumentation.StageMetrics("extract")
+        with patch.object(lf, "_stage_metrics", metrics), tempfile.TemporaryDirectory() as tmp:
+            self.assertEqual(lf.raw_file_prefix(), "")
+            metrics.start("req-1")
+            lf.write_table_to_parquet(table, tmp)
+            files = os.listdir(f"{tmp}/year=2025/month=7/day=14/index=IBOV")
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].startswith("req-1_"))
+
+    @patch("lambda_function.requests.Session")
+    @patch("lambda_function.wr.s3.to_parquet")
+    @patch("lambda_function.get_portfolio_day")
+    def test_lambda_handler_stage_metrics(self, mock_get_portfolio, mock_to_parquet, mock_session):
+        mock_get_portfolio.return_value = self._sample_json()
+        stream = io.StringIO()
+        with patch.object(lf, "_stage_metrics", instrumentation.StageMetrics("extract", enabled=True, fmt="json", stream=stream)):
+            result = lf.lambda_handler({**self.event, "correlation_id": "req-1"}, None)
+        self.assertEqual(result["statusCode"], 200)
+        self.assertEqual(mock_to_parquet.call_args.kwargs["filename_prefix"], "req-1_")
+        documents = {document["stage"]: document for document in map(json.loads, stream.getvalue().splitlines())}
+        self.assertEqual(set(documents), {"convert", "s3_write"})
+        self.assertEqual(documents["s3_write"]["rows"], 2)
+        self.assertEqual(documents["s3_write"]["correlation_id"], "req-1")
+
+        self.assertEqual(lf.lambda_handler({**self.event, "correlation_id": "a/b"}, None)["statusCode"], 400)
+
+    def test_index_confs(self):
+        conf = {**self.api_conf, "parameters": {**self.api_conf["parameters"], "index": ["IBOV", "SMLL"]}}
+        confs = lf.index_confs(conf)
+        self.assertEqual([(c["parameters"]["index"], c["parameters"]["segment"]) for c in confs], [("IBOV", "ALL"), ("SMLL", "ALL")])
+        conf["parameters"]["segment"] = ["1", "2"]
+        self.assertEqual([c["parameters"]["segment"] for c in lf.index_confs(conf)], ["1", "2"])
+        self.assertEqual(len(lf.index_confs(self.api_conf)), 1)
+
+    def test_validate_event_indices(self):
+        params = self.api_conf["parameters"]
+        cases = [
+            ({"index": ["IBOV", "SMLL"]}, True),
+            ({"index": ["IBOV", "SMLL"], "segment": ["1", "2"]}, True),
+            ({"index": []}, False),
+            ({"index": ["IBOV", "IBOV"]}, False),
+            ({"index": ["IBOV", ""]}, False),
+            ({"index": ["IBOV", "SMLL"], "segment": ["1"]}, False)
+        ]
+        for override, expected in cases:
+            event = {**self.event, "api": {**self.api_conf, "parameters": {**params, **override}}}
+            self.assertEqual(lf.validate_event(event)[0], expected, override)
+
+    @patch("lambda_function.get_portfolio_day")
+    def test_get_portfolio_indices_tags_pages(self, mock_get_portfolio):
+        mock_get_portfolio.side_effect = lambda conf, session: {**self._sample_json(), "index": None}
+        conf = {**self.api_conf, "parameters": {**self.api_conf["parameters"], "index": ["IBOV", "SMLL", "IDIV"]}}
+        pages = lf.get_portfolio_indices(conf, MagicMock())
+        self.assertEqual([page["index"] for page in pages], ["IBOV", "SMLL", "IDIV"])
+        self.assertEqual(sorted(call.args[0]["parameters"]["index"] for call in mock_get_portfolio.call_args_list), ["IBOV", "IDIV", "SMLL"])
+        with tempfile.TemporaryDirectory() as tmp:
+            lf.write_pages(pages, tmp, columnar=True)
+            self.assertEqual(sorted(os.listdir(f"{tmp}/year=2025/month=7/day=14")), ["index=IBOV", "index=IDIV", "index=SMLL"])
+            written = pq.read_table(f"{tmp}/year=2025/month=7/day=14")
+        self.assertEqual(written.num_rows, 6)
+
+    @patch("lambda_function.stream_portfolio_to_parquet", return_value=2)
+    def test_lambda_handler_stream_multi_index(self, mock_stream):
+        event = {**self.event, "stream": True,
+                 "api": {**self.api_conf, "parameters": {**self.api_conf["parameters"], "index": ["IBOV", "SMLL"]}}}
+        result = lf.lambda_handler(event, None)
+        self.assertEqual(result["statusCode"], 200)
+        self.assertEqual([call.args[0]["parameters"]["index"] for call in mock_stream.call_args_list], ["IBOV", "SMLL"])
+
+    def test_archive_pages_round_trip(self):
+        conf = {**self.api_conf, "parameters": {**self.api_conf["parameters"], "index": ["IBOV", "SMLL"]}}
+        pages = lf.tag_pages([self._sample_json()], "IBOV") + lf.tag_pages([self._sample_json(), None], "SMLL")
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertEqual(lf.archive_pages(pages, conf, tmp), 2)
+            files = os.listdir(f"{tmp}/year=2025/month=7/day=14/index=IBOV")
+            self.assertEqual(len(files), 1)
+            self.assertTrue(files[0].endswith("-0001.json.zst"))
+            with open(f"{tmp}/year=2025/month=7/day=14/index=IBOV/{files[0]}", "rb") as f:
+                self.assertEqual(f.read(4), b"\x28\xb5\x2f\xfd")
+            archived = lf.read_archived_day(tmp, datetime(2025, 7, 14).date())
+            self.assertEqual(archived, [page for page in pages if page])
+            self.assertEqual(lf.read_archived_day(tmp, datetime(2025, 7, 15).date()), [])
+
+            # Nova gravação do mesmo snapshot com menos páginas remove as páginas que sobraram
+            second = {**self._sample_json(), "page": {**self._sample_json()["page"], "pageNumber": 2}}
+            lf.archive_pages(lf.tag_pages([self._sample_json(), second], "IBOV"), conf, tmp)
+            lf.archive_pages(lf.tag_pages([self._sample_json()], "IBOV"), conf, tmp)
+            self.assertEqual(len(os.listdir(f"{tmp}/year=2025/month=7/day=14/index=IBOV")), 1)
+
+    def test_run_replay_rebuilds_raw(self):
+        pages = lf.tag_pages([self._sample_json()], "IBOV")
+        with tempfile.TemporaryDirectory() as tmp:
+            lf.write_pages(pages, f"{tmp}/expected", columnar=True)
+            lf.archive_pages(pages, self.api_conf, f"{tmp}/archive")
+            result = lf.run_replay({"start_date": "2025-07-14", "end_date": "2025-07-15", "chunk_days": 1},
+                                   f"{tmp}/archive", f"{tmp}/raw", columnar=True)
+            expected = pq.read_table(f"{tmp}/expected").to_pandas()
+            rebuilt = pq.read_table(f"{tmp}/raw").to_pandas()
+        body = json.loads(result["body"])
+        self.assertEqual(result["statusCode"], 200)
+        self.assertEqual([(day["date"], day["status"], day["rows"]) for day in body["days"]],
+                         [("2025-07-14", "ok", 2), ("2025-07-15", "missing", 0)])
+        pd.testing.assert_frame_equal(rebuilt, expected)
+
+    @patch("lambda_function.run_replay", return_value={"statusCode": 200, "body": "{}"})
+    @patch("lambda_function.get_session")
+    def test_lambda_handler_replay(self, mock_get_session, mock_replay):
+        event = {"s3_bucket": "bucket", "s3_prefix": "raw-zone", "replay": {"dates": ["2025-07-14"]}}
+        self.assertEqual(lf.lambda_handler(event, None)["statusCode"], 200)
+        mock_get_session.assert_not_called()
+        self.assertEqual(mock_replay.call_args.args[1:], ("s3://bucket/raw-zone_archive/", "s3://bucket/raw-zone/"))
+
+        self.assertFalse(lf.validate_event({**event, "replay": {"start_date": "2025-07-14"}})[0])
+        self.assertFalse(lf.validate_event({**event, "backfill": {"dates": ["2025-07-14"]}})[0])
+        self.assertFalse(lf.validate_event({**self.event, "archive": True, "archive_prefix": "prefix/archive/"})[0])
+        self.assertTrue(lf.validate_event({**self.event, "archive": True, "archive_prefix": "prefix_archive/"})[0])
+
+    def test_backfill_days_range_skips_weekends(self):
+        days = lf.backfill_days({"start_date": "2025-07-11", "end_date": "2025-07-14"})
+        self.assertEqual([d.isoformat() for d in days], ["2025-07-11", "2025-07-14"])
+        days = lf.backfill_days({"dates": ["2025-07-14", "2025-07-12", "2025-07-14"]})
+        self.assertEqual([d.isoformat() for d in days], ["2025-07-12", "2025-07-14"])
+
+    def test_validate_event_backfill(self):
+        valid, _ = lf.validate_event({**self.event, "backfill": {"start_date": "2025-07-01", "end_date": "2025-07-14"}})
+        self.assertTrue(valid)
+        valid, _ = lf.validate_event({**self.event, "backfill": {"start_date": "2025-07-14"}})
+        self.assertFalse(valid)
+        valid, _ = lf.validate_event({**self.event, "backfill": {"start_date": "2025-07-14", "end_date": "2025-07-01"}})
+        self.assertFalse(valid)
+        valid, _ = lf.validate_event({**self.event, "backfill": {"dates": ["14/07/2025"]}})
+        self.assertFalse(valid)
+
+    @patch("lambda_function.write_pages", return_value=2)
+    @patch("lambda_function.get_portfolio_day")
+    def test_run_backfill_reports_status_per_day(self, mock_get_portfolio, mock_write_pages):
+        def fake_day(conf, session):
+            requested = conf["parameters"]["date"]
+            if requested == "2025-07-15":
+                raise Exception("timeout")
+            if requested == "2025-07-16":
+                return self._sample_json()
+            json_data = self._sample_json()
+            json_data["header"]["date"] = datetime.strptime(requested, "%Y-%m-%d").strftime("%d/%m/%y")
+            return json_data
+        mock_get_portfolio.side_effect = fake_day
+        backfill_conf = {"start_date": "2025-07-14", "end_date": "2025-07-16", "max_concurrency": 2}
+        result = lf.run_backfill(self.api_conf, backfill_conf, MagicMock(), "s3://bucket/prefix/")
+        body = json.loads(result["body"])
+        self.assertEqual(result["statusCode"], 207)
+        statuses = {item["date"]: item["status"] for item in body["days"]}
+        self.assertEqual(statuses, {"2025-07-14": "ok", "2025-07-15": "error", "2025-07-16": "date_mismatch"})
+        self.assertEqual(body["failed_dates"], ["2025-07-15", "2025-07-16"])
+        mock_write_pages.assert_called_once()
+        self.assertEqual(len(mock_write_pages.call_args.args[0]), 1)
+
+    @patch("lambda_function.requests.Session")
+    @patch("lambda_function.run_backfill", return_value={"statusCode": 200, "body": "{}"})
+    def test_lambda_handler_backfill(self, mock_run_backfill, mock_session):
+        event = {**self.event, "backfill": {"dates": ["2025-07-14"]}}
+        result = lf.lambda_handler(event, None)
+        self.assertEqual(result["statusCode"], 200)
+        mock_run_backfill.assert_called_once()
+
+    def test_lambda_handler_malformed_input(self):
+        invalid_events = [
+            {**self.event, "max_workers": 0},
+            {**self.event, "max_workers": "8"},
+            {**self.event, "batch_size": -1},
+            {**self.event, "batch_size": True},
+            {**self.event, "backfill": {"start_date": "2025-07-01", "end_date": "2025-07-02", "max_concurrency": "4"}},
+            {**self.event, "backfill": {"start_date": "2025-07-01", "end_date": "2025-07-02", "max_concurrency": 0}},
+            {"s3_bucket": "bucket", "s3_prefix": "prefix", "replay": {"dates": ["2025-07-01"], "chunk_days": 0}},
+            {**self.event, "api": "api.b3.com.br"},
+            {**self.event, "api": {**self.api_conf, "parameters": ["IBOV"]}},
+            {**self.event, "s3_prefix": 123},
+            {**self.event, "rate_limit": {"max_rps": 10}}
+        ]
+        for event in invalid_events:
+            with self.subTest(event=event):
+                self.assertEqual(lf.lambda_handler(event, None)["statusCode"], 400)
+
+    @patch("lambda_function.get_client", side_effect=ValueError("falha ao criar o cliente"))
+    def test_lambda_handler_client_error(self, mock_get_client):
+        result = lf.lambda_handler(self.event, None)
+        self.assertEqual(result["statusCode"], 500)
+        self.assertIn("falha ao criar o cliente", result["body"])
+
+    def test_payload_hash_is_canonical(self):
+        json_data = self._sample_json()
+        reordered = json.loads(json.dumps(json_data))
+        reordered["results"] = [dict(reversed(list(item.items()))) for item in reordered["results"]]
+        self.assertEqual(lf.payload_hash([json_data]), lf.payload_hash([reordered]))
+        reordered["results"][0]["theoricalQty"] = "1"
+        self.assertNotEqual(lf.payload_hash([json_data]), lf.payload_hash([reordered]))
+
+    def test_manifest_roundtrip_local(self):
+        day = lf.pages_partition_day([self._sample_json()])
+        digest = lf.payload_hash([self._sample_json()])
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertIsNone(lf.read_manifest(tmp, day, "IBOV"))
+            self.assertFalse(lf.is_unchanged(tmp, day, "IBOV", digest))
+            lf.write_manifest(tmp, day, "IBOV", digest, 2)
+            self.assertTrue(lf.is_unchanged(tmp, day, "IBOV", digest))
+            self.assertFalse(lf.is_unchanged(tmp, day, "SMLL", digest))
+            self.assertTrue(lf.manifest_path(tmp, day, "IBOV").endswith("year=2025/month=7/day=14/index=IBOV/_manifest.json"))
+
+    def test_changed_pages_per_index(self):
+        ibov = self._sample_json()
+        smll = {**self._sample_json(), "index": "SMLL"}
+        day = lf.pages_partition_day([ibov])
+        with tempfile.TemporaryDirectory() as tmp:
+            # Agenda separada do IBOV: o manifesto do SMLL não é afetado
+            pages, digests = lf.changed_pages([ibov], tmp, day)
+            lf.write_manifests(tmp, day, digests)
+            self.assertEqual(digests["IBOV"][1], 2)
+            pages, digests = lf.changed_pages([smll], tmp, day)
+            self.assertEqual(pages, [smll])
+            lf.write_manifests(tmp, day, digests)
+
+            self.assertEqual(lf.changed_pages([ibov, smll], tmp, day), ([], {}))
+            changed = {**self._sample_json(), "index": "SMLL"}
+            changed["results"] = changed["results"][:1]
+            pages, digests = lf.changed_pages([ibov, changed], tmp, day)
+            self.assertEqual(pages, [changed])
+            self.assertEqual(list(digests), ["SMLL"])
+
+    def _stream_session(self, payloads):
+        def fake_get(url, **kwargs):
+            self.assertTrue(kwargs.get("stream"))
+            page_number = lf.decode_api_params(url.rsplit('/', 1)[-1])["pageNumber"]
+            response = MagicMock()
+            response.raw = io.BytesIO(json.dumps(payloads[page_number - 1]).encode('utf-8'))
+            response.__enter__.return_value = response
+            return response
+        session = MagicMock()
+        session.get.side_effect = fake_get
+        return session
+
+    def test_iter_portfolio_batches(self):
+        session = self._stream_session([self._sample_json()])
+        meta = {}
+        batches = list(lf.iter_portfolio_batches(self.api_conf, session, batch_size=1, meta=meta))
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(batches[0][2][0]["cod"], "WEGE3")
+        self.assertEqual(meta["header"]["date"], "14/07/25")
+        self.assertEqual(meta["page"]["totalPages"], 1)
+
+    def test_stream_portfolio_to_parquet_replaces_partition(self):
+        first, second = self._sample_json(), self._sample_json()
+        first["page"]["totalPages"] = second["page"]["totalPages"] = 2
+        second["page"]["pageNumber"] = 2
+        session = self._stream_session([first, second])
+        with tempfile.TemporaryDirectory() as tmp:
+            lf.write_table_to_parquet(lf.portfolio_day_to_table(self._sample_json()), tmp)
+            rows = lf.stream_portfolio_to_parquet(self.api_conf, session, tmp, batch_size=1, all_pages=True)
+            partition = f"{tmp}/year=2025/month=7/day=14/index=IBOV"
+            files = os.listdir(partition)
+            written = pq.read_table(partition)
+        self.assertEqual(rows, 4)
+        self.assertEqual(len(files), 1)
+        self.assertEqual(written.num_rows, 4)
+        self.assertEqual(written.column("results_cod").to_pylist(), ["WEGE3", "EMBR3", "WEGE3", "EMBR3"])
+
+    def test_stream_portfolio_to_parquet_removes_partial_file_on_error(self):
+        first, second = self._sample_json(), self._sample_json()
+        first["page"]["totalPages"] = 2
+        second["header"]["date"] = "15/07/25"
+        session = self._stream_session([first, second])
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(ValueError):
+                lf.stream_portfolio_to_parquet(self.api_conf, session, tmp, all_pages=True)
+            self.assertEqual(os.listdir(f"{tmp}/year=2025/month=7/day=14/index=IBOV"), [])
+
     def test_validate_event_success(self):
         valid, msg = lf.validate_event(self.event)
         self.assertTrue(valid)
@@ -126,6 +501,88 @@ class TestLambdaExtractBovespa(unittest.TestCase):
         result = lf.lambda_handler(event, None)
         self.assertEqual(result["statusCode"], 200)
 
+    @patch("lambda_function.requests.Session")
+    @patch("lambda_function.wr.s3.to_parquet")
+    @patch("lambda_function.get_portfolio_all_pages")
+    @patch("lambda_function.portfolio_day_to_df")
+    def test_lambda_handler_all_pages(self, mock_to_df, mock_all_pages, mock_to_parquet, mock_session):
+        event = {**self.event, "all_pages": True}
+        mock_all_pages.return_value = [{}, {}]
+        mock_to_df.side_effect = [
+            pd.DataFrame([{"a": 1, "year": 2024, "month": 1, "day": 1}]),
+            pd.DataFrame([{"a": 2, "year": 2024, "month": 1, "day": 1}])
+        ]
+        result = lf.lambda_handler(event, None)
+        self.assertEqual(result["statusCode"], 200)
+        mock_to_parquet.assert_called_once()
+        self.assertEqual(len(mock_to_parquet.call_args.kwargs["df"]), 2)
+
+    @patch("lambda_function.requests.Session")
+    @patch("lambda_function.write_table_to_parquet")
+    @patch("lambda_function.get_portfolio_day")
+    def test_lambda_handler_columnar(self, mock_get_portfolio, mock_write_table, mock_session):
+        event = {**self.event, "columnar": True}
+        mock_get_portfolio.return_value = self._sample_json()
+        result = lf.lambda_handler(event, None)
+        self.assertEqual(result["statusCode"], 200)
+        mock_write_table.assert_called_once()
+        self.assertEqual(mock_write_table.call_args.args[0].num_rows, 2)
+
+    @patch("lambda_function.requests.Session")
+    @patch("lambda_function.write_pages")
+    @patch("lambda_function.is_unchanged", return_value=True)
+    @patch("lambda_function.get_portfolio_day")
+    def test_lambda_handler_dedup_unchanged(self, mock_get_portfolio, mock_unchanged, mock_write_pages, mock_session):
+        mock_get_portfolio.return_value = self._sample_json()
+        result = lf.lambda_handler({**self.event, "dedup": True}, None)
+        self.assertEqual(result["statusCode"], 304)
+        mock_write_pages.assert_not_called()
+
+    @patch("lambda_function.requests.Session")
+    @patch("lambda_function.write_manifest")
+    @patch("lambda_function.write_pages", return_value=2)
+    @patch("lambda_function.is_unchanged", return_value=False)
+    @patch("lambda_function.get_portfolio_day")
+    def test_lambda_handler_dedup_changed(self, mock_get_portfolio, mock_unchanged, mock_write_pages, mock_write_manifest, mock_session):
+        mock_get_portfolio.return_value = self._sample_json()
+        result = lf.lambda_handler({**self.event, "dedup": True}, None)
+        self.assertEqual(result["statusCode"], 200)
+        mock_write_pages.assert_called_once()
+        mock_write_manifest.assert_called_once()
+
+    @patch("lambda_function.requests.Session")
+    @patch("lambda_function.write_manifest")
+    @patch("lambda_function.write_pages", return_value=2)
+    @patch("lambda_function.is_unchanged", return_value=False)
+    @patch("lambda_function.get_portfolio_all_pages")
+    def test_lambda_handler_dedup_missing_page(self, mock_all_pages, mock_unchanged, mock_write_pages, mock_write_manifest, mock_session):
+        # Uma página sem resposta não pode virar uma partição parcial registrada como completa no manifesto
+        mock_all_pages.return_value = [self._sample_json(), None]
+        result = lf.lambda_handler({**self.event, "dedup": True, "all_pages": True}, None)
+        self.assertEqual(result["statusCode"], 500)
+        mock_write_pages.assert_not_called()
+        mock_write_manifest.assert_not_called()
+
+    @patch("lambda_function.write_pages", return_value=2)
+    @patch("lambda_function.get_portfolio_indices")
+    def test_run_backfill_missing_page_fails_day(self, mock_indices, mock_write_pages):
+        mock_indices.return_value = [self._sample_json(), None]
+        result = lf.run_backfill(self.api_conf, {"dates": ["2025-07-14"]}, MagicMock(), "s3://bucket/prefix/", dedup=True)
+        body = json.loads(result["body"])
+        self.assertEqual([item["status"] for item in body["days"]], ["error"])
+        mock_write_pages.assert_not_called()
+
+    @patch("lambda_function.build_b3_url", side_effect=ValueError("host inválido"))
+    def test_get_portfolio_day_raises(self, mock_url):
+        with self.assertRaises(ValueError):
+            lf.get_portfolio_day(self.api_conf, MagicMock())
+
+    @patch("lambda_function.stream_portfolio_to_parquet", return_value=2)
+    def test_lambda_handler_stream(self, mock_stream):
+        result = lf.lambda_handler({**self.event, "stream": True, "batch_size": 500}, None)
+        self.assertEqual(result["statusCode"], 200)
+        self.assertEqual(mock_stream.call_args.kwargs["batch_size"], 500)
+
     @patch("lambda_function.requests.Session")
     @patch("lambda_function.get_portfolio_day")
     @patch("lambda_function.portfolio_day_to_df")
@@ -150,5 +607,100 @@ class TestLambdaExtractBovespa(unittest.TestCase):
         result = lf.lambda_handler(event, None)
         self.assertEqual(result["statusCode"], 400)
 
+class TestLambdaExtractBovespaStartup(unittest.TestCase):
+    """Imports adiados no cold start e reuso da sessão entre invocações (tempos em tests/benchmark)."""
+    MODULE_DIR = os.path.abspath('src/lambda/lambda-extract-bovespa')
+    # No pacote da Lambda o instrumentation.py fica ao lado do lambda_function.py
+    SHARED_DIR = os.path.abspath('src/shared')
+
+    def _run_python(self, code: str) -> str:
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=self.MODULE_DIR,
+            env={**os.environ, "PYTHONPATH": self.SHARED_DIR}
+        )
+        return result.stdout.strip().splitlines()[-1]
+
+    def test_cold_start_defers_heavy_imports(self):
+        loaded = self._run_python(
+            "import sys, lambda_function; "
+            "print(sorted(m for m in ('pandas', 'awswrangler', 'pyarrow', 'ijson') if m in sys.modules))"
+        )
+        self.assertEqual(loaded, "[]")
+
+    def test_validation_path_does_not_import_heavy_modules(self):
+        loaded = self._run_python(
+            "import sys, lambda_function; lambda_function.lambda_handler({}, None); "
+            "print(any(m in sys.modules for m in ('pandas', 'awswrangler', 'pyarrow')))"
+        )
+        self.assertEqual(loaded, "False")
+
+    @patch("lambda_function.write_pages", return_value=1)
+    @patch("lambda_function.get_portfolio_day", return_value={})
+    @patch("lambda_function.create_session", wraps=lf.create_session)
+    def test_warm_invocation_reuses_session(self, mock_create_session, mock_get_portfolio, mock_write_pages):
+        lf.reset_session()
+        event = {
+            "s3_bucket": "bucket",
+            "s3_prefix": "prefix",
+            "api": {"host": "api.b3.com.br", "route": "portfolio", "parameters": {
+                "language": "pt", "pageNumber": 1, "pageSize": 10, "index": "IBOV", "segment": "ALL"}}
+        }
+        lf.lambda_handler(event, None)
+        lf.lambda_handler(event, None)
+        mock_create_session.assert_called_once()
+        lf.reset_session()
+
+    @patch("lambda_function.get_portfolio_day", side_effect=Exception("fail"))
+    def test_session_reset_after_error(self, mock_get_portfolio):
+        lf.get_session()
+        event = {
+            "s3_bucket": "bucket",
+            "s3_prefix": "prefix",
+            "api": {"host": "api.b3.com.br", "route": "portfolio", "parameters": {
+                "language": "pt", "pageNumber": 1, "pageSize": 10, "index": "IBOV", "segment": "ALL"}}
+        }
+        result = lf.lambda_handler(event, None)
+        self.assertEqual(result["statusCode"], 500)
+        self.assertIsNone(lf._session)
+
+    def test_validate_rate_limit(self):
+        self.assertTrue(lf.validate_rate_limit({"requests_per_second": 5, "burst": None, "max_concurrency": 4})[0])
+        self.assertFalse(lf.validate_rate_limit([])[0])
+        self.assertFalse(lf.validate_rate_limit({"rps": 5})[0])
+        self.assertFalse(lf.validate_rate_limit({"requests_per_second": "5"})[0])
+        self.assertFalse(lf.validate_rate_limit({"max_attempts": 0})[0])
+        self.assertFalse(lf.validate_rate_limit({"min_concurrency": 8, "max_concurrency": 4})[0])
+        event = {
+            "s3_bucket": "bucket",
+            "s3_prefix": "prefix",
+            "rate_limit": {"burst": -1},
+            "api": {"host": "api.b3.com.br", "route": "portfolio", "parameters": {
+                "language": "pt", "pageNumber": 1, "pageSize": 10, "index": "IBOV", "segment": "ALL"}}
+        }
+        self.assertEqual(lf.lambda_handler(event, None)["statusCode"], 400)
+
+    @patch("lambda_function.get_portfolio_day", return_value={})
+    def test_client_state_survives_session_reset(self, mock_get_portfolio):
+        event = {
+            "s3_bucket": "bucket",
+            "s3_prefix": "prefix",
+            "rate_limit": {"requests_per_second": 5},
+            "api": {"host": "api.b3.com.br", "route": "portfolio", "parameters": {
+                "language": "pt", "pageNumber": 1, "pageSize": 10, "index": "IBOV", "segment": "ALL"}}
+        }
+        self.addCleanup(setattr, lf, "_client", None)
+        lf.lambda_handler(event, None)
+        client = mock_get_portfolio.call_args[0][1]
+        self.assertIsInstance(client, lf.b3_client.B3Client)
+        self.assertEqual(client.settings["max_concurrency"], lf.DEFAULT_MAX_WORKERS)
+        client.breaker.state = "open"
+
+        lf.reset_session()
+        session = lf.get_session()
+        self.assertIs(lf.get_client(rate_limit={"requests_per_second": 5}), client)
+        self.assertIs(client.session, session)
+        self.assertEqual(client.breaker.state, "open")
+        self.assertIsNot(lf.get_client(rate_limit={"requests_per_second": 10}), client)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
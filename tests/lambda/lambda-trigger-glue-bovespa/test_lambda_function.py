@@ -1,13 +1,17 @@
 import unittest
 from unittest.mock import patch, MagicMock
 import json
+import io
 
 import sys
+sys.path.append('src/shared')
 sys.path.append('src/lambda/lambda-trigger-glue-bovespa')
 import lambda_function as lf
+import instrumentation
 
 class TestLambdaTriggerGlueBovespa(unittest.TestCase):
     def setUp(self):
+        lf.reset_glue_client()
         self.event = {
             "job_name": "glue-refined-zone-bovespa",
             "job_parameters": {"--JOB_NAME": "glue-refined-zone-bovespa"}
@@ -42,16 +46,303 @@ class TestLambdaTriggerGlueBovespa(unittest.TestCase):
         resp = lf.start_glue_job("job", {"--JOB_NAME": "job"})
         self.assertEqual(resp["statusCode"], 500)
 
+    @patch("lambda_function.boto3.client")
+    def test_glue_client_reused_between_invocations(self, mock_boto):
+        mock_boto.return_value.start_job_run.return_value = {"JobRunId": "123"}
+        lf.start_glue_job("job", {"--JOB_NAME": "job"})
+        lf.start_glue_job("job", {"--JOB_NAME": "job"})
+        mock_boto.assert_called_once_with('glue')
+
+    @patch("lambda_function.boto3.client")
+    def test_glue_client_reset_after_error(self, mock_boto):
+        mock_boto.return_value.start_job_run.side_effect = Exception("fail")
+        resp = lf.start_glue_job("job", {"--JOB_NAME": "job"})
+        self.assertEqual(resp["statusCode"], 500)
+        self.assertIsNone(lf._glue_client)
+
+    @patch("lambda_function.find_active_run", return_value=None)
     @patch("lambda_function.start_glue_job", return_value={"statusCode": 200, "body": "{}"})
-    def test_lambda_handler_success(self, mock_start):
+    def test_lambda_handler_success(self, mock_start, mock_active):
         event = self.event.copy()
         resp = lf.lambda_handler(event, None)
         self.assertEqual(resp["statusCode"], 200)
 
+    def _sqs_event(self, keys, job_name="glue-refined-zone-bovespa"):
+        return {"Records": [
+            {
+                "messageId": f"m{index}",
+                "eventSource": "aws:sqs",
+                "body": json.dumps({
+                    "job_name": job_name,
+                    "job_parameters": {"--JOB_NAME": job_name, "--OBJECT_KEY": key}
+                })
+            }
+            for index, key in enumerate(keys)
+        ]}
+
+    def test_validate_event_on_active_run(self):
+        for policy in ("queue", "attach"):
+            valid, msg = lf.validate_event(dict(self.event, on_active_run=policy))
+            self.assertFalse(valid)
+        self.assertTrue(lf.validate_event(dict(self.event, on_active_run="defer"))[0])
+
+    def test_merge_object_keys(self):
+        self.assertEqual(lf.merge_object_keys(["raw/a.parquet", "raw/a.parquet"]), "raw/a.parquet")
+        self.assertEqual(
+            lf.merge_object_keys([
+                "raw/year=2025/month=7/day=14/a.parquet",
+                "raw/year=2025/month=7/day=14/b.parquet"
+            ]),
+            "raw/year=2025/month=7/day=14/"
+        )
+        self.assertEqual(
+            lf.merge_object_keys([
+                "raw/year=2025/month=7/day=14/a.parquet",
+                "raw/year=2025/month=7/day=15/a.parquet"
+            ]),
+            "raw/year=2025/month=7/"
+        )
+        # Sem diretório em comum o job leria o bucket inteiro
+        with self.assertRaises(ValueError):
+            lf.merge_object_keys(["raw/a.parquet", "outro/a.parquet"])
+
+    def test_coalesce_payloads(self):
+        payloads = [json.loads(record["body"]) for record in self._sqs_event(["raw/a.parquet", "raw/b.parquet"])["Records"]]
+        [(job_name, merged)] = lf.coalesce_payloads(payloads)
+        self.assertEqual(job_name, "glue-refined-zone-bovespa")
+        self.assertEqual(merged["--OBJECT_KEY"], "raw/")
+
+    def test_coalesce_payloads_one_run_per_root(self):
+        payloads = [
+            lf.build_s3_payload("bucket", key, "us-east-1") for key in (
+                "raw-zone/tbl_a/year=2025/month=7/day=14/a.parquet",
+                "outra-zone/tbl_b/year=2025/month=7/day=14/a.parquet",
+                "raw-zone/tbl_a/year=2025/month=7/day=15/a.parquet",
+                "a.parquet"
+            )
+        ]
+        runs = lf.coalesce_payloads(payloads)
+        self.assertEqual(
+            [(parameters["--OBJECT_KEY"], parameters.get("--PARTITIONS")) for _, parameters in runs],
+            [
+                ("raw-zone/tbl_a/year=2025/month=7/", "year=2025/month=7/day=14,year=2025/month=7/day=15"),
+                ("outra-zone/tbl_b/year=2025/month=7/day=14/", "year=2025/month=7/day=14"),
+                ("a.parquet", None)
+            ]
+        )
+
+    @patch("lambda_function.boto3.client")
+    def test_find_active_run(self, mock_boto):
+        mock_boto.return_value.get_job_runs.return_value = {"JobRuns": [
+            {"Id": "jr_2", "JobRunState": "SUCCEEDED"},
+            {"Id": "jr_1", "JobRunState": "RUNNING"}
+        ]}
+        self.assertEqual(lf.find_active_run("job")["Id"], "jr_1")
+        mock_boto.return_value.get_job_runs.return_value = {"JobRuns": [{"Id": "jr_2", "JobRunState": "FAILED"}]}
+        self.assertIsNone(lf.find_active_run("job"))
+
+    @patch("lambda_function.find_active_run", return_value={"Id": "jr_1", "JobRunState": "RUNNING"})
+    @patch("lambda_function.start_glue_job")
+    def test_dispatch_with_active_run(self, mock_start, mock_active):
+        resp = lf.dispatch_glue_job("job", {"--JOB_NAME": "job"}, "defer")
+        self.assertEqual(resp["statusCode"], 409)
+        self.assertEqual(json.loads(resp["body"])["JobRunId"], "jr_1")
+        mock_start.assert_not_called()
+
+    @patch("lambda_function.boto3.client")
+    def test_start_glue_job_concurrent_runs_exceeded(self, mock_boto):
+        from botocore.exceptions import ClientError
+        mock_boto.return_value.start_job_run.side_effect = ClientError(
+            {"Error": {"Code": "ConcurrentRunsExceededException", "Message": "busy"}}, "StartJobRun"
+        )
+        resp = lf.start_glue_job("job", {"--JOB_NAME": "job"})
+        self.assertEqual(resp["statusCode"], 409)
+
+    @patch("lambda_function.find_active_run", return_value=None)
+    @patch("lambda_function.start_glue_job", return_value={"statusCode": 200, "body": "{}"})
+    def test_lambda_handler_records_single_run(self, mock_start, mock_active):
+        event = self._sqs_event([
+            "raw/year=2025/month=7/day=14/a.parquet",
+            "raw/year=2025/month=7/day=14/b.parquet"
+        ])
+        event["Records"].append({"messageId": "bad", "body": "not json"})
+        resp = lf.lambda_handler(event, None)
+        self.assertEqual(resp, {"batchItemFailures": []})
+        mock_start.assert_called_once()
+        self.assertEqual(mock_start.call_args[0][1]["--OBJECT_KEY"], "raw/year=2025/month=7/day=14/")
+
+    @patch("lambda_function.find_active_run", return_value={"Id": "jr_1", "JobRunState": "RUNNING"})
+    def test_lambda_handler_records_deferred(self, mock_active):
+        resp = lf.lambda_handler(self._sqs_event(["raw/a.parquet", "raw/b.parquet"]), None)
+        self.assertEqual(resp["batchItemFailures"], [{"itemIdentifier": "m0"}, {"itemIdentifier": "m1"}])
+
     def test_lambda_handler_invalid(self):
         event = {}
         resp = lf.lambda_handler(event, None)
         self.assertEqual(resp["statusCode"], 400)
 
+    def _s3_record(self, key, event_name="ObjectCreated:Put"):
+        return {
+            "eventSource": "aws:s3",
+            "eventName": event_name,
+            "awsRegion": "us-east-1",
+            "s3": {"bucket": {"name": "fiap-ml-tc-fase2-data"}, "object": {"key": key}}
+        }
+
+    def test_build_s3_payload(self):
+        payload = lf.build_s3_payload("bucket", "raw-zone/year=2025/month=7/day=14/a.parquet", "us-east-1")
+        self.assertEqual(payload["job_name"], lf.GLUE_JOB_NAME)
+        self.assertEqual(payload["job_parameters"]["--OBJECT_KEY"], "raw-zone/year=2025/month=7/day=14/")
+        self.assertEqual(payload["job_parameters"]["--PARTITIONS"], "year=2025/month=7/day=14")
+        self.assertTrue(lf.validate_event(payload)[0])
+        payload = lf.build_s3_payload("bucket", "raw-zone/a.parquet", "us-east-1")
+        self.assertEqual(payload["job_parameters"]["--OBJECT_KEY"], "raw-zone/a.parquet")
+        self.assertNotIn("--PARTITIONS", payload["job_parameters"])
+
+    def test_payloads_from_s3_notification(self):
+        message = {"Records": [
+            self._s3_record("raw-zone/year=2025/month=7/day=14/a+b.parquet"),
+            self._s3_record("raw-zone/year=2025/month=7/day=14/_manifest.json"),
+            self._s3_record("raw-zone/year=2025/month=7/day=13/a.parquet", event_name="ObjectRemoved:Delete")
+        ]}
+        payloads = lf.payloads_from_message(message)
+        self.assertEqual(len(payloads), 1)
+        self.assertEqual(payloads[0]["job_parameters"]["--PARTITIONS"], "year=2025/month=7/day=14")
+
+    def test_payloads_from_eventbridge_event(self):
+        message = {
+            "source": "aws.s3",
+            "detail-type": "Object Created",
+            "region": "us-east-1",
+            "detail": {"bucket": {"name": "bucket"}, "object": {"key": "raw-zone/year=2025/month=7/day=14/a.parquet"}}
+        }
+        payloads = lf.payloads_from_message(message)
+        self.assertEqual(payloads[0]["job_parameters"]["--S3_BUCKET"], "bucket")
+        self.assertEqual(payloads[0]["job_parameters"]["--AWS_REGION"], "us-east-1")
+
+    def test_coalesce_payloads_partitions(self):
+        payloads = [
+            lf.build_s3_payload("bucket", f"raw-zone/year=2025/month=7/day={day}/a.parquet", "us-east-1")
+            for day in (15, 14, 14)
+        ]
+        [(_, merged)] = lf.coalesce_payloads(payloads)
+        self.assertEqual(merged["--PARTITIONS"], "year=2025/month=7/day=14,year=2025/month=7/day=15")
+        self.assertEqual(merged["--OBJECT_KEY"], "raw-zone/year=2025/month=7/")
+        payloads.append(lf.build_s3_payload("bucket", "raw-zone/a.parquet", "us-east-1"))
+        [(_, merged)] = lf.coalesce_payloads(payloads)
+        self.assertNotIn("--PARTITIONS", merged)
+        self.assertEqual(merged["--OBJECT_KEY"], "raw-zone/")
+
+    def test_correlation_id_from_key(self):
+        payload = lf.build_s3_payload("bucket", "raw-zone/year=2025/month=7/day=14/index=IBOV/req-1_ab12-0.snappy.parquet", "us-east-1")
+        self.assertEqual(payload["job_parameters"]["--CORRELATION_ID"], "req-1")
+        payload = lf.build_s3_payload("bucket", "raw-zone/year=2025/month=7/day=14/ab12-0.snappy.parquet", "us-east-1")
+        self.assertNotIn("--CORRELATION_ID", payload["job_parameters"])
+        self.assertIsNone(lf.correlation_id_from_key("raw_zone/year=2025/a.parquet"))
+
+    def test_coalesce_payloads_correlation_ids(self):
+        payloads = [
+            lf.build_s3_payload("bucket", f"raw-zone/year=2025/month=7/day=14/{cid}_ab12-0.snappy.parquet", "us-east-1")
+            for cid in ("req-2", "req-1", "req-2")
+        ]
+        payloads.append(lf.build_s3_payload("bucket", "raw-zone/year=2025/month=7/day=14/ab12-0.snappy.parquet", "us-east-1"))
+        with self.assertNoLogs(level="WARNING"):
+            [(_, merged)] = lf.coalesce_payloads(payloads)
+        self.assertEqual(merged["--CORRELATION_ID"], "req-1,req-2")
+
+    @patch("lambda_function.get_glue_client")
+    def test_stage_metrics_use_extraction_correlation_id(self, mock_get_client):
+        mock_get_client.return_value.get_job_runs.return_value = {"JobRuns": [], "ResponseMetadata": {"RetryAttempts": 0}}
+        mock_get_client.return_value.start_job_run.return_value = {"JobRunId": "jr_1", "ResponseMetadata": {"RetryAttempts": 2}}
+        stream = io.StringIO()
+        with patch.object(lf, "_stage_metrics", instrumentation.StageMetrics("trigger", enabled=True, fmt="json", stream=stream)):
+            resp = lf.lambda_handler({"Records": [
+                self._s3_record("raw-zone/year=2025/month=7/day=14/req-1_ab12-0.snappy.parquet")
+            ]}, None)
+        self.assertEqual(resp["statusCode"], 200)
+        documents = {document["stage"]: document for document in map(json.loads, stream.getvalue().splitlines())}
+        self.assertEqual(set(documents), {"parse", "get_job_runs", "start_job_run"})
+        self.assertEqual(documents["start_job_run"]["retries"], 2)
+        self.assertEqual(documents["parse"]["correlation_id"], "req-1")
+        arguments = mock_get_client.return_value.start_job_run.call_args.kwargs["Arguments"]
+        self.assertEqual(arguments["--CORRELATION_ID"], "req-1")
+
+    @patch("lambda_function.find_active_run", return_value=None)
+    @patch("lambda_function.start_glue_job", return_value={"statusCode": 200, "body": "{}"})
+    def test_lambda_handler_s3_notification(self, mock_start, mock_active):
+        event = {"Records": [
+            self._s3_record("raw-zone/year=2025/month=7/day=14/a.parquet"),
+            self._s3_record("raw-zone/year=2025/month=7/day=14/b.parquet")
+        ]}
+        resp = lf.lambda_handler(event, None)
+        self.assertEqual(resp["statusCode"], 200)
+        mock_start.assert_called_once()
+        self.assertEqual(mock_start.call_args[0][1]["--PARTITIONS"], "year=2025/month=7/day=14")
+
+    @patch("lambda_function.find_active_run", return_value={"Id": "jr_1", "JobRunState": "RUNNING"})
+    @patch("lambda_function.start_glue_job")
+    def test_lambda_handler_s3_notification_deferred_raises(self, mock_start, mock_active):
+        # Invocação direta (assíncrona) sem fila: o erro faz a Lambda retentar o evento
+        event = {
+            "source": "aws.s3", "detail-type": "Object Created", "region": "us-east-1",
+            "detail": {"bucket": {"name": "bucket"}, "object": {"key": "raw-zone/year=2025/month=7/day=14/a.parquet"}}
+        }
+        with self.assertRaises(lf.DispatchError):
+            lf.lambda_handler(event, None)
+        mock_start.assert_not_called()
+
+    @patch("lambda_function.find_active_run", return_value=None)
+    @patch("lambda_function.start_glue_job", return_value={"statusCode": 500, "body": "\"erro\""})
+    def test_lambda_handler_s3_notification_error_raises(self, mock_start, mock_active):
+        with self.assertRaises(lf.DispatchError):
+            lf.lambda_handler({"Records": [self._s3_record("raw-zone/year=2025/month=7/day=14/a.parquet")]}, None)
+
+    @patch("lambda_function.start_glue_job")
+    def test_lambda_handler_s3_notification_ignored(self, mock_start):
+        resp = lf.lambda_handler({"Records": [self._s3_record("raw-zone/_manifest.json")]}, None)
+        self.assertEqual(resp["statusCode"], 200)
+        mock_start.assert_not_called()
+
+    @patch("lambda_function.find_active_run", return_value=None)
+    @patch("lambda_function.start_glue_job", return_value={"statusCode": 200, "body": "{}"})
+    def test_lambda_handler_sqs_with_s3_notifications(self, mock_start, mock_active):
+        event = {"Records": [
+            {"messageId": f"m{day}", "eventSource": "aws:sqs",
+             "body": json.dumps({"Records": [self._s3_record(f"raw-zone/year=2025/month=7/day={day}/a.parquet")]})}
+            for day in (14, 15)
+        ]}
+        resp = lf.lambda_handler(event, None)
+        self.assertEqual(resp, {"batchItemFailures": []})
+        self.assertEqual(mock_start.call_args[0][1]["--PARTITIONS"], "year=2025/month=7/day=14,year=2025/month=7/day=15")
+
+    @patch("lambda_function.find_active_run", return_value={"Id": "jr_1", "JobRunState": "RUNNING"})
+    def test_lambda_handler_sqs_deferred_per_root(self, mock_active):
+        event = {"Records": [
+            {"messageId": "m0", "body": json.dumps({"Records": [
+                self._s3_record("raw-zone/tbl_a/year=2025/month=7/day=14/a.parquet"),
+                self._s3_record("raw-zone/tbl_b/year=2025/month=7/day=14/a.parquet")
+            ]})},
+            {"messageId": "m1", "body": json.dumps({"Records": [self._s3_record("raw-zone/tbl_a/year=2025/month=7/day=15/a.parquet")]})}
+        ]}
+        resp = lf.lambda_handler(event, None)
+        self.assertEqual(resp["batchItemFailures"], [{"itemIdentifier": "m0"}, {"itemIdentifier": "m1"}])
+
+class TestTriggerEventRule(unittest.TestCase):
+    """Regra do EventBridge que entrega os objetos da camada raw à Lambda de disparo."""
+
+    def setUp(self):
+        with open("src/event-bridge/create-event-raw-file-bovespa/create-event-raw-file-bovespa.json", encoding="utf-8") as f:
+            self.resources = json.load(f)["Resources"]
+
+    def test_rule_delivers_to_queue_with_batch_item_failures(self):
+        [rule] = [resource for resource in self.resources.values() if resource["Type"] == "AWS::Events::Rule"]
+        [mapping] = [resource for resource in self.resources.values() if resource["Type"] == "AWS::Lambda::EventSourceMapping"]
+        [target] = rule["Properties"]["Targets"]
+        self.assertEqual(target["Arn"], {"Fn::GetAtt": ["TriggerQueue", "Arn"]})
+        self.assertEqual(mapping["Properties"]["EventSourceArn"], {"Fn::GetAtt": ["TriggerQueue", "Arn"]})
+        self.assertEqual(mapping["Properties"]["FunctionResponseTypes"], ["ReportBatchItemFailures"])
+        queue = self.resources["TriggerQueue"]["Properties"]
+        self.assertEqual(queue["RedrivePolicy"]["deadLetterTargetArn"], {"Fn::GetAtt": ["TriggerDeadLetterQueue", "Arn"]})
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,93 @@
+import unittest
+from unittest.mock import MagicMock
+import io
+import json
+import threading
+
+import sys
+sys.path.append('src/shared')
+import instrumentation
+
+class TestInstrumentation(unittest.TestCase):
+    def test_disabled_is_noop(self):
+        stream = io.StringIO()
+        metrics = instrumentation.StageMetrics("lambda", enabled=False, stream=stream)
+        metrics.start("abc")
+        with metrics.stage("http_fetch") as stage:
+            stage.rows = 10
+        metrics.add("http_fetch", rows=5)
+        self.assertIs(metrics.stage("outra"), metrics.stage("http_fetch"))
+        self.assertEqual(stage.rows, 0)
+        self.assertEqual(metrics.flush(), [])
+        self.assertEqual(stream.getvalue(), "")
+
+    def test_stage_accumulates_across_threads(self):
+        metrics = instrumentation.StageMetrics("lambda", enabled=True, fmt="json", stream=io.StringIO())
+        metrics.start("abc")
+
+        def fetch():
+            with metrics.stage("http_fetch") as stage:
+                stage.rows = 2
+                stage.bytes = 100
+                stage.retries = 1
+
+        threads = [threading.Thread(target=fetch) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with self.assertRaises(ValueError):
+            with metrics.stage("s3_write"):
+                raise ValueError("falha")
+
+        documents = {document["stage"]: document for document in metrics.flush()}
+        self.assertEqual(documents["http_fetch"]["calls"], 8)
+        self.assertEqual(documents["http_fetch"]["rows"], 16)
+        self.assertEqual(documents["http_fetch"]["bytes"], 800)
+        self.assertEqual(documents["http_fetch"]["retries"], 8)
+        self.assertEqual(documents["http_fetch"]["correlation_id"], "abc")
+        self.assertEqual(documents["s3_write"]["calls"], 1)
+        self.assertEqual(metrics.flush(), [])
+
+    def test_emf_document(self):
+        stream = io.StringIO()
+        metrics = instrumentation.StageMetrics("lambda-extract-bovespa", enabled=True, stream=stream)
+        metrics.start("abc")
+        metrics.add("convert", seconds=0.5, rows=3)
+        metrics.flush()
+        document = json.loads(stream.getvalue().splitlines()[0])
+        directive = document["_aws"]["CloudWatchMetrics"][0]
+        self.assertEqual(directive["Namespace"], instrumentation.DEFAULT_NAMESPACE)
+        self.assertEqual(directive["Dimensions"], [["Component", "Stage"]])
+        self.assertEqual({metric["Name"] for metric in directive["Metrics"]}, set(instrumentation.MEASURES))
+        self.assertEqual(document["Component"], "lambda-extract-bovespa")
+        self.assertEqual(document["Stage"], "convert")
+        self.assertEqual(document["CorrelationId"], "abc")
+        self.assertEqual(document["seconds"], 0.5)
+        self.assertEqual(document["rows"], 3)
+
+    def test_from_env(self):
+        metrics = instrumentation.StageMetrics.from_env("lambda", {"STAGE_METRICS": "true", "STAGE_METRICS_FORMAT": "json"})
+        self.assertTrue(metrics.enabled)
+        self.assertEqual(metrics.fmt, "json")
+        self.assertFalse(instrumentation.StageMetrics.from_env("lambda", {}).enabled)
+        with self.assertRaises(ValueError):
+            instrumentation.StageMetrics.from_env("lambda", {"STAGE_METRICS_FORMAT": "xml"})
+
+    def test_correlation_id(self):
+        self.assertTrue(instrumentation.is_valid_correlation_id("c6af9ac6-7b61-11e6-9a41-93e8deadbeef"))
+        self.assertFalse(instrumentation.is_valid_correlation_id("a_b"))
+        self.assertFalse(instrumentation.is_valid_correlation_id(MagicMock()))
+        self.assertEqual(instrumentation.resolve_correlation_id(None, MagicMock(), "req-1"), "req-1")
+        self.assertTrue(instrumentation.is_valid_correlation_id(instrumentation.resolve_correlation_id(None)))
+
+    def test_retries(self):
+        response = MagicMock()
+        response.raw.retries.history = [object(), object()]
+        self.assertEqual(instrumentation.http_retries(response), 2)
+        self.assertEqual(instrumentation.http_retries(object()), 0)
+        self.assertEqual(instrumentation.boto_retries({"ResponseMetadata": {"RetryAttempts": 3}}), 3)
+        self.assertEqual(instrumentation.boto_retries({}), 0)
+
+if __name__ == "__main__":
+    unittest.main()